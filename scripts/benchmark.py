@@ -0,0 +1,235 @@
+"""Load test of the dapp-0-django icauth api.
+
+Virtual users run concurrently, each in a loop of:
+(-) create a session password in canister_motoko (not timed, like the dApp does)
+(-) POST /api/v1/icauth/login
+(-) GET  /api/v1/icauth/health, HEALTH_PER_LOGIN times
+(-) POST /api/v1/icauth/logout
+
+The requests of all virtual users together are paced to a target rate.
+Reports throughput & p50/p95/p99/max latency per endpoint, and saves it as JSON.
+
+The django server must use an IC replica that the benchmark can reach as well, eg.
+the stand-in started with `make run-ic-standin`. Without IC_NETWORK_URL, the virtual
+users only call the health endpoint.
+
+Usage:
+    python -m scripts.benchmark --users 50 --rate 200 --duration 30 --output out.json
+"""
+# pylint: disable=invalid-name
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+from ic.agent import Agent  # type: ignore
+from ic.canister import Canister  # type: ignore
+from ic.client import Client  # type: ignore
+from ic.identity import Identity  # type: ignore
+
+CANDID_FILE = Path(__file__).resolve().parent.parent / "src/candid/canister_motoko.did"
+
+HEALTH = "GET /health"
+LOGIN = "POST /login"
+LOGOUT = "POST /logout"
+
+
+class Pacer:  # pylint: disable=too-few-public-methods
+    """Spaces out the requests of all virtual users to a target rate per second"""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = time.perf_counter()
+
+    async def wait(self) -> None:
+        """Waits for the next free slot"""
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Stats:
+    """Latencies & errors per endpoint"""
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def add(self, endpoint: str, latency: float, ok: bool) -> None:
+        """Records one request"""
+        if ok:
+            self.latencies[endpoint].append(latency)
+        else:
+            self.errors[endpoint] += 1
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        """Returns throughput & latency percentiles in milliseconds, per endpoint"""
+        result = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            ordered = sorted(self.latencies[endpoint])
+            summary: dict[str, Any] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "throughput_rps": len(ordered) / elapsed,
+            }
+            if ordered:
+
+                def percentile(p: float, values: list[float] = ordered) -> float:
+                    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+                summary.update(
+                    {
+                        "p50_ms": percentile(50) * 1000,
+                        "p95_ms": percentile(95) * 1000,
+                        "p99_ms": percentile(99) * 1000,
+                        "max_ms": ordered[-1] * 1000,
+                    }
+                )
+            result[endpoint] = summary
+        return result
+
+
+def create_session_password(ic_network_url: str, canister_id: str) -> tuple[str, str]:
+    """Logs a new identity into canister_motoko. Returns its principal & password."""
+    identity = Identity()
+    canister = Canister(
+        agent=Agent(identity, Client(url=ic_network_url)),
+        canister_id=canister_id,
+        candid=CANDID_FILE.read_text(encoding="utf-8"),
+    )
+    response = canister.session_password_create()  # pylint: disable=no-member
+    return identity.sender().to_str(), response[0]["ok"]
+
+
+async def timed_request(
+    session: aiohttp.ClientSession,
+    stats: Stats,
+    pacer: Pacer,
+    endpoint: str,
+    url: str,
+    *,
+    body: Optional[dict[str, str]] = None,
+) -> None:
+    """Makes one paced request & records its latency"""
+    await pacer.wait()
+    method = endpoint.split()[0]
+    t0 = time.perf_counter()
+    try:
+        async with session.request(method, url, json=body) as response:
+            await response.read()
+            ok = response.status == 200
+    except aiohttp.ClientError:
+        ok = False
+    stats.add(endpoint, time.perf_counter() - t0, ok)
+
+
+async def virtual_user(
+    args: argparse.Namespace, stats: Stats, pacer: Pacer, deadline: float
+) -> None:
+    """Runs the login/health/logout loop of one user until the deadline"""
+    api_url = f"{args.url}/api/v1/icauth"
+    loop = asyncio.get_running_loop()
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if args.ic_network_url:
+                principal, password = await loop.run_in_executor(
+                    None, create_session_password, args.ic_network_url, args.canister_id
+                )
+                await timed_request(
+                    session,
+                    stats,
+                    pacer,
+                    LOGIN,
+                    f"{api_url}/login",
+                    body={"principal": principal, "session_password": password},
+                )
+            for _ in range(args.health_per_login):
+                await timed_request(session, stats, pacer, HEALTH, f"{api_url}/health")
+            if args.ic_network_url:
+                await timed_request(session, stats, pacer, LOGOUT, f"{api_url}/logout")
+            session.cookie_jar.clear()
+
+
+def git_commit() -> Optional[str]:
+    """Returns the current git commit, to compare runs between commits"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Runs the virtual users & returns the results"""
+    stats = Stats()
+    pacer = Pacer(args.rate)
+    t0 = time.perf_counter()
+    deadline = t0 + args.duration
+    await asyncio.gather(
+        *(virtual_user(args, stats, pacer, deadline) for _ in range(args.users))
+    )
+    elapsed = time.perf_counter() - t0
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "url": args.url,
+        "users": args.users,
+        "target_rate_rps": args.rate,
+        "duration_s": elapsed,
+        "endpoints": stats.summary(elapsed),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments, with defaults from environment variables"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument(
+        "--url",
+        default=os.environ.get("DJANGO_SERVER_URL", "http://localhost:8001"),
+    )
+    parser.add_argument("--ic-network-url", default=os.environ.get("IC_NETWORK_URL"))
+    parser.add_argument(
+        "--canister-id",
+        default=os.environ.get("CANISTER_MOTOKO_ID", "rno2w-sqaaa-aaaaa-aaacq-cai"),
+    )
+    parser.add_argument("--users", type=int, default=10, help="Virtual users")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="Target requests/s, 0 for no limit"
+    )
+    parser.add_argument("--duration", type=float, default=10, help="Seconds")
+    parser.add_argument("--health-per-login", type=int, default=5)
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+    if args.ic_network_url:
+        args.ic_network_url = args.ic_network_url.rstrip("/")
+    return args
+
+
+def main() -> None:
+    """Runs the benchmark"""
+    args = parse_args()
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
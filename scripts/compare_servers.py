@@ -0,0 +1,218 @@
+"""Load test of the production servers, with the same number of workers:
+(-) gunicorn: gunicorn with uvicorn workers, as in the Makefile
+(-) run_uvicorn: src/run_uvicorn.py
+(-) run_uvicorn_preload: src/run_uvicorn.py --preload
+
+For every server, in turn:
+(-) starts it, and times its startup until GET /ready returns 200
+(-) runs scripts.benchmark against it. With --hup-at, sends SIGHUP to the master
+    during the run, so the errors include those of a reload of the workers.
+(-) measures the memory of the master & its workers, as the sum of their PSS
+(-) stops it with SIGTERM, and times the stop
+
+The servers use the database & settings of src/.env, and IC_NETWORK_URL, eg. the
+stand-in started with `make run-ic-standin`. Saves the results as JSON.
+
+Usage:
+    python -m scripts.compare_servers --workers 4 --duration 20 --hup-at 10
+"""
+# pylint: disable=invalid-name
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Coroutine, Optional
+
+import aiohttp
+
+from scripts.benchmark import git_commit
+from scripts.benchmark import run as run_benchmark
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+
+def server_commands(args: argparse.Namespace) -> dict[str, list[str]]:
+    """The command line of every server"""
+    run_uvicorn = [
+        sys.executable,
+        "run_uvicorn.py",
+        f"--host={args.host}",
+        f"--port={args.port}",
+        f"--workers={args.workers}",
+    ]
+    return {
+        "gunicorn": [
+            "gunicorn",
+            f"--bind={args.host}:{args.port}",
+            "--worker-tmp-dir=/dev/shm",
+            f"--workers={args.workers}",
+            "--worker-class=uvicorn.workers.UvicornWorker",
+            "project.asgi:application",
+        ],
+        "run_uvicorn": run_uvicorn,
+        "run_uvicorn_preload": [*run_uvicorn, "--preload"],
+    }
+
+
+def process_tree(pid: int) -> list[int]:
+    """Returns the pid & the pids of all descendants of a process"""
+    children: dict[int, list[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            # pid (comm) state ppid ..., where comm may contain spaces
+            fields = stat.read_text(encoding="utf-8").rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    pids = [pid]
+    for parent in pids:
+        pids.extend(children.get(parent, []))
+    return pids
+
+
+def pss_mb(pid: int) -> Optional[float]:
+    """Returns the proportional set size of a process tree, in MB, if available"""
+    total_kb = 0
+    for tree_pid in process_tree(pid):
+        try:
+            rollup = Path(f"/proc/{tree_pid}/smaps_rollup").read_text(encoding="utf-8")
+        except OSError:
+            return None
+        for line in rollup.splitlines():
+            if line.startswith("Pss:"):
+                total_kb += int(line.split()[1])
+    return total_kb / 1024
+
+
+async def wait_ready(url: str, timeout: float) -> float:
+    """Polls GET /ready until it returns 200, and returns the seconds it took"""
+    t0 = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                async with session.get(f"{url}/ready") as response:
+                    if response.status == 200:
+                        return time.perf_counter() - t0
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.05)
+    raise TimeoutError(f"{url}/ready: not ready after {timeout}s")
+
+
+async def reload_at(process: "subprocess.Popen[bytes]", delay: float) -> None:
+    """Sends SIGHUP to the master after delay seconds"""
+    await asyncio.sleep(delay)
+    process.send_signal(signal.SIGHUP)
+
+
+async def compare(args: argparse.Namespace, name: str, command: list[str]) -> Any:
+    """Starts a server, load tests it, stops it & returns the results"""
+    url = f"http://{args.host}:{args.port}"
+    t0 = time.perf_counter()
+    with subprocess.Popen(
+        command,
+        cwd=SRC_DIR,
+        env={**os.environ, "DJANGO_SETTINGS_MODULE": "project.settings"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ) as process:
+        try:
+            ready_s = await wait_ready(url, args.ready_timeout)
+            print(f"{name}: ready in {ready_s:.2f}s", file=sys.stderr)
+            benchmark_args = argparse.Namespace(
+                url=url,
+                ic_network_url=args.ic_network_url,
+                canister_id=args.canister_id,
+                users=args.users,
+                rate=args.rate,
+                duration=args.duration,
+                health_per_login=args.health_per_login,
+            )
+            tasks: list[Coroutine[Any, Any, Any]] = [run_benchmark(benchmark_args)]
+            if args.hup_at:
+                tasks.append(reload_at(process, args.hup_at))
+            results = (await asyncio.gather(*tasks))[0]
+            memory = pss_mb(process.pid)
+        finally:
+            t1 = time.perf_counter()
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+            stop_s = time.perf_counter() - t1
+    return {
+        "command": " ".join(command),
+        "ready_s": ready_s,
+        "stop_s": stop_s,
+        "total_s": time.perf_counter() - t0,
+        "pss_mb": memory,
+        "endpoints": results["endpoints"],
+    }
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Runs the servers one after the other & returns the results"""
+    commands = server_commands(args)
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "users": args.users,
+        "target_rate_rps": args.rate,
+        "duration_s": args.duration,
+        "hup_at_s": args.hup_at,
+        "servers": {
+            name: await compare(args, name, commands[name]) for name in args.servers
+        },
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments, with defaults from environment variables"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--servers", nargs="+", default=["gunicorn", "run_uvicorn"])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--ic-network-url", default=os.environ.get("IC_NETWORK_URL"))
+    parser.add_argument(
+        "--canister-id",
+        default=os.environ.get("CANISTER_MOTOKO_ID", "rno2w-sqaaa-aaaaa-aaacq-cai"),
+    )
+    parser.add_argument("--users", type=int, default=20, help="Virtual users")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="Target requests/s, 0 for no limit"
+    )
+    parser.add_argument("--duration", type=float, default=20, help="Seconds")
+    parser.add_argument("--health-per-login", type=int, default=5)
+    parser.add_argument(
+        "--hup-at", type=float, default=0, help="Seconds into the run to reload, 0: no"
+    )
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    args = parser.parse_args()
+    unknown = set(args.servers) - set(server_commands(args))
+    if unknown:
+        parser.error(f"unknown servers: {', '.join(sorted(unknown))}")
+    if args.ic_network_url:
+        args.ic_network_url = args.ic_network_url.rstrip("/")
+    return args
+
+
+def main() -> None:
+    """Runs the comparison"""
+    args = parse_args()
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
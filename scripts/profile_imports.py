@@ -0,0 +1,210 @@
+"""Import time profile of a dapp-0-django worker, and its cold-start latency.
+
+Every run starts a fresh python process, like a new gunicorn worker, and times:
+(-) the import of project.asgi, as a worker does at boot
+(-) the lifespan startup, that warms the worker up (skipped with --no-warm-up)
+(-) the first request to GET /api/v1/icauth/health, and a second one
+(-) the first build of the canister_motoko client, as on the first login
+
+One more run with `python -X importtime` lists the modules that take the longest to
+import. Reports the median, min & max of every step, and saves it as JSON.
+
+The database & IC_IDENTITY_PEM_ENCODED of src/.env are used, as by a worker.
+
+Usage:
+    python -m scripts.profile_imports --runs 5 --output bench_imports.json
+    python -m scripts.profile_imports --runs 5 --no-warm-up
+"""
+# pylint: disable=invalid-name,import-outside-toplevel
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# The steps timed in every run, in seconds
+STEPS = (
+    "process",
+    "import",
+    "warm_up",
+    "first_request",
+    "second_request",
+    "canister_client",
+)
+
+
+async def request(application: Any, path: str) -> int:
+    """Sends a GET request to the ASGI application & returns the status code"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    messages: list[dict[str, Any]] = []
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict[str, Any]) -> None:
+        messages.append(message)
+
+    await application(scope, receive, send)
+    status: int = messages[0]["status"]
+    return status
+
+
+async def worker_steps(application: Any, warm_up: bool) -> dict[str, float]:
+    """Times the steps of a worker after the import, on one event loop as a worker"""
+    timings = {"warm_up": 0.0}
+    if warm_up:
+        t0 = time.perf_counter()
+        await application.startup()
+        timings["warm_up"] = time.perf_counter() - t0
+
+    for step in ("first_request", "second_request"):
+        t0 = time.perf_counter()
+        status = await request(application, "/api/v1/icauth/health")
+        timings[step] = time.perf_counter() - t0
+        if status != 200:
+            raise SystemExit(f"GET /api/v1/icauth/health: {status}")
+
+    from api_v1_icauth.canister_motoko import get_canister_motoko
+
+    t0 = time.perf_counter()
+    get_canister_motoko()
+    timings["canister_client"] = time.perf_counter() - t0
+    return timings
+
+
+def child(warm_up: bool) -> None:
+    """Times the steps of a worker in this fresh process & prints them as JSON"""
+    t0 = time.perf_counter()
+    from project.asgi import application
+
+    timings = {"import": time.perf_counter() - t0}
+    timings.update(asyncio.run(worker_steps(application, warm_up)))
+    print(json.dumps(timings))
+
+
+def run_child(*options: str, warm_up: bool = True) -> subprocess.CompletedProcess[str]:
+    """Runs child() in a fresh python process"""
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(SRC_DIR),
+        "DJANGO_SETTINGS_MODULE": "project.settings",
+    }
+    return subprocess.run(
+        [
+            sys.executable,
+            *options,
+            "-m",
+            "scripts.profile_imports",
+            "--child",
+            *([] if warm_up else ["--no-warm-up"]),
+        ],
+        capture_output=True,
+        check=True,
+        cwd=SRC_DIR.parent,
+        env=env,
+        text=True,
+    )
+
+
+def slowest_imports(importtime: str, top: int) -> list[dict[str, Any]]:
+    """Returns the modules with the longest self & cumulative import times"""
+    modules: list[dict[str, Any]] = []
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        modules.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    modules.sort(key=lambda module: module["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Runs the fresh processes & returns the results"""
+    # Not imported by the child processes, whose imports are profiled
+    from scripts.benchmark import git_commit
+
+    samples: dict[str, list[float]] = {step: [] for step in STEPS}
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        timings = json.loads(run_child(warm_up=args.warm_up).stdout.splitlines()[-1])
+        timings["process"] = time.perf_counter() - t0
+        for step in STEPS:
+            samples[step].append(timings[step])
+
+    profiled = run_child("-X", "importtime", warm_up=args.warm_up)
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "runs": args.runs,
+        "warm_up": args.warm_up,
+        "steps_ms": {
+            step: {
+                "median": statistics.median(values) * 1000,
+                "min": min(values) * 1000,
+                "max": max(values) * 1000,
+            }
+            for step, values in samples.items()
+        },
+        "slowest_imports": slowest_imports(profiled.stderr, args.top),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes")
+    parser.add_argument("--top", type=int, default=25, help="Slowest imports listed")
+    parser.add_argument("--output", help="Save the results as JSON to this file")
+    parser.add_argument(
+        "--no-warm-up",
+        dest="warm_up",
+        action="store_false",
+        help="Skip the lifespan startup, as a server without lifespan events",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Runs the profile"""
+    args = parse_args()
+    if args.child:
+        child(args.warm_up)
+        return
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
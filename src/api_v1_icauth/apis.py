@@ -1,86 +1,113 @@
 """Business logic of the apis"""
 
-import time
-import jwt
-from django.http import HttpRequest
+import logging
+import uuid
+from typing import Any
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib import auth
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
 
 from ninja.errors import HttpError
 
-from . import schemas
+from . import principal_sessions, refresh_tokens, revocation, schemas, single_flight
 
-from .canister_motoko import canister_motoko
+from .async_auth import acycle_login_key, aget_user, alogin, alogout
+from .backends import PrincipalBackend, aget_or_create_user
+from .canister_motoko import CanisterError, canister_motoko_async
+from .credentials import verified_credentials
+from .tokens import create_jwt, get_bearer_token, get_jwks, verify_jwt
 
+logger = logging.getLogger(__name__)
 
-# We can not use async, because the auth app is not async aware
-def login(request: HttpRequest, body: schemas.BodyLoginSchema) -> dict[str, str]:
+PRINCIPAL_BACKEND = "api_v1_icauth.backends.PrincipalBackend"
+principal_backend = PrincipalBackend()
+
+# The family of the refresh tokens of a login, stored in its django session
+REFRESH_FAMILY_SESSION_KEY = "refresh_family"
+
+
+# The ic canister is called on the event loop with the asyncio client, and the
+# session & user with the async ORM, through async_auth & PrincipalBackend.
+async def login(request: HttpRequest, body: schemas.BodyLoginSchema) -> dict[str, str]:
     """Authenticates with PrincipalBackend and logs into a django cookie based session.
 
-    Returns a JSON containing a JWT token for non-django services:
+    Returns a JSON containing a short-lived JWT token for non-django services, and
+    a refresh token to renew it with:
 
-    {"jwt": "--jwt token--"}
+    {"jwt": "--jwt token--", "refresh": "--refresh token--"}
     """
     # https://docs.djangoproject.com/en/4.0/topics/auth/default/#how-to-log-a-user-in-1
-
-    # We authenticate using the IC canister & create the user if not exists
-    user = auth.authenticate(
-        request, username=body.principal, password=body.session_password
-    )
-
-    if user is None:
+    #
+    # A login makes 1 canister call: save_django_session_key checks the session
+    # password, and saves the django session_key with it, for cleanup purposes. So
+    # the session is moved to its new key first, and the user is only logged in
+    # once the canister saved it: a session the canister did not save could never
+    # be purged from it. A rejected session password returns 400, a failed canister
+    # call 503.
+    replaced_key = request.session.session_key
+    await acycle_login_key(request, body.principal)
+    session_key: str = request.session.session_key  # type: ignore[assignment]
+    if replaced_key and replaced_key != session_key:
+        # Moved to a new key, or flushed
+        await principal_sessions.aremove(replaced_key)
+
+    if not await principal_backend.asave_session_key(
+        session_key, body.principal, body.session_password
+    ):
         raise HttpError(400, "Unauthorized")
 
-    # The user is now authenticated, but to avoid having to re-authenticate, also
-    # log the user in, which persists it into a django session.
-    print("DEBUG: apis.py - login - 01")
-    auth.login(request, user)
-    print("DEBUG: apis.py - login - 02")
-
-    # Store the django session_key in the IC canister, for cleanup purposes
-    # We call authenticate again, but only to store the django session_key in the
-    # IC canister for cleanup purposes
-    user = auth.authenticate(
-        request, username=body.principal, password=body.session_password
-    )
-    print("DEBUG: apis.py - login - 03")
+    # The user is now authenticated: create it if not exists, and log it in, which
+    # persists it into the django session, to avoid having to re-authenticate.
+    user = await aget_or_create_user(body.principal)
+    await alogin(request, user, backend=PRINCIPAL_BACKEND, cycle_key=False)
+
+    # Index the session of the principal, for a logout everywhere
+    await principal_sessions.aadd(body.principal, request.session)
 
     # In addition to the django session approach, we also return a JWT token
-    response_dict = {"jwt": create_jwt(body.principal)}
-    print("DEBUG: apis.py - login - 04")
-    print(f"response_dict: {response_dict}")
-
-    return response_dict
-
-
-def create_jwt(principal: str) -> str:
-    """Creates a jwt for the logged in user."""
-    # jwt_header = {"alg": "HS256", "typ": "JWT"} will be inserted by jwt.encode
-    jwt_payload = {
-        "iss": "web3r.chat",
-        "exp": time.time() + settings.SESSION_COOKIE_AGE,
-        "sub": principal,
-    }
-    return jwt.encode(
-        jwt_payload,
-        settings.SECRET_JWT_KEY,
-        algorithm=settings.JWT_METHOD,
-        headers=None,
-        json_encoder=None,
-    )
+    refresh_token, family = await refresh_tokens.aissue(body.principal)
+    request.session[REFRESH_FAMILY_SESSION_KEY] = str(family)
+    return {"jwt": create_jwt(body.principal), "refresh": refresh_token}
+
+
+async def refresh(
+    request: HttpRequest, body: schemas.BodyRefreshSchema
+) -> dict[str, str]:
+    """Renews the JWT token with a refresh token, without calling the ic canister.
+
+    The refresh token is used up. Returns a new JWT token & the next refresh token:
 
+    {"jwt": "--jwt token--", "refresh": "--refresh token--"}
+    """
+    rotated = await sync_to_async(refresh_tokens.rotate)(body.refresh)
+    if rotated is None:
+        raise HttpError(401, "Unauthorized")
+
+    principal, next_refresh = rotated
+    return {"jwt": create_jwt(principal), "refresh": next_refresh}
 
-# We can not use async, because the auth app is not async aware
-def logout(request: HttpRequest) -> dict[str, str]:
+
+async def logout(request: HttpRequest) -> dict[str, str]:
     """Logout the user."""
     # https://docs.djangoproject.com/en/4.0/topics/auth/default/#how-to-log-a-user-out
 
-    # Remove the session password from the ic canister
-    if request.user.is_authenticated and request.session.session_key:
-        canister_motoko.session_password_delete(  # pylint: disable=no-member
-            request.session.session_key
-        )
+    user = await aget_user(request)
+
+    # Remove the session password from the ic canister. When the canister is not
+    # available, the user is still logged out & the session password expires.
+    if user.is_authenticated and request.session.session_key:
+        verified_credentials.invalidate(user.get_username())
+        await single_flight.arelease_principal(user.get_username())
+        await principal_sessions.aremove(request.session.session_key)
+        try:
+            await canister_motoko_async.session_password_delete(
+                request.session.session_key, principal=user.get_username()
+            )
+        except CanisterError:
+            logger.warning("IC session_password_delete failed", exc_info=True)
     else:
         # TODO:
         # Read about SESSION_COOKIE_SAMESITE
@@ -94,10 +121,56 @@ def logout(request: HttpRequest) -> dict[str, str]:
         # Thread careful though, because setting SESSION_COOKIE_SAMESITE to another
         # value might break CORS again in prod deployment...
         #
-        print("logout: TODO - WE STILL NEED TO GET SESSION COOKIES TO STICK...")
-        print("logout: We currently do NOT clean up the JWT data in the canister...")
+        logger.debug("logout without session cookie, session password not deleted")
+
+    # Revoke the JWT of the request, in all workers
+    token = get_bearer_token(request)
+    claims = verify_jwt(token) if token else None
+    if claims and "jti" in claims:
+        await revocation.arevoke(claims["jti"], claims["exp"])
+
+    # Revoke the refresh tokens of this login
+    family = await request.session.aget(  # type: ignore[attr-defined]
+        REFRESH_FAMILY_SESSION_KEY
+    )
+    if family:
+        await refresh_tokens.arevoke_family(uuid.UUID(family))
 
     # Clean out the django session data.
-    auth.logout(request)
+    await alogout(request)
 
     return {"status": "logged out"}
+
+
+async def logout_everywhere(request: HttpRequest) -> dict[str, Any]:
+    """Logout the authenticated principal from all its sessions & tokens.
+
+    Returns the number of ended sessions, of deleted session passwords, and of the
+    failed canister calls. A session password whose call failed expires.
+    """
+    principal = request.auth.get_username()  # type: ignore[attr-defined]
+    counts = await principal_sessions.alogout_everywhere(principal)
+    logger.info("Logged out everywhere", extra={"principal": principal, **counts})
+
+    # The session of this request is gone, drop its cookie
+    await alogout(request)
+
+    return {"status": "logged out everywhere", **counts}
+
+
+def jwks(request: HttpRequest) -> HttpResponse:
+    """Returns the public keys that sign the JWTs, as a JSON Web Key Set.
+
+    Clients may cache it for JWT_JWKS_MAX_AGE seconds, and revalidate with the ETag.
+    """
+    body, etag = get_jwks()
+    response: HttpResponse
+    if etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(  # pylint: disable=http-response-with-content-type-json
+            body, content_type="application/json"
+        )
+    response["ETag"] = etag
+    patch_cache_control(response, public=True, max_age=settings.JWT_JWKS_MAX_AGE)
+    return response
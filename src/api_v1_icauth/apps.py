@@ -1,5 +1,6 @@
 """Apps"""
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
 
 
 class ApiV1Icauth(AppConfig):
@@ -7,3 +8,13 @@ class ApiV1Icauth(AppConfig):
 
     default_auto_field = "django.db.models.BigAutoField"
     name = "api_v1_icauth"
+
+    def ready(self) -> None:
+        # Connects the signals that invalidate the user cache
+        from . import users  # pylint: disable=import-outside-toplevel
+
+        # This app is ready before django.contrib.auth, which then does not connect
+        # its own receiver under the same dispatch_uid
+        user_logged_in.connect(
+            users.update_last_login, dispatch_uid="update_last_login"
+        )
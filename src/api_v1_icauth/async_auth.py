@@ -0,0 +1,144 @@
+"""Async versions of auth.login, auth.logout & auth.get_user.
+
+Django 4.2 has none, and its auth functions use the sync session & ORM, so an async
+view has to run them in a thread. These use the async API of the project.sessions
+SessionStore, and of PrincipalBackend, like alogin, alogout & aget_user of Django 5.
+They need a SESSION_ENGINE with the async session methods.
+"""
+
+from typing import Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    get_user_model,
+    load_backend,
+)
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.http import HttpRequest
+from django.middleware.csrf import rotate_token
+from django.utils.crypto import constant_time_compare
+
+from .users import aupdate_last_login
+
+UserModel = get_user_model()
+
+
+def user_pk(value: Any) -> Any:
+    """Returns the primary key of a user, from its value in the session"""
+    pk_field: Any = UserModel._meta.pk  # pylint: disable=protected-access
+    return pk_field.to_python(value)
+
+
+async def aget_user(request: HttpRequest) -> Any:
+    """Returns the user of the session, or an AnonymousUser. Sets request.user."""
+    session: Any = request.session
+    user: Optional[Any] = None
+    user_id = await session.aget(SESSION_KEY)
+    backend_path = await session.aget(BACKEND_SESSION_KEY)
+    if user_id is not None and backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        user_id = user_pk(user_id)
+        if hasattr(backend, "aget_user"):
+            user = await backend.aget_user(user_id)
+        else:
+            user = await sync_to_async(backend.get_user)(user_id)
+        if user is not None and not await averify_session(request, user):
+            user = None
+
+    user = user or AnonymousUser()
+    request.user = user
+    return user
+
+
+async def averify_session(request: HttpRequest, user: Any) -> bool:
+    """Returns True if the session auth hash matches the user, as in auth.get_user.
+
+    A session signed with a fallback secret key is moved to a new session key,
+    a session that does not match is flushed.
+    """
+    if not hasattr(user, "get_session_auth_hash"):
+        return True
+    session: Any = request.session
+    session_hash = await session.aget(HASH_SESSION_KEY)
+    session_auth_hash = user.get_session_auth_hash()
+    if session_hash and constant_time_compare(session_hash, session_auth_hash):
+        return True
+    if session_hash and any(
+        constant_time_compare(session_hash, fallback_auth_hash)
+        for fallback_auth_hash in user.get_session_auth_fallback_hash()
+    ):
+        await session.acycle_key()
+        session[HASH_SESSION_KEY] = session_auth_hash
+        return True
+    await session.aflush()
+    return False
+
+
+async def acycle_login_key(request: HttpRequest, username: str) -> None:
+    """Moves the session to the key it gets at a login of username, as in alogin:
+    the session of another user is flushed, and an anonymous session moves to a
+    new key with its data. The session of the same user keeps its key.
+
+    The new key is saved, so it exists before the user is authenticated, eg. to be
+    sent to the ic canister with the credentials. alogin(..., cycle_key=False) then
+    keeps it.
+    """
+    session: Any = request.session
+    user = await aget_user(request)
+    if user.is_authenticated and user.get_username() == username:
+        return
+    if await session.ahas_key(SESSION_KEY):
+        await session.aflush()
+    await session.acycle_key()
+
+
+async def alogin(
+    request: HttpRequest, user: Any, backend: str, cycle_key: bool = True
+) -> None:
+    """Persists the user id & backend in the session, as auth.login.
+
+    The session is saved by SessionMiddleware. last_login is updated here, and the
+    user_logged_in signal is sent with last_login_updated=True. Without cycle_key,
+    an anonymous session keeps its key, moved by acycle_login_key.
+    """
+    session: Any = request.session
+    session_auth_hash = ""
+    if hasattr(user, "get_session_auth_hash"):
+        session_auth_hash = user.get_session_auth_hash()
+
+    if await session.ahas_key(SESSION_KEY):
+        if user_pk(await session.aget(SESSION_KEY)) != user.pk or (
+            session_auth_hash
+            and not constant_time_compare(
+                await session.aget(HASH_SESSION_KEY, ""), session_auth_hash
+            )
+        ):
+            # Do not reuse the session of another user
+            await session.aflush()
+    elif cycle_key:
+        await session.acycle_key()
+
+    session[SESSION_KEY] = user._meta.pk.value_to_string(user)
+    session[BACKEND_SESSION_KEY] = backend
+    session[HASH_SESSION_KEY] = session_auth_hash
+    request.user = user
+    rotate_token(request)
+    await aupdate_last_login(user)
+    user_logged_in.send(
+        sender=user.__class__, request=request, user=user, last_login_updated=True
+    )
+
+
+async def alogout(request: HttpRequest) -> None:
+    """Flushes the session, as auth.logout"""
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        user = None
+    user_logged_out.send(sender=user.__class__, request=request, user=user)
+    await request.session.aflush()  # type: ignore[attr-defined]
+    request.user = AnonymousUser()
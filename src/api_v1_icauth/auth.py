@@ -0,0 +1,53 @@
+"""django-ninja auth classes of the apis
+
+(-) JWTAuth: the `Authorization: Bearer` JWT returned by /login, without db access
+(-) SessionAuth: the django session cookie, usable by async operations, with the
+                csrf check of django for the unsafe methods
+"""
+
+from typing import Any, Optional
+
+from django.http import HttpRequest
+from ninja.security import HttpBearer
+from ninja.utils import check_csrf
+
+from .async_auth import aget_user
+from .tokens import TokenUser, verify_jwt
+
+
+class JWTAuth(HttpBearer):  # pylint: disable=too-few-public-methods
+    """Authenticates with the JWT alone. Sets request.user to a TokenUser."""
+
+    def authenticate(self, request: HttpRequest, token: str) -> Optional[TokenUser]:
+        # Already verified by JWTAuthenticationMiddleware
+        user = getattr(request, "user", None)
+        if isinstance(user, TokenUser):
+            return user
+
+        claims = verify_jwt(token)
+        if claims is None:
+            return None
+        user = TokenUser(claims)
+        request.user = user  # type: ignore[assignment]
+        return user
+
+
+class SessionAuth:  # pylint: disable=too-few-public-methods
+    """Authenticates with the django session cookie.
+
+    ninja's SessionAuth reads request.user on the event loop, where the lazy user
+    can not be loaded from the database. It also requires csrf for the whole api,
+    where this checks it for the operations with the session cookie only: the
+    browser sends the cookie with cross-site requests too, a JWT it does not.
+    A POST, eg. /logout-everywhere, needs the X-CSRFToken header of the csrftoken
+    cookie.
+    """
+
+    async def __call__(self, request: HttpRequest) -> Optional[Any]:
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return None
+        # None for the safe methods, or a valid csrf token
+        if check_csrf(request, self.__call__) is not None:
+            return None
+        return user
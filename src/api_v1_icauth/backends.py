@@ -3,16 +3,51 @@
 https://docs.djangoproject.com/en/4.0/topics/auth/customizing/#writing-an-authentication-backend
 """
 
+import logging
 from typing import Optional, Any
 from django.http import HttpRequest
 from django.contrib.auth.backends import BaseBackend
 from django.contrib.auth import get_user_model
+from django.db import transaction
 
-from .canister_motoko import canister_motoko, is_response_variant_ok
+from .canister_motoko import (
+    CanisterError,
+    canister_motoko_async,
+    is_response_variant_ok,
+)
+from .credentials import verified_credentials
+from .single_flight import check_session_password
+from .users import aprovision_user, provision_user, user_cache
+
+logger = logging.getLogger(__name__)
 
 UserModel = get_user_model()
 
 
+def get_or_create_user(username: str) -> Any:
+    """Returns the user of the principal, creating it on first login"""
+    user = user_cache.get_by_username(username)
+    if user is not None:
+        return user
+    # There's no need to set a password because we use temporary
+    # session passwords generated and stored in the ic canister.
+    user = provision_user(username)
+    # Not cached before the row is committed, it may still be rolled back
+    transaction.on_commit(lambda: user_cache.set(user))
+    return user
+
+
+async def aget_or_create_user(username: str) -> Any:
+    """Async version of get_or_create_user"""
+    user = user_cache.get_by_username(username)
+    if user is not None:
+        return user
+    user = await aprovision_user(username)
+    # The async ORM runs in autocommit, the row is committed
+    user_cache.set(user)
+    return user
+
+
 class PrincipalBackend(BaseBackend):
     """
     Authenticate against the principal's password saved in an ic canister.
@@ -37,81 +72,151 @@ class PrincipalBackend(BaseBackend):
     ) -> Optional[Any]:
         """Authenticates username (principal) against session password in ic canister"""
 
-        print("--custom backends.py -- authenticate --TODO: use logger.info--")
-        print("TODO: only use CI based authentication when request.get_host() is IC")
-        response = canister_motoko.whoami()  # pylint: disable=no-member
-        print(
-            "Response from canister_motoko.whoami, "
-            "for django-server Internet Identity: "
-        )
-        print(response)
-        print("-------------------------------")
+        # TODO: only use CI based authentication when request.get_host() is IC
 
         if request and request.session.session_key:
             # called after login
             # we save the session_key in IC canister & return
             try:
-                response = canister_motoko.save_django_session_key(  # pylint: disable=no-member
-                    request.session.session_key, username, password
+                response = canister_motoko_async.call_sync(
+                    "save_django_session_key",
+                    request.session.session_key,
+                    username,
+                    password,
+                )
+            except CanisterError:
+                logger.warning(
+                    "IC save_django_session_key failed",
+                    exc_info=True,
+                    extra={"principal": username},
                 )
-            except Exception as e:  # pylint: disable=broad-except
-                print(e)
-                print("IC Authentication failure - 1")
                 return None
 
-            print("--backends.py -- authenticate -- AFTER LOGIN  --TODO: REMOVE THIS--")
-            print(f"request.session.session_key: {request.session.session_key}")
-            print("Response from canister_motoko.save_django_session_key: ")
-            print(response)
-            print(f"username: {username}")
-            print(
-                f"UserModel.objects.get(username=username): "
-                f"{UserModel.objects.get(username=username)}"
+            logger.debug(
+                "IC save_django_session_key response",
+                extra={"principal": username, "response": response},
             )
-            print("-------------------------------")
             if is_response_variant_ok(response):
-                return UserModel.objects.get(username=username)
+                return get_or_create_user(username)
 
-            print("IC Authentication failure - 2")
+            logger.info(
+                "IC authentication failure",
+                extra={"principal": username, "response": response},
+            )
             return None
 
         # Not yet logged in
-        # We need to authenticate the session_password with the IC canister
+        # We need to authenticate the session_password with the IC canister,
+        # unless it was verified recently
         if password:
-            try:
-                response = (
-                    canister_motoko.session_password_check(  # pylint: disable=no-member
-                        username, password
+            verified = verified_credentials.get(username, password)
+            if not verified:
+                try:
+                    response = canister_motoko_async.call_sync(
+                        "session_password_check", username, password
                     )
+                except CanisterError:
+                    logger.warning(
+                        "IC session_password_check failed",
+                        exc_info=True,
+                        extra={"principal": username},
+                    )
+                    return None
+
+                logger.debug(
+                    "IC session_password_check response",
+                    extra={"principal": username, "response": response},
                 )
-            except Exception as e:  # pylint: disable=broad-except
-                print(e)
-                print("IC Authentication failure - 3")
-                return None
+                verified = is_response_variant_ok(response)
+                if verified:
+                    verified_credentials.set(username, password)
+            if verified:
+                return get_or_create_user(username)
 
-            print("--backends.py -- authenticate -- BEFORE LOGIN --TODO: REMOVE THIS--")
-            print("Response from canister_motoko.save_django_session_key: ")
-            print(response)
-            print("-------------------------------")
-            if is_response_variant_ok(response):
-                try:
-                    user = UserModel.objects.get(username=username)
-                except UserModel.DoesNotExist:
-                    # Create a new user.
-                    # There's no need to set a password because we use temporary
-                    # session passwords generated and stored in the ic canister.
-                    user = UserModel(username=username)
-                    user.is_staff = False
-                    user.is_superuser = False
-                    user.save()
-                return user
-
-        print("IC Authentication failure - 4")
+        logger.info("IC authentication failure", extra={"principal": username})
         return None
 
+    async def aauthenticate(
+        self,
+        request: Optional[HttpRequest],
+        username: Any = None,
+        password: Any = None,
+        **kwargs: Any,
+    ) -> Optional[Any]:
+        """Authenticates username (principal) against session password in ic canister.
+
+        Same as authenticate before login, but with the asyncio canister client.
+        Saving the django session_key after login is done by asave_session_key.
+
+        Raises CanisterError when the ic canister fails or is unavailable, so the
+        caller can tell an outage apart from wrong credentials.
+        """
+        if not password:
+            logger.info("IC authentication failure", extra={"principal": username})
+            return None
+
+        if verified_credentials.get(username, password):
+            return await aget_or_create_user(username)
+
+        async def check() -> bool:
+            response = await canister_motoko_async.session_password_check(
+                username, password
+            )
+            if not is_response_variant_ok(response):
+                logger.info(
+                    "IC authentication failure",
+                    extra={"principal": username, "response": response},
+                )
+                return False
+            verified_credentials.set(username, password)
+            return True
+
+        # Identical concurrent authentications share one session_password_check
+        if not await check_session_password(username, password, check):
+            return None
+
+        return await aget_or_create_user(username)
+
+    async def asave_session_key(
+        self, session_key: str, username: str, password: str
+    ) -> bool:
+        """Saves the django session_key in the ic canister, for cleanup purposes.
+
+        Returns False if the canister rejects the session password. Raises
+        CanisterError when the ic canister fails or is unavailable.
+        """
+        response = await canister_motoko_async.save_django_session_key(
+            session_key, username, password
+        )
+        if not is_response_variant_ok(response):
+            logger.info(
+                "IC save_django_session_key failure",
+                extra={"principal": username, "response": response},
+            )
+            return False
+
+        return True
+
     def get_user(self, user_id: int) -> Optional[Any]:
-        """Returns user objec if it exists"""
+        """Returns user objec if it exists, from the user cache if possible"""
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+        try:
+            user = UserModel.objects.get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        user_cache.set(user)
+        return user
+
+    async def aget_user(self, user_id: int) -> Optional[Any]:
+        """Async version of get_user"""
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
         try:
-            return UserModel.objects.get(pk=user_id)
+            user = await UserModel.objects.aget(pk=user_id)
         except UserModel.DoesNotExist:
             return None
+        user_cache.set(user)
+        return user
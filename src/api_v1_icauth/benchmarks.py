@@ -0,0 +1,348 @@
+"""Benchmarks of the icauth apis, running in-process against a test database.
+
+Run them with the benchmark management command, eg.:
+
+    python src/manage.py benchmark login --requests 500 --concurrency 20
+
+Every benchmark returns a dict, which the command prints & optionally saves as JSON.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from typing import Any, Awaitable, Callable
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.db import IntegrityError, connection, connections
+from django.test import AsyncClient  # type: ignore[attr-defined]
+from django.test.utils import override_settings
+from project.sessions.cached_db import session_cache
+
+from .canister_motoko import get_transport
+from .tokens import verified_tokens
+from .transports import InMemoryTransport
+from .users import provision_user
+
+MEMORY_TRANSPORT = "api_v1_icauth.transports.InMemoryTransport"
+
+Benchmark = Callable[..., dict[str, Any]]
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def register(func: Benchmark) -> Benchmark:
+    """Registers a benchmark under the name of the function"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def latency_stats(samples: list[float]) -> dict[str, float]:
+    """Returns the count & the mean/p50/p95/p99/max latency in milliseconds"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def run_concurrently(
+    func: Callable[[int, AsyncClient], Awaitable[None]],
+    requests: int,
+    concurrency: int,
+) -> list[float]:
+    """Awaits func(i, client) for i in range(requests), by `concurrency` workers.
+
+    Every worker has its own AsyncClient, because building the middleware chain of a
+    client is expensive. Returns the latency of every call, in seconds.
+
+    Run it with asyncio.run, so the event loop owns the main thread like under uvicorn.
+    """
+    samples: list[float] = []
+    indices = iter(range(requests))
+
+    async def worker() -> None:
+        client = AsyncClient()
+        for i in indices:
+            t0 = time.perf_counter()
+            await func(i, client)
+            samples.append(time.perf_counter() - t0)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        # Close the connections opened by the thread of sync_to_async
+        await sync_to_async(connections.close_all)()
+    return samples
+
+
+@register
+def login(
+    requests: int = 200, concurrency: int = 10, latency: float = 0.02, **_: Any
+) -> dict[str, Any]:
+    """POST /login, against the InMemoryTransport with `latency` seconds per call.
+
+    Reports the number of canister round trips per login & the login latency.
+    Half of the logins are by a principal that logged in before.
+    """
+    with override_settings(
+        CANISTER_MOTOKO_TRANSPORT=MEMORY_TRANSPORT,
+        CANISTER_MOTOKO_MEMORY_LATENCY=latency,
+    ):
+        transport = get_transport()
+        assert isinstance(transport, InMemoryTransport)
+
+        passwords = {
+            principal: transport.create_session_password(principal)
+            for principal in (f"benchmark-{i // 2}" for i in range(requests))
+        }
+
+        async def one_login(i: int, client: AsyncClient) -> None:
+            principal = f"benchmark-{i // 2}"
+            client.cookies.clear()
+            response = await client.post(
+                "/api/v1/icauth/login",
+                {"principal": principal, "session_password": passwords[principal]},
+                content_type="application/json",
+            )
+            assert response.status_code == 200, response.content
+
+        t0 = time.perf_counter()
+        samples = asyncio.run(run_concurrently(one_login, requests, concurrency))
+        elapsed = time.perf_counter() - t0
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "canister_latency_ms": latency * 1000,
+        "canister_round_trips_per_login": sum(transport.calls.values()) / requests,
+        "canister_calls": dict(transport.calls),
+        "throughput_rps": requests / elapsed,
+        "latency": latency_stats(samples),
+    }
+
+
+@register
+def auth(requests: int = 2000, concurrency: int = 10, **_: Any) -> dict[str, Any]:
+    """GET /me, authenticated by session cookie vs by JWT bearer token.
+
+    `concurrency` users log in first. The session cookie path loads the session &
+    the user on every request, from the session & user caches of the worker, the
+    JWT path only verifies the token, once per token thanks to the verified token
+    cache.
+    """
+    with override_settings(
+        CANISTER_MOTOKO_TRANSPORT=MEMORY_TRANSPORT, CANISTER_MOTOKO_MEMORY_LATENCY=0.0
+    ):
+        transport = get_transport()
+        assert isinstance(transport, InMemoryTransport)
+
+        async def log_in(i: int, client: AsyncClient) -> None:
+            principal = f"benchmark-auth-{i}"
+            response = await client.post(
+                "/api/v1/icauth/login",
+                {
+                    "principal": principal,
+                    "session_password": transport.create_session_password(principal),
+                },
+                content_type="application/json",
+            )
+            assert response.status_code == 200, response.content
+            cookies.append(response.cookies["sessionid"].value)
+            tokens.append(response.json()["jwt"])
+
+        async def me_by_session(i: int, client: AsyncClient) -> None:
+            client.cookies["sessionid"] = cookies[i % len(cookies)]
+            response = await client.get("/api/v1/icauth/me")
+            assert response.status_code == 200, response.content
+
+        async def me_by_jwt(i: int, client: AsyncClient) -> None:
+            response = await client.get(
+                "/api/v1/icauth/me",
+                headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"},
+            )
+            assert response.status_code == 200, response.content
+
+        cookies: list[str] = []
+        tokens: list[str] = []
+        asyncio.run(run_concurrently(log_in, concurrency, concurrency))
+        verified_tokens.clear()
+
+        results: dict[str, Any] = {"requests": requests, "concurrency": concurrency}
+        for name, func in (("session", me_by_session), ("jwt", me_by_jwt)):
+            t0 = time.perf_counter()
+            samples = asyncio.run(run_concurrently(func, requests, concurrency))
+            elapsed = time.perf_counter() - t0
+            results[name] = {
+                "throughput_rps": requests / elapsed,
+                "latency": latency_stats(samples),
+            }
+        results["jwt"]["verified_token_cache"] = {
+            "hits": verified_tokens.hits,
+            "misses": verified_tokens.misses,
+        }
+    return results
+
+
+def get_then_save(username: str) -> Any:
+    """The provisioning of a user before provision_user, for comparison"""
+    user_model = get_user_model()
+    try:
+        return user_model.objects.get(username=username)
+    except user_model.DoesNotExist:
+        user = user_model(username=username, is_staff=False, is_superuser=False)
+        user.save()
+        return user
+
+
+def run_in_threads(
+    func: Callable[[int], None], calls: int, concurrency: int
+) -> dict[str, Any]:
+    """Calls func(i) for i in range(calls), by `concurrency` threads.
+
+    Returns the elapsed seconds, the latency of every call & the number of SQL
+    statements of all calls.
+    """
+    samples: list[float] = []
+    statements = [0]
+    lock = threading.Lock()
+
+    def count(execute: Any, *args: Any) -> Any:
+        with lock:
+            statements[0] += 1
+        return execute(*args)
+
+    def call(i: int) -> None:
+        with connection.execute_wrapper(count):
+            t0 = time.perf_counter()
+            func(i)
+            samples.append(time.perf_counter() - t0)
+
+    barrier = threading.Barrier(concurrency)
+
+    def close_connection(_: int) -> None:
+        # The barrier makes every thread take one of the calls
+        barrier.wait()
+        connection.close()
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(call, range(calls)))
+        elapsed = time.perf_counter() - t0
+        # Every thread closes its own connection
+        list(executor.map(close_connection, range(concurrency)))
+
+    return {"elapsed": elapsed, "samples": samples, "statements": statements[0]}
+
+
+def burst_of_first_logins(
+    provision_func: Callable[[str], Any], prefix: str, requests: int, concurrency: int
+) -> dict[str, Any]:
+    """Provisions the users of `requests` principals, twice each, by threads"""
+    errors = [0]
+    lock = threading.Lock()
+
+    def first_login(i: int) -> None:
+        try:
+            provision_func(f"{prefix}-{i // 2}")
+        except IntegrityError:
+            with lock:
+                errors[0] += 1
+
+    run = run_in_threads(first_login, 2 * requests, concurrency)
+    return {
+        "throughput_per_second": 2 * requests / run["elapsed"],
+        "integrity_errors": errors[0],
+        "statements_per_login": run["statements"] / (2 * requests),
+        "latency": latency_stats(run["samples"]),
+    }
+
+
+@register
+def provision(
+    requests: int = 10_000, concurrency: int = 10, **_: Any
+) -> dict[str, Any]:
+    """A burst of first logins of `requests` new principals, by `concurrency` threads.
+
+    Every principal logs in twice at once, eg. from a retry, so the provisioning of
+    its user races with itself. Compares get-then-save with provision_user by the
+    failed provisionings (IntegrityError), statements & latency.
+    """
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "get_then_save": burst_of_first_logins(
+            get_then_save, "benchmark-get-then-save", requests, concurrency
+        ),
+        "upsert": burst_of_first_logins(
+            provision_user, "benchmark-upsert", requests, concurrency
+        ),
+    }
+
+
+def session_requests(engine: str, requests: int, concurrency: int) -> dict[str, Any]:
+    """The session I/O of `requests` requests with a login session, by threads.
+
+    (-) read: the request loads the session, as AuthenticationMiddleware does
+    (-) sliding: the request also saves it, as with SESSION_SAVE_EVERY_REQUEST
+    """
+    store_class = import_module(engine).SessionStore
+    session_cache.clear()
+    session_keys: list[str] = []
+    for i in range(max(1, requests // 10)):
+        store = store_class()
+        store[SESSION_KEY] = str(i)
+        store.save()
+        session_keys.append(store.session_key)
+
+    def read(i: int) -> None:
+        store = store_class(session_keys[i % len(session_keys)])
+        assert store.get(SESSION_KEY) is not None
+
+    def sliding(i: int) -> None:
+        store = store_class(session_keys[i % len(session_keys)])
+        assert store.get(SESSION_KEY) is not None
+        store.save()
+
+    results: dict[str, Any] = {}
+    for name, func in (("read", read), ("sliding", sliding)):
+        run = run_in_threads(func, requests, concurrency)
+        results[name] = {
+            "throughput_per_second": requests / run["elapsed"],
+            "statements_per_request": run["statements"] / requests,
+            "latency": latency_stats(run["samples"]),
+        }
+    return results
+
+
+@register
+def sessions(requests: int = 10_000, concurrency: int = 10, **_: Any) -> dict[str, Any]:
+    """Session I/O of the stock database engine vs the engines of project.sessions.
+
+    Every session is used by 10 requests, by `concurrency` threads. Compares the
+    statements per request, the throughput & the latency.
+    """
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        **{
+            engine: session_requests(engine, requests, concurrency)
+            for engine in (
+                "django.contrib.sessions.backends.db",
+                "project.sessions.cached_db",
+                "project.sessions.signed_cookies",
+            )
+        },
+    }
@@ -1,43 +1,688 @@
 """Functions to interact with canister_motoko, using ic-py
 
 Reference: https://github.com/rocklabs-io/ic-py
+
+Nothing is built at import, so a worker or a manage.py command that does not call
+the canister does not pay for it. On first use:
+(-) get_identity: decodes & parses the .pem of the `django-server` identity
+(-) get_canister_motoko: builds the agent, and the canister from its candid
+    interface, parsed once & cached on disk by load_candid
+
+With CANISTER_MOTOKO_IDS, the principals are sharded over several canisters. A call
+goes to the canister of its principal, see sharding.py.
 """
+import asyncio
 import base64
-from typing import Union
+import functools
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import tempfile
+import time
+import weakref
+from importlib.metadata import version
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Awaitable, Optional, Union
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
 
-from ic.canister import Canister  # type: ignore
+import cbor2  # type: ignore
+from ic.canister import Canister, CaniterMethod, CaniterMethodAsync  # type: ignore
+from ic.candid import encode, decode  # type: ignore
+from ic.certificate import lookup  # type: ignore
 from ic.client import Client  # type: ignore
 from ic.identity import Identity  # type: ignore
-from ic.agent import Agent  # type: ignore
+from ic.agent import Agent, sign_request  # type: ignore
+from ic.principal import Principal  # type: ignore
+
+from project.metrics import registry
+
+from .resilience import CircuitBreaker, hedged, method_timeout
+from .sharding import canister_ids, shard_for
+
+if TYPE_CHECKING:
+    import aiohttp
+
+    from .transports import Transport
+
+logger = logging.getLogger(__name__)
+
+# A parsed candid interface is only valid for the ic-py version that pickled it
+CANDID_CACHE_KEY = f"ic-py-{version('ic-py')}"
+
+# Bytes of the HMAC-SHA256 at the start of a candid cache file
+SIGNATURE_SIZE = 32
+
+
+@functools.lru_cache(maxsize=None)
+def get_identity() -> Identity:
+    """Returns the `django-server` Identity, created on first use"""
+    # Read the private key from the .pem file for the `django-server` Identity
+    ##with open(settings.IC_IDENTITY_PEM, "r", encoding="utf-8") as f:
+    ##    private_key = f.read()
+    ##private_key = settings.IC_IDENTITY_PEM
+    private_key = base64.b64decode(settings.IC_IDENTITY_PEM_ENCODED)
+    return Identity.from_pem(private_key)
+
+
+@functools.lru_cache(maxsize=None)
+def get_canister_motoko_did() -> str:
+    """Returns the candid interface of canister_motoko, read on first use"""
+    with open(
+        settings.BASE_DIR / "candid/canister_motoko.did", "r", encoding="utf-8"
+    ) as f:
+        return f.read()
+
 
-# Read the private key from the .pem file for the `django-server` Identity
-##with open(settings.IC_IDENTITY_PEM, "r", encoding="utf-8") as f:
-##    private_key = f.read()
-##private_key = settings.IC_IDENTITY_PEM
-private_key = base64.b64decode(settings.IC_IDENTITY_PEM_ENCODED)
+def candid_cache_signature(data: bytes) -> bytes:
+    """Returns the HMAC of a pickled candid interface, keyed with SECRET_KEY"""
+    return hmac.new(settings.SECRET_KEY.encode(), data, hashlib.sha256).digest()
 
 
-# Create an `django-server` Identity instance using the private key
-identity = Identity.from_pem(private_key)
+def load_candid(candid: str) -> dict[str, Any]:
+    """Returns the actor of a candid interface, as parsed by ic-py.
 
-# Create an HTTP client instance for making HTTPS calls to the IC
+    The parse is cached in CANDID_CACHE_DIR, under the sha256 of the candid, so a
+    changed interface is parsed again. A cache that can not be read or written is
+    skipped: the interface is then parsed.
+
+    A pickle runs code when it is loaded, so the cache file starts with an HMAC of
+    the pickle, keyed with SECRET_KEY, and a file whose HMAC does not match is
+    never unpickled.
+    """
+    actor: dict[str, Any]
+    if not settings.CANDID_CACHE_DIR:
+        actor = Canister(agent=None, canister_id="aaaaa-aa", candid=candid).actor
+        return actor
+    digest = hashlib.sha256(f"{CANDID_CACHE_KEY}\n{candid}".encode()).hexdigest()
+    path = Path(settings.CANDID_CACHE_DIR) / f"{digest}.pickle"
+    try:
+        signed = path.read_bytes()
+        signature, data = signed[:SIGNATURE_SIZE], signed[SIGNATURE_SIZE:]
+        if not hmac.compare_digest(signature, candid_cache_signature(data)):
+            raise ValueError("Invalid signature")
+        actor = pickle.loads(data)
+        return actor
+    except FileNotFoundError:
+        pass
+    except Exception:  # pylint: disable=broad-except
+        logger.warning("Unreadable candid cache %s", path, exc_info=True)
+
+    actor = Canister(agent=None, canister_id="aaaaa-aa", candid=candid).actor
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write & rename, so a concurrent worker never reads a partial file
+        data = pickle.dumps(actor)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(candid_cache_signature(data) + data)
+        os.replace(f.name, path)
+    except OSError:
+        logger.warning("Could not write the candid cache %s", path, exc_info=True)
+    return actor
+
+
+class CachedCanister(Canister):  # type: ignore[misc] # pylint: disable=too-few-public-methods
+    """An ic-py Canister, from a parsed candid interface instead of its source"""
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self, agent: Agent, canister_id: str, actor: dict[str, Any]
+    ) -> None:
+        # As Canister.__init__, after the parse
+        self.agent = agent
+        self.canister_id = canister_id
+        self.actor = actor
+        for name, method in actor["methods"].items():
+            anno = None if len(method.annotations) == 0 else method.annotations[0]
+            args = (agent, canister_id, name, method.argTypes, method.retTypes, anno)
+            setattr(self, name, CaniterMethod(*args))
+            setattr(self, name + "_async", CaniterMethodAsync(*args))
+
+
+@functools.lru_cache(maxsize=None)
+def get_agent() -> Agent:
+    """Returns the IC agent of the `django-server` identity, created on first use"""
+    # Create an HTTP client instance for making HTTPS calls to the IC
+    # https://smartcontracts.org/docs/interface-spec/index.html#http-interface
+    client = Client(url=settings.IC_NETWORK_URL)
+
+    # Create an IC agent to communicate with IC canisters
+    return Agent(get_identity(), client)
+
+
+@functools.lru_cache(maxsize=None)
+def get_canister_motoko(canister_id: str = "") -> Canister:
+    """Returns a canister_motoko canister of ic-py, CANISTER_MOTOKO_ID by default"""
+    return CachedCanister(
+        get_agent(),
+        canister_id or settings.CANISTER_MOTOKO_ID,
+        load_candid(get_canister_motoko_did()),
+    )
+
+
+# ######################################################################
+# asyncio client
+#
+# ic-py's own *_async methods open a new httpx client per request and poll the
+# request status with a blocking sleep, which stalls the event loop.
+# AsyncCanister talks to the same http interface with a shared aiohttp session per
+# event loop, so connections are pooled, kept alive and bounded by IC_HTTP_POOL_SIZE.
+#
 # https://smartcontracts.org/docs/interface-spec/index.html#http-interface
-client = Client(url=settings.IC_NETWORK_URL)
 
-# Create an IC agent to communicate with IC canisters
-agent = Agent(identity, client)
+CBOR_HEADERS = {"Content-Type": "application/cbor"}
+
+# Polling of the request status of update calls: start fast, back off to 1 second
+POLL_DELAY_INITIAL = 0.05
+POLL_DELAY_MAX = 1.0
+POLL_BACKOFF = 1.5
+POLL_TIMEOUT = 60.0
+
+_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (  # pylint: disable=line-too-long
+    weakref.WeakKeyDictionary()
+)
+
+
+class CanisterError(Exception):
+    """Raised when the IC rejects or does not answer a canister call"""
+
+
+class CanisterRejected(CanisterError):
+    """Raised when the IC rejects a canister call, eg. because the canister trapped"""
+
+
+class CanisterTimeout(CanisterError):
+    """Raised when a canister call does not complete within its deadline"""
+
+
+class CanisterUnavailable(CanisterError):
+    """Raised without calling the canister, while the circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def get_http_session() -> "aiohttp.ClientSession":
+    """Returns the aiohttp session of the running event loop, created on first use."""
+    # Imported on first use, as it takes longer to import than the rest of django
+    import aiohttp  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_running_loop()
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.IC_HTTP_POOL_SIZE,
+            keepalive_timeout=settings.IC_HTTP_KEEPALIVE_TIMEOUT,
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _http_sessions[loop] = session
+    return session
+
+
+async def close_http_session() -> None:
+    """Closes the aiohttp session of the running event loop, if any."""
+    session = _http_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+
+class AsyncCanister:  # pylint: disable=too-few-public-methods
+    """asyncio version of an ic-py Canister.
+
+    Every method of the candid service is available as a coroutine, eg.:
+
+        response = await canister_motoko_async.session_password_check(p, password)
+
+    The responses have the same format as those of the ic-py Canister. A method is
+    called as an update call, or as a query call with query=True:
+
+        response = await canister_motoko_async.whoami(query=True)
+    """
+
+    def __init__(self, canister: Canister) -> None:
+        self.agent = canister.agent
+        self.canister_id = canister.canister_id
+        url = str(self.agent.client.url).rstrip("/")
+        self.url = f"{url}/api/v2/canister/{self.canister_id}"
+        self._sender = self.agent.identity.sender().bytes
+        self._canister_id_bytes = Principal.from_str(self.canister_id).bytes
+
+        for name, method in canister.actor["methods"].items():
+            setattr(
+                self,
+                name,
+                AsyncCanisterMethod(self, name, method.argTypes, method.retTypes),
+            )
+
+    def __getattr__(self, name: str) -> "AsyncCanisterMethod":
+        # Only called for names that are not a method of the candid service
+        raise AttributeError(f"canister has no method {name}")
+
+    async def _post(self, endpoint: str, data: bytes) -> bytes:
+        """POSTs cbor data to an endpoint of the canister & returns the body"""
+        async with get_http_session().post(
+            f"{self.url}/{endpoint}", data=data, headers=CBOR_HEADERS
+        ) as response:
+            body = await response.read()
+            if response.status >= 400:
+                raise CanisterError(
+                    f"{endpoint} failed with status {response.status}: {body!r}"
+                )
+            return body
+
+    def _request(self, request_type: str, **fields: Any) -> tuple[bytes, bytes]:
+        """Signs a request & returns the request id and the cbor encoded envelope"""
+        req = {
+            "request_type": request_type,
+            "sender": self._sender,
+            "ingress_expiry": self.agent.get_expiry_date(),
+            **fields,
+        }
+        req_id, data = sign_request(req, self.agent.identity)
+        return req_id, data
 
-# Read canister_motoko candid from file
-with open(settings.BASE_DIR / "candid/canister_motoko.did", "r", encoding="utf-8") as f:
-    canister_motoko_did = f.read()
+    async def update(self, method_name: str, arg: bytes, ret_types: Any) -> Any:
+        """Makes an update call & waits for the certified reply"""
+        req_id, data = self._request(
+            "call",
+            canister_id=self._canister_id_bytes,
+            method_name=method_name,
+            arg=arg,
+        )
+        await self._post("call", data)
+        status, result = await self.poll(req_id)
+        if status == "rejected":
+            raise CanisterRejected(f"Rejected: {result.decode()}")
+        if status != "replied":
+            raise CanisterError(f"Timeout to poll result, current status: {status}")
+        return decode(result, ret_types)
 
-# Create a canister_motoko canister instance
-canister_motoko = Canister(
-    agent=agent, canister_id=settings.CANISTER_MOTOKO_ID, candid=canister_motoko_did
+    async def query(self, method_name: str, arg: bytes, ret_types: Any) -> Any:
+        """Makes a query call & returns the uncertified reply of one replica"""
+        _, data = self._request(
+            "query",
+            canister_id=self._canister_id_bytes,
+            method_name=method_name,
+            arg=arg,
+        )
+        result = cbor2.loads(await self._post("query", data))
+        if not isinstance(result, dict) or result.get("status") != "replied":
+            reject_message = (
+                result.get("reject_message") if isinstance(result, dict) else result
+            )
+            raise CanisterRejected(f"Rejected: {reject_message}")
+        return decode(result["reply"]["arg"], ret_types)
+
+    async def request_status(self, req_id: bytes) -> tuple[Any, Any]:
+        """Reads the status of a request & returns it with the certificate"""
+        _, data = self._request("read_state", paths=[[b"request_status", req_id]])
+        cert = cbor2.loads(
+            cbor2.loads(await self._post("read_state", data))["certificate"]
+        )
+        status = lookup([b"request_status", req_id, b"status"], cert)
+        return (None if status is None else status.decode()), cert
+
+    async def poll(self, req_id: bytes) -> tuple[Any, Any]:
+        """Polls the request status, with backoff, until the request is done"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + POLL_TIMEOUT
+        delay = POLL_DELAY_INITIAL
+        while True:
+            status, cert = await self.request_status(req_id)
+            if status in ("replied", "done", "rejected"):
+                break
+            if loop.time() + delay > deadline:
+                return status, None
+            await asyncio.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_DELAY_MAX)
+
+        if status == "replied":
+            return status, lookup([b"request_status", req_id, b"reply"], cert)
+        if status == "rejected":
+            return status, lookup([b"request_status", req_id, b"reject_message"], cert)
+        return status, None
+
+
+class AsyncCanisterMethod:  # pylint: disable=too-few-public-methods
+    """A coroutine method of an AsyncCanister, mirroring ic-py's CaniterMethod"""
+
+    def __init__(
+        self, canister: AsyncCanister, name: str, args: Any, rets: Any
+    ) -> None:
+        self.canister = canister
+        self.name = name
+        self.args = args
+        self.rets = rets
+
+    async def __call__(self, *args: Any, query: bool = False) -> Any:
+        if len(args) != len(self.args):
+            raise ValueError("Arguments length not match")
+        arguments = [{"type": t, "value": v} for t, v in zip(self.args, args)]
+        call = self.canister.query if query else self.canister.update
+        res = await call(self.name, encode(arguments), self.rets)
+        if not isinstance(res, list):
+            return res
+        return [item["value"] for item in res]
+
+
+# ######################################################################
+# The transport to canister_motoko is selected by settings.CANISTER_MOTOKO_TRANSPORT
+
+
+@functools.lru_cache(maxsize=None)
+def get_transport() -> "Transport":
+    """Returns the transport to canister_motoko, created on first use"""
+    transport_class = import_string(settings.CANISTER_MOTOKO_TRANSPORT)
+    transport: "Transport" = transport_class()
+    return transport
+
+
+@functools.lru_cache(maxsize=None)
+def get_circuit_breaker(canister_id: str) -> CircuitBreaker:
+    """Returns the circuit breaker of the calls to a canister, per process"""
+    return CircuitBreaker(
+        f"canister_motoko {canister_id}",
+        threshold=settings.CANISTER_MOTOKO_BREAKER_THRESHOLD,
+        reset_timeout=settings.CANISTER_MOTOKO_BREAKER_RESET,
+    )
+
+
+# Call modes of a method, in CANISTER_MOTOKO_CALL_MODES:
+# (-) update: goes through consensus, and the reply is certified. The default.
+# (-) query: answered by one replica, without consensus. The reply is not certified,
+#            so a malicious or lagging replica can answer anything.
+# (-) query_or_update: a query, then an update call unless the query replied ok, eg.
+#                      a session password not yet seen by the replica of the query
+CALL_UPDATE = "update"
+CALL_QUERY = "query"
+CALL_QUERY_OR_UPDATE = "query_or_update"
+
+# Methods that do not change the state of the canister. A query call discards the
+# changes of the other methods.
+READ_ONLY_METHODS = frozenset(["greet", "whoami", "session_password_check"])
+
+
+@functools.lru_cache(maxsize=None)
+def get_call_modes() -> dict[str, str]:
+    """Returns the call mode of the methods that are not called as update calls"""
+    call_modes: dict[str, str] = {
+        method_name: mode
+        for method_name, mode in settings.CANISTER_MOTOKO_CALL_MODES.items()
+        if mode != CALL_UPDATE
+    }
+    for method_name, mode in call_modes.items():
+        if mode not in (CALL_QUERY, CALL_QUERY_OR_UPDATE):
+            raise ImproperlyConfigured(
+                f"CANISTER_MOTOKO_CALL_MODES has an unknown mode {mode}"
+            )
+        if method_name not in READ_ONLY_METHODS:
+            raise ImproperlyConfigured(
+                f"CANISTER_MOTOKO_CALL_MODES: {method_name} changes the state of the "
+                "canister, it can only be called as an update call"
+            )
+    return call_modes
+
+
+@receiver(setting_changed)
+def reset_transport(*, setting: str, **kwargs: Any) -> None:
+    """Creates a new transport when a CANISTER_MOTOKO_ or IC_ setting changes (in
+    tests)
+    """
+    if setting.startswith(("CANISTER_MOTOKO_", "IC_")):
+        get_identity.cache_clear()
+        get_agent.cache_clear()
+        get_canister_motoko.cache_clear()
+        get_transport.cache_clear()
+        get_circuit_breaker.cache_clear()
+        get_call_modes.cache_clear()
+
+
+canister_call_duration = registry.histogram(
+    "canister_call_duration_seconds",
+    "Latency of the calls to canister_motoko, by method, call mode & outcome",
+    ("method", "mode", "outcome"),
 )
 
 
+def call_outcome(response: Any) -> str:
+    """Returns the outcome of a canister call: ok, err or rejected"""
+    if response == "rejected":
+        return "rejected"
+    if isinstance(response, list) and response and isinstance(response[0], dict):
+        r = response[0]
+        if "err" in r or (isinstance(r.get("value"), dict) and "err" in r["value"]):
+            return "err"
+    return "ok"
+
+
+# The position of the principal in the arguments of a method, whose calls go to the
+# canister of the principal. The other calls go to CANISTER_MOTOKO_ID.
+PRINCIPAL_ARGS = {"session_password_check": 0, "save_django_session_key": 1}
+
+# Idempotent methods, that may be sent again while the first call is slow
+HEDGED_METHODS = frozenset(["whoami", "session_password_check"])
+
+# Outcomes of a call that count as a failure for the circuit breaker
+FAILURE_OUTCOMES = frozenset(["rejected", "timeout", "exception"])
+
+
+class CanisterMotoko:
+    """The methods of canister_motoko.did used by django, as coroutines.
+
+    Every call goes through the circuit breaker, has a deadline, and is hedged if its
+    method is in HEDGED_METHODS and CANISTER_MOTOKO_HEDGE_DELAY is set. A call
+    raises CanisterError, or one of its subclasses, when it fails.
+
+    A method is called as an update call, with a certified reply, unless its call
+    mode in CANISTER_MOTOKO_CALL_MODES is query or query_or_update. The deadline of
+    a query_or_update call covers both calls.
+
+    A call goes to the canister of its principal, from its arguments or the
+    principal keyword, or to the canister_id keyword, through the circuit breaker
+    of that canister.
+
+    The latency of every call is recorded in canister_call_duration, by method, call
+    mode, and outcome: ok, err (the err variant), rejected, timeout or exception.
+    """
+
+    async def _call(
+        self,
+        method_name: str,
+        *args: Any,
+        principal: Optional[str] = None,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        """Calls a method through the transport & records the latency"""
+        canister_id = canister_id or self._canister_id(method_name, args, principal)
+        breaker = self._allow(method_name, canister_id)
+        mode = get_call_modes().get(method_name, CALL_UPDATE)
+        timeout = method_timeout(
+            method_name,
+            settings.CANISTER_MOTOKO_TIMEOUTS,
+            settings.CANISTER_MOTOKO_TIMEOUT,
+        )
+
+        def send(query: bool) -> Awaitable[Any]:
+            def send_once() -> Awaitable[Any]:
+                return get_transport().call(
+                    method_name, *args, query=query, canister_id=canister_id
+                )
+
+            if method_name in HEDGED_METHODS and settings.CANISTER_MOTOKO_HEDGE_DELAY:
+                return hedged(send_once, settings.CANISTER_MOTOKO_HEDGE_DELAY)
+            return send_once()
+
+        async def query_or_update() -> Any:
+            try:
+                response = await send(query=True)
+                if call_outcome(response) == "ok":
+                    return response
+            except CanisterError:
+                pass
+            logger.debug("Query of %s uncertain, calling update", method_name)
+            return await send(query=False)
+
+        t0 = time.perf_counter()
+        outcome = "exception"
+        call: Awaitable[Any]
+        try:
+            if mode == CALL_QUERY_OR_UPDATE:
+                call = query_or_update()
+            else:
+                call = send(query=mode == CALL_QUERY)
+            response = await asyncio.wait_for(call, timeout)
+            outcome = call_outcome(response)
+            return response
+        except asyncio.TimeoutError as e:
+            outcome = "timeout"
+            raise CanisterTimeout(f"{method_name} timed out after {timeout}s") from e
+        except CanisterRejected:
+            outcome = "rejected"
+            raise
+        except CanisterError:
+            raise
+        except Exception as e:
+            raise CanisterError(f"{method_name} failed: {e!r}") from e
+        finally:
+            self._record(breaker, method_name, mode, outcome, time.perf_counter() - t0)
+
+    def call_sync(
+        self,
+        method_name: str,
+        *args: Any,
+        principal: Optional[str] = None,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        """Blocking version of _call, for the sync code paths of the auth app.
+
+        A blocking call can not be cancelled, so it has no deadline. ic-py times
+        out its http requests after 5 seconds.
+        """
+        canister_id = canister_id or self._canister_id(method_name, args, principal)
+        breaker = self._allow(method_name, canister_id)
+        mode = get_call_modes().get(method_name, CALL_UPDATE)
+        t0 = time.perf_counter()
+        outcome = "exception"
+
+        def send(query: bool) -> Any:
+            return get_transport().call_sync(
+                method_name, *args, query=query, canister_id=canister_id
+            )
+
+        try:
+            if mode == CALL_UPDATE:
+                response = send(query=False)
+            elif mode == CALL_QUERY:
+                response = send(query=True)
+            else:
+                try:
+                    response = send(query=True)
+                    certain = call_outcome(response) == "ok"
+                except CanisterError:
+                    certain = False
+                if not certain:
+                    response = send(query=False)
+            outcome = call_outcome(response)
+            return response
+        except CanisterRejected:
+            outcome = "rejected"
+            raise
+        except CanisterError:
+            raise
+        except Exception as e:
+            raise CanisterError(f"{method_name} failed: {e!r}") from e
+        finally:
+            self._record(breaker, method_name, mode, outcome, time.perf_counter() - t0)
+
+    def _canister_id(
+        self, method_name: str, args: tuple[Any, ...], principal: Optional[str]
+    ) -> str:
+        """Returns the id of the canister of the principal of a call"""
+        if principal is None and method_name in PRINCIPAL_ARGS:
+            principal = args[PRINCIPAL_ARGS[method_name]]
+        if principal is None:
+            return str(settings.CANISTER_MOTOKO_ID)
+        return shard_for(principal)
+
+    def _allow(self, method_name: str, canister_id: str) -> CircuitBreaker:
+        """Returns the circuit breaker of the canister, or raises CanisterUnavailable
+        if it is open
+        """
+        breaker = get_circuit_breaker(canister_id)
+        if not breaker.allow():
+            raise CanisterUnavailable(
+                f"canister_motoko {canister_id} is unavailable, {method_name} not "
+                "called",
+                retry_after=breaker.retry_after(),
+            )
+        return breaker
+
+    def _record(  # pylint: disable=too-many-arguments
+        self,
+        breaker: CircuitBreaker,
+        method_name: str,
+        mode: str,
+        outcome: str,
+        latency: float,
+    ) -> None:
+        """Records the outcome of a call in the circuit breaker & the metrics"""
+        if outcome in FAILURE_OUTCOMES:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        canister_call_duration.observe(latency, method_name, mode, outcome)
+
+    async def whoami(self) -> Any:
+        """Returns the principal of the django-server identity"""
+        return await self._call("whoami")
+
+    async def session_password_check(self, principal: str, password: str) -> Any:
+        """Checks the session password of the principal"""
+        return await self._call("session_password_check", principal, password)
+
+    async def save_django_session_key(
+        self, session_key: str, principal: str, password: str
+    ) -> Any:
+        """Saves the django session_key, after checking the session password"""
+        return await self._call(
+            "save_django_session_key", session_key, principal, password
+        )
+
+    async def session_password_delete(
+        self,
+        session_key: str,
+        principal: Optional[str] = None,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        """Deletes the session password saved with the django session_key, in the
+        canister of the principal, or in canister_id.
+
+        Without either, the session password is deleted in every canister.
+        """
+        if principal is not None or canister_id is not None:
+            return await self._call(
+                "session_password_delete",
+                session_key,
+                principal=principal,
+                canister_id=canister_id,
+            )
+        responses = await asyncio.gather(
+            *(
+                self._call("session_password_delete", session_key, canister_id=c_id)
+                for c_id in canister_ids()
+            )
+        )
+        return next(filter(is_response_variant_ok, responses), responses[0])
+
+
+canister_motoko_async = CanisterMotoko()
+
+
 def is_response_variant_ok(
     response: Union[str, list[dict[str, Union[str, dict[str, str]]]]]
 ) -> bool:
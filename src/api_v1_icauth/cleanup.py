@@ -0,0 +1,207 @@
+"""Cleanup of the expired django sessions, and of their session passwords in the
+ic canister, which are otherwise only deleted at an explicit logout.
+
+The expired sessions are read in chunks of SESSION_CLEANUP_BATCH_SIZE, with keyset
+pagination on (expire_date, session_key), along the index of expire_date. For every
+chunk, the session passwords saved with the session keys are deleted in the
+canister, with at most SESSION_CLEANUP_CONCURRENCY calls in flight, and then the
+sessions are deleted in one statement, and dropped from the PrincipalSession index.
+The session password of an indexed session is deleted in the canister of its
+principal, the others in every canister.
+
+A run also deletes the expired LoginClaims, and in chunks the expired
+RefreshTokens, used or not, and the RevokedTokens of the tokens expired since.
+
+A session whose canister call failed is kept, so the next run retries it. A run
+stops at a chunk of which all canister calls failed, eg. when the canister is down.
+
+Run it with the purge_expired_sessions command, eg. from cron, or in a background
+thread of every worker, every SESSION_CLEANUP_INTERVAL seconds, stopped at the
+shutdown of the worker. Concurrent runs are safe: a session password deleted twice
+is not found the second time.
+"""
+
+import asyncio
+import datetime
+import logging
+import random
+import threading
+from collections import Counter
+from typing import Any, Optional
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import close_old_connections
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from .canister_motoko import (
+    CanisterError,
+    canister_motoko_async,
+    close_http_session,
+    is_response_variant_ok,
+)
+from .models import PrincipalSession, RefreshToken, RevokedToken
+from .single_flight import apurge_expired_claims
+
+logger = logging.getLogger(__name__)
+
+# Set to stop the background cleanup of this worker
+cleanup_stopped = threading.Event()
+
+
+async def delete_session_password(
+    session_key: str,
+    semaphore: asyncio.Semaphore,
+    principal: Optional[str] = None,
+    canister_id: Optional[str] = None,
+) -> Optional[bool]:
+    """Deletes the session password saved with a session key in the canister of the
+    principal, or in canister_id, or in every canister if neither is known.
+
+    Returns True if deleted, False if the canister has none, or None if the call
+    failed.
+    """
+    async with semaphore:
+        try:
+            response = await canister_motoko_async.session_password_delete(
+                session_key, principal=principal, canister_id=canister_id
+            )
+        except CanisterError as e:
+            logger.warning("IC session_password_delete failed", extra={"error": e})
+            return None
+    return is_response_variant_ok(response)
+
+
+async def adelete_in_batches(queryset: QuerySet[Any], batch_size: int) -> int:
+    """Deletes the rows of a queryset, batch_size rows per statement, so a large
+    backlog does not lock the table for long. Returns the number of deleted rows."""
+    deleted = 0
+    while True:
+        pks = [pk async for pk in queryset.values_list("pk", flat=True)[:batch_size]]
+        if pks:
+            count, _ = await queryset.model.objects.filter(pk__in=pks).adelete()
+            deleted += count
+        if len(pks) < batch_size:
+            return deleted
+
+
+async def purge_expired_sessions(
+    batch_size: Optional[int] = None, concurrency: Optional[int] = None
+) -> Counter[str]:
+    """Deletes the sessions that expired before now, and their session passwords.
+
+    Returns the number of deleted sessions, session passwords, login claims,
+    refresh tokens & revocations, and of the failed canister calls.
+    """
+    batch_size = batch_size or settings.SESSION_CLEANUP_BATCH_SIZE
+    semaphore = asyncio.Semaphore(concurrency or settings.SESSION_CLEANUP_CONCURRENCY)
+    now = timezone.now()
+    counts: Counter[str] = Counter(sessions=0, session_passwords=0, failed=0)
+    counts["login_claims"] = await apurge_expired_claims()
+    counts["refresh_tokens"] = await adelete_in_batches(
+        RefreshToken.objects.filter(expires_at__lt=now), batch_size
+    )
+    # An expired token fails verification, revoked or not
+    counts["revoked_tokens"] = await adelete_in_batches(
+        RevokedToken.objects.filter(expires_at__lt=now), batch_size
+    )
+    after: Optional[tuple[datetime.datetime, str]] = None
+    while True:
+        expired = Session.objects.filter(expire_date__lt=now)
+        if after is not None:
+            expired = expired.filter(
+                Q(expire_date__gt=after[0])
+                | Q(expire_date=after[0], session_key__gt=after[1])
+            )
+        chunk = [
+            row
+            async for row in expired.order_by("expire_date", "session_key").values_list(
+                "expire_date", "session_key"
+            )[:batch_size]
+        ]
+        if not chunk:
+            break
+        after = chunk[-1]
+
+        session_keys = [session_key for _, session_key in chunk]
+        principals = {
+            session_key: principal
+            async for session_key, principal in PrincipalSession.objects.filter(
+                session_key__in=session_keys
+            ).values_list("session_key", "principal")
+        }
+        results = await asyncio.gather(
+            *(
+                delete_session_password(key, semaphore, principals.get(key))
+                for key in session_keys
+            )
+        )
+        purged = [
+            key for key, result in zip(session_keys, results) if result is not None
+        ]
+        if purged:
+            deleted, _ = await Session.objects.filter(
+                session_key__in=purged, expire_date__lt=now
+            ).adelete()
+            counts["sessions"] += deleted
+            # Not the sessions extended since they were read
+            extended = Session.objects.filter(session_key__in=purged)
+            await PrincipalSession.objects.filter(session_key__in=purged).exclude(
+                session_key__in=extended.values("session_key")
+            ).adelete()
+        counts["session_passwords"] += sum(result is True for result in results)
+        counts["failed"] += len(session_keys) - len(purged)
+
+        if not purged:
+            logger.warning("Session cleanup stopped, all canister calls failed")
+            break
+        if len(chunk) < batch_size:
+            break
+    return counts
+
+
+async def purge_expired_sessions_once(
+    batch_size: Optional[int] = None, concurrency: Optional[int] = None
+) -> Counter[str]:
+    """purge_expired_sessions, on an event loop of its own, eg. of async_to_sync.
+
+    Closes the http session of the loop at the end, as the loop is not reused.
+    """
+    try:
+        return await purge_expired_sessions(batch_size, concurrency)
+    finally:
+        await close_http_session()
+
+
+def cleanup_periodically() -> None:
+    """Purges the expired sessions every SESSION_CLEANUP_INTERVAL seconds"""
+    # Jitter, so the workers do not all run at the same time
+    while not cleanup_stopped.wait(
+        settings.SESSION_CLEANUP_INTERVAL * random.uniform(0.5, 1.5)
+    ):
+        try:
+            counts = async_to_sync(purge_expired_sessions_once)()
+            logger.info("Expired sessions purged", extra=dict(counts))
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Session cleanup failed")
+        finally:
+            close_old_connections()
+
+
+def start_cleanup_thread() -> Optional[threading.Thread]:
+    """Starts the background cleanup of this worker, if SESSION_CLEANUP_INTERVAL"""
+    if settings.SESSION_CLEANUP_INTERVAL <= 0:
+        return None
+    cleanup_stopped.clear()
+    thread = threading.Thread(
+        target=cleanup_periodically, name="session-cleanup", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def stop_cleanup_thread() -> None:
+    """Stops the background cleanup, after the purge in progress, if any"""
+    cleanup_stopped.set()
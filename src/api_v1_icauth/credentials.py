@@ -0,0 +1,110 @@
+"""Keyed hashes of credentials, and the cache of recently verified credentials.
+
+A principal & session password are never kept in memory or stored as such, only as
+an HMAC of the pair:
+(-) credential_key: keyed with SECRET_KEY, the same in all workers, for LoginClaim
+(-) VerifiedCredentialCache: keyed with a random salt of the process
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def credential_key(principal: str, password: str) -> str:
+    """Returns a keyed hash of the principal & session password"""
+    return hmac.new(
+        settings.SECRET_KEY.encode(),
+        f"{principal}\0{password}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+class VerifiedCredentialCache:
+    """A bounded LRU cache of the session passwords verified by the canister.
+
+    Holds one entry per principal, like the canister holds one session password
+    per principal: a salted hash of the password, until `ttl` seconds after it was
+    verified. An entry takes about 300 bytes, so 10_000 entries take about 3 MB.
+
+    A ttl of 0 disables the cache. The cache is per worker process: a logout drops
+    the entry in its own worker, the other workers drop theirs within the ttl.
+    """
+
+    def __init__(self, ttl: float, maxsize: int) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.salt = secrets.token_bytes(16)
+        # principal -> (hash of the password, expiry time in time.monotonic)
+        self.credentials: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def digest(self, principal: str, password: str) -> bytes:
+        """Returns the salted hash of the credentials"""
+        return hmac.new(
+            self.salt, f"{principal}\0{password}".encode(), hashlib.sha256
+        ).digest()
+
+    def get(self, principal: str, password: str) -> bool:
+        """Returns True if the credentials were verified less than ttl seconds ago"""
+        if self.ttl <= 0:
+            return False
+        digest = self.digest(principal, password)
+        with self.lock:
+            entry = self.credentials.get(principal)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return False
+            if not hmac.compare_digest(entry[0], digest):
+                self.misses += 1
+                return False
+            self.credentials.move_to_end(principal)
+            self.hits += 1
+            return True
+
+    def set(self, principal: str, password: str) -> None:
+        """Adds credentials that the canister verified"""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        entry = (self.digest(principal, password), time.monotonic() + self.ttl)
+        with self.lock:
+            self.credentials[principal] = entry
+            self.credentials.move_to_end(principal)
+            while len(self.credentials) > self.maxsize:
+                self.credentials.popitem(last=False)
+
+    def invalidate(self, principal: str) -> None:
+        """Drops the credentials of a principal, eg. when its password is deleted"""
+        with self.lock:
+            self.credentials.pop(principal, None)
+
+    def clear(self) -> None:
+        """Drops all credentials & resets the counters"""
+        with self.lock:
+            self.credentials.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+verified_credentials = VerifiedCredentialCache(
+    settings.LOGIN_CACHE_TTL, settings.LOGIN_CACHE_SIZE
+)
+
+
+@receiver(setting_changed)
+def reset_verified_credentials(*, setting: str, **kwargs: Any) -> None:
+    """Drops the verified credentials when a LOGIN_CACHE_ setting changes (in tests)"""
+    if setting.startswith("LOGIN_CACHE_"):
+        verified_credentials.clear()
+        verified_credentials.ttl = settings.LOGIN_CACHE_TTL
+        verified_credentials.maxsize = settings.LOGIN_CACHE_SIZE
@@ -0,0 +1,189 @@
+"""A local stand-in for an IC replica, serving canister_motoko from memory.
+
+It implements the endpoints of the http interface used by ic-py & AsyncCanister:
+
+    POST /api/v2/canister/<canister_id>/call
+    POST /api/v2/canister/<canister_id>/read_state
+    POST /api/v2/canister/<canister_id>/query
+    GET  /api/v2/status
+
+Requests & replies are cbor encoded, and the arguments & results candid encoded,
+so the full client side cost of a canister call is measured: signing, encoding and
+polling of the request status. The stand-in does NOT verify signatures, and the
+certificates it returns are not signed.
+
+Every canister_id gets its own CanisterMotokoState.
+
+Run it with the ic_standin management command:
+
+    python src/manage.py ic_standin --port 8000
+
+https://smartcontracts.org/docs/interface-spec/index.html#http-interface
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Any, Optional
+
+import cbor2  # type: ignore
+from aiohttp import web
+from ic.candid import decode, encode  # type: ignore
+from ic.principal import Principal  # type: ignore
+from ic.utils import to_request_id  # type: ignore
+
+from .canister_motoko import get_canister_motoko_did, load_candid
+from .transports import CanisterMotokoState
+
+CBOR_CONTENT_TYPE = "application/cbor"
+
+# Labels of the hash tree, see the certificate module of ic-py
+NODE_FORK = 1
+NODE_LABELED = 2
+NODE_LEAF = 3
+
+# Replies of update calls are kept until this many newer calls are made
+MAX_REPLIES = 100_000
+
+
+def labeled(label: bytes, tree: list[Any]) -> list[Any]:
+    """Returns a Labeled node of a hash tree"""
+    return [NODE_LABELED, label, tree]
+
+
+def leaf(value: bytes) -> list[Any]:
+    """Returns a Leaf node of a hash tree"""
+    return [NODE_LEAF, value]
+
+
+def fork(left: list[Any], right: list[Any]) -> list[Any]:
+    """Returns a Fork node of a hash tree"""
+    return [NODE_FORK, left, right]
+
+
+class IcStandin:
+    """The state of the stand-in replica & its aiohttp request handlers"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        # Seconds before the reply of an update call is available for read_state
+        self.latency = latency
+        self.states: dict[str, CanisterMotokoState] = {}
+        # request_id -> (time available, status, reply or reject message)
+        self.replies: OrderedDict[bytes, tuple[float, str, bytes]] = OrderedDict()
+        # The method signatures of canister_motoko, parsed from the candid file
+        self.methods = load_candid(get_canister_motoko_did())["methods"]
+
+    def create_app(self) -> web.Application:
+        """Returns the aiohttp application of the stand-in"""
+        app = web.Application()
+        app.router.add_get("/api/v2/status", self.status)
+        app.router.add_post("/api/v2/canister/{canister_id}/call", self.call)
+        app.router.add_post(
+            "/api/v2/canister/{canister_id}/read_state", self.read_state
+        )
+        app.router.add_post("/api/v2/canister/{canister_id}/query", self.query)
+        return app
+
+    def execute(self, canister_id: str, content: dict[str, Any]) -> tuple[str, bytes]:
+        """Executes the canister method of a call or query.
+
+        Returns ('replied', candid encoded reply) or ('rejected', reject message)
+        """
+        method = self.methods.get(content["method_name"])
+        if method is None:
+            return (
+                "rejected",
+                f"Canister has no method {content['method_name']}".encode(),
+            )
+
+        caller = Principal(bytes=content["sender"]).to_str()
+        args = [arg["value"] for arg in decode(content["arg"])]
+        state = self.states.setdefault(canister_id, CanisterMotokoState())
+        try:
+            value = getattr(state, content["method_name"])(caller, *args)
+        except Exception as e:  # pylint: disable=broad-except
+            return "rejected", f"Canister trapped: {e}".encode()
+        return "replied", encode([{"type": method.retTypes[0], "value": value}])
+
+    async def status(self, request: web.Request) -> web.Response:
+        """GET /api/v2/status"""
+        return cbor_response({"ic_api_version": "0.18.0", "impl_source": "ic_standin"})
+
+    async def call(self, request: web.Request) -> web.Response:
+        """POST /api/v2/canister/<canister_id>/call: executes an update call"""
+        content = await read_content(request)
+        status, result = self.execute(request.match_info["canister_id"], content)
+        loop = asyncio.get_running_loop()
+        self.replies[to_request_id(content)] = (
+            loop.time() + self.latency,
+            status,
+            result,
+        )
+        while len(self.replies) > MAX_REPLIES:
+            self.replies.popitem(last=False)
+        return web.Response(status=202)
+
+    async def read_state(self, request: web.Request) -> web.Response:
+        """POST /api/v2/canister/<canister_id>/read_state: request status of calls"""
+        content = await read_content(request)
+        loop = asyncio.get_running_loop()
+        subtrees = []
+        for path in content["paths"]:
+            if len(path) < 2 or path[0] != b"request_status":
+                continue
+            req_id = path[1]
+            available_at, status, result = self.replies.get(req_id, (0.0, "", b""))
+            if not status:
+                continue
+            if loop.time() < available_at:
+                tree = labeled(b"status", leaf(b"processing"))
+            elif status == "replied":
+                tree = fork(
+                    labeled(b"reply", leaf(result)),
+                    labeled(b"status", leaf(b"replied")),
+                )
+            else:
+                tree = fork(
+                    labeled(b"reject_message", leaf(result)),
+                    labeled(b"status", leaf(b"rejected")),
+                )
+            subtrees.append(labeled(req_id, tree))
+
+        tree = labeled(b"request_status", fold_forks(subtrees))
+        certificate = cbor2.dumps({"tree": tree, "signature": b""})
+        return cbor_response({"certificate": certificate})
+
+    async def query(self, request: web.Request) -> web.Response:
+        """POST /api/v2/canister/<canister_id>/query: executes a query call"""
+        content = await read_content(request)
+        status, result = self.execute(request.match_info["canister_id"], content)
+        if status == "replied":
+            return cbor_response({"status": "replied", "reply": {"arg": result}})
+        return cbor_response(
+            {"status": "rejected", "reject_code": 5, "reject_message": result.decode()}
+        )
+
+
+def fold_forks(trees: list[list[Any]]) -> list[Any]:
+    """Combines hash trees with Fork nodes"""
+    if not trees:
+        return [0]
+    result: Optional[list[Any]] = None
+    for tree in trees:
+        result = tree if result is None else fork(result, tree)
+    assert result is not None
+    return result
+
+
+async def read_content(request: web.Request) -> dict[str, Any]:
+    """Returns the content of the cbor encoded envelope of a request"""
+    envelope = cbor2.loads(await request.read())
+    if isinstance(envelope, cbor2.CBORTag):
+        # self-describing cbor
+        envelope = envelope.value
+    content: dict[str, Any] = envelope["content"]
+    return content
+
+
+def cbor_response(data: Any) -> web.Response:
+    """Returns a cbor encoded response"""
+    return web.Response(body=cbor2.dumps(data), content_type=CBOR_CONTENT_TYPE)
@@ -0,0 +1,57 @@
+"""Runs a benchmark of api_v1_icauth.benchmarks against a throw-away test database"""
+
+import json
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+from ...benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    """python manage.py benchmark <name> [options]"""
+
+    help = "Runs an in-process benchmark & prints (or saves) the results as JSON."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("name", choices=sorted(BENCHMARKS))
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.02,
+            help="Artificial latency of a canister call, in seconds",
+        )
+        parser.add_argument("--output", help="Save the results as JSON to this file")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if options["name"] not in BENCHMARKS:
+            raise CommandError(f"Unknown benchmark: {options['name']}")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            results = {
+                "benchmark": options["name"],
+                **BENCHMARKS[options["name"]](
+                    requests=options["requests"],
+                    concurrency=options["concurrency"],
+                    latency=options["latency"],
+                ),
+            }
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,33 @@
+"""Runs a local stand-in for an IC replica, serving canister_motoko from memory"""
+
+from typing import Any
+
+from aiohttp import web
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...ic_standin import IcStandin
+
+
+class Command(BaseCommand):
+    """python manage.py ic_standin [--host HOST] [--port PORT] [--latency SECONDS]"""
+
+    help = "Runs a local stand-in for an IC replica, serving canister_motoko."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8000)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds before the reply of an update call is available",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        standin = IcStandin(latency=options["latency"])
+        web.run_app(
+            standin.create_app(),
+            host=options["host"],
+            port=options["port"],
+            print=self.stdout.write,
+        )
@@ -0,0 +1,30 @@
+"""Creates a private key to sign JWTs with, for JWT_SIGNING_KEYS_ENCODED"""
+
+import base64
+from typing import Any
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from django.core.management.base import BaseCommand, CommandParser
+
+
+class Command(BaseCommand):
+    """python manage.py jwt_signing_key {EdDSA,ES256}"""
+
+    help = "Prints a new base64 encoded pem private key, to sign JWTs with."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("algorithm", choices=["EdDSA", "ES256"])
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        private_key: Any
+        if options["algorithm"] == "EdDSA":
+            private_key = ed25519.Ed25519PrivateKey.generate()
+        else:
+            private_key = ec.generate_private_key(ec.SECP256R1())
+        pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        self.stdout.write(base64.b64encode(pem).decode())
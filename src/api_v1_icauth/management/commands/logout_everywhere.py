@@ -0,0 +1,39 @@
+"""Logs a principal out of all its sessions, eg. a compromised identity"""
+
+from collections import Counter
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...canister_motoko import close_http_session
+from ...principal_sessions import alogout_everywhere
+
+
+async def alogout_everywhere_once(principal: str) -> Counter[str]:
+    """alogout_everywhere, then closes the http session of the event loop of
+    async_to_sync, which is not reused"""
+    try:
+        return await alogout_everywhere(principal)
+    finally:
+        await close_http_session()
+
+
+class Command(BaseCommand):
+    """python manage.py logout_everywhere <principal>"""
+
+    help = (
+        "Ends all django sessions of a principal, revokes all its JWTs & refresh "
+        "tokens, and deletes its session passwords in the ic canister."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("principal")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        counts = async_to_sync(alogout_everywhere_once)(options["principal"])
+        self.stdout.write(
+            f"Ended {counts['sessions']} sessions & deleted "
+            f"{counts['session_passwords']} session passwords, "
+            f"{counts['failed']} canister calls failed"
+        )
@@ -0,0 +1,43 @@
+"""Deletes the expired sessions, and their session passwords in the ic canister"""
+
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...cleanup import purge_expired_sessions_once
+
+
+class Command(BaseCommand):
+    """python manage.py purge_expired_sessions [options]"""
+
+    help = (
+        "Deletes the expired django sessions in chunks, and their session passwords "
+        "in the ic canister."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help="Sessions per chunk (default: SESSION_CLEANUP_BATCH_SIZE)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Canister calls in flight (default: SESSION_CLEANUP_CONCURRENCY)",
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        # async_to_sync runs the database queries in this thread
+        counts = async_to_sync(purge_expired_sessions_once)(
+            options["batch_size"], options["concurrency"]
+        )
+        self.stdout.write(
+            f"Deleted {counts['sessions']} sessions & "
+            f"{counts['session_passwords']} session passwords, "
+            f"{counts['failed']} canister calls failed, "
+            f"{counts['login_claims']} expired login claims, "
+            f"{counts['refresh_tokens']} expired refresh tokens & "
+            f"{counts['revoked_tokens']} expired revocations deleted"
+        )
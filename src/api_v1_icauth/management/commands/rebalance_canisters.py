@@ -0,0 +1,52 @@
+"""Cleans up the principals moved to another canister by a change of
+CANISTER_MOTOKO_IDS"""
+
+from collections import Counter
+from typing import Any
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandParser
+
+from ...canister_motoko import close_http_session
+from ...principal_sessions import arebalance
+
+
+async def arebalance_once(previous_ids: list[str], dry_run: bool) -> Counter[str]:
+    """arebalance, then closes the http session of the event loop of
+    async_to_sync, which is not reused"""
+    try:
+        return await arebalance(previous_ids, dry_run)
+    finally:
+        await close_http_session()
+
+
+class Command(BaseCommand):
+    """python manage.py rebalance_canisters --previous-ids id-1,id-2 [--dry-run]"""
+
+    help = (
+        "Deletes the session passwords of the principals moved to another canister "
+        "by the current CANISTER_MOTOKO_IDS, in their previous canister."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--previous-ids",
+            required=True,
+            help="The canister ids before the change, separated by commas",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only count the moved principals"
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        previous_ids = [
+            canister_id.strip()
+            for canister_id in options["previous_ids"].split(",")
+            if canister_id.strip()
+        ]
+        counts = async_to_sync(arebalance_once)(previous_ids, options["dry_run"])
+        self.stdout.write(
+            f"{counts['moved']} of {counts['principals']} principals moved, with "
+            f"{counts['sessions']} sessions. Deleted {counts['session_passwords']} "
+            f"session passwords, {counts['failed']} canister calls failed"
+        )
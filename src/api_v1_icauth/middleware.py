@@ -0,0 +1,59 @@
+"""Middleware of the icauth app"""
+
+from typing import Any, Awaitable, Callable, Union
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import HttpRequest, HttpResponseBase
+
+from .revocation import revocation_list
+from .tokens import TokenUser, get_bearer_token, verify_jwt
+
+
+class JWTAuthenticationMiddleware:
+    """Sets request.user from a valid `Authorization: Bearer` JWT.
+
+    It must come after AuthenticationMiddleware. The lazy session user is replaced,
+    so neither the session nor the user is loaded from the database. Requests
+    without a valid token keep the session user.
+
+    Before it checks a token, it syncs the revoked tokens if the last sync is more
+    than JWT_REVOCATION_SYNC_INTERVAL seconds ago.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[..., Any]) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(
+        self, request: HttpRequest
+    ) -> Union[HttpResponseBase, Awaitable[HttpResponseBase]]:
+        if self.async_mode:
+            return self.__acall__(request)
+        token = get_bearer_token(request)
+        if token is not None:
+            if revocation_list.sync_due():
+                revocation_list.sync()
+            self.authenticate(request, token)
+        response: HttpResponseBase = self.get_response(request)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """Async version of __call__"""
+        token = get_bearer_token(request)
+        if token is not None:
+            if revocation_list.sync_due():
+                await sync_to_async(revocation_list.sync)()
+            self.authenticate(request, token)
+        response: HttpResponseBase = await self.get_response(request)
+        return response
+
+    def authenticate(self, request: HttpRequest, token: str) -> None:
+        """Sets request.user if the token is valid"""
+        claims = verify_jwt(token)
+        if claims is not None:
+            request.user = TokenUser(claims)  # type: ignore[assignment]
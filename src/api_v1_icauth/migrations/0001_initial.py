@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="RefreshToken",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("token_hash", models.CharField(max_length=64, unique=True)),
+                ("family", models.UUIDField(db_index=True)),
+                ("principal", models.CharField(max_length=150)),
+                ("expires_at", models.DateTimeField()),
+                ("used", models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api_v1_icauth", "0003_loginclaim"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PrincipalSession",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("principal", models.CharField(db_index=True, max_length=150)),
+                ("session_key", models.CharField(max_length=40, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="revokedtoken",
+            name="principal",
+            field=models.CharField(blank=True, default="", max_length=150),
+        ),
+        migrations.AlterField(
+            model_name="refreshtoken",
+            name="principal",
+            field=models.CharField(db_index=True, max_length=150),
+        ),
+    ]
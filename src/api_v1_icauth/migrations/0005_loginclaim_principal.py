@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api_v1_icauth", "0004_principalsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="loginclaim",
+            name="principal",
+            field=models.CharField(db_index=True, default="", max_length=150),
+        ),
+    ]
@@ -1,4 +1,72 @@
 """Models"""
-##from django.db import models
+from django.db import models
 
-# Create your models here.
+
+class RefreshToken(models.Model):
+    """A refresh token, stored as the sha256 hash of the token.
+
+    The refresh tokens issued from one login form a family. A refresh uses up the
+    token & issues the next token of the family. When a used token is presented
+    again, it was stolen or replayed, and the whole family is revoked.
+    The expired tokens, used or not, are deleted by the session cleanup.
+    """
+
+    token_hash = models.CharField(max_length=64, unique=True)
+    family = models.UUIDField(db_index=True)
+    principal = models.CharField(max_length=150, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+    used = models.BooleanField(default=False)
+
+    def __str__(self) -> str:
+        return f"{self.principal} {self.family}"
+
+
+class RevokedToken(models.Model):
+    """The jti of a JWT revoked before it expires, eg. at logout.
+
+    A row with a principal revokes all JWTs of the principal that expire up to its
+    expires_at, ie. all JWTs issued before it, eg. at a logout everywhere.
+
+    The auto-incremented id is the high-water mark of the incremental sync of the
+    workers. The rows of expired tokens are deleted by the session cleanup.
+    """
+
+    jti = models.CharField(max_length=32, unique=True)
+    principal = models.CharField(max_length=150, blank=True, default="")
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return self.jti
+
+
+class LoginClaim(models.Model):
+    """A claim of a worker on the session password check of a login.
+
+    Workers that get the same principal & session password wait for the claimant,
+    and reuse its result until the claim expires. The key is an HMAC of the pair,
+    so the table holds no passwords. `verified` is null while the check runs.
+    The claims of a principal are deleted at its logout.
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    principal = models.CharField(max_length=150, db_index=True, default="")
+    verified = models.BooleanField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return self.key
+
+
+class PrincipalSession(models.Model):
+    """The django session of a login of a principal.
+
+    An index of the sessions by principal, to end all sessions of a principal
+    without decoding every session. Added at login, deleted at logout & with the
+    expired session.
+    """
+
+    principal = models.CharField(max_length=150, db_index=True)
+    session_key = models.CharField(max_length=40, unique=True)
+
+    def __str__(self) -> str:
+        return f"{self.principal} {self.session_key}"
@@ -0,0 +1,146 @@
+"""The sessions of a principal, and the logout of a principal everywhere.
+
+A django session stores the user id in its encoded session data, so finding the
+sessions of a principal means decoding every session. Instead, the PrincipalSession
+index maps the principal to the session key of every login:
+(-) a login adds its session key, and drops the session key it replaced. Only the
+    sessions stored in the database, since a signed cookie session can not be ended.
+(-) a logout drops its session key, as does the cleanup of the expired sessions
+
+A logout everywhere, eg. of a compromised identity, ends all logins of a principal:
+(-) in one transaction: deletes its sessions & refresh tokens in bulk, by principal,
+    and revokes all JWTs issued to it until now
+(-) deletes the session passwords of its sessions in the ic canister, concurrently,
+    with at most SESSION_CLEANUP_CONCURRENCY calls in flight
+
+The workers reject the revoked JWTs at their next revocation sync, as at a logout.
+With SESSION_CACHE_TTL, the other workers drop their cached sessions within that
+time.
+
+A change of CANISTER_MOTOKO_IDS moves some principals to another canister, see
+sharding.py. The canister can not transfer its state, so a rebalance deletes the
+session passwords of the indexed sessions of the moved principals in their previous
+canister. The sessions stay logged in, and the next login of a moved principal
+creates its session password in its new canister.
+"""
+
+import asyncio
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.sessions.models import Session
+from django.db import transaction
+
+from project.sessions.cached_db import session_cache
+
+from .cleanup import delete_session_password
+from .credentials import verified_credentials
+from .models import PrincipalSession, RefreshToken
+from .revocation import revoke_principal
+from .sharding import HashRing, shard_for
+from .single_flight import arelease_principal
+
+
+async def aadd(principal: str, session: SessionBase) -> None:
+    """Adds the session of a login"""
+    session_key = session.session_key
+    if not isinstance(session, DBStore) or session_key is None:
+        return
+    # A login into the session of the same principal keeps the session key
+    await PrincipalSession.objects.abulk_create(
+        [PrincipalSession(principal=principal, session_key=session_key)],
+        ignore_conflicts=True,
+    )
+
+
+async def aremove(session_key: str) -> None:
+    """Drops the session of a logout"""
+    await PrincipalSession.objects.filter(session_key=session_key).adelete()
+
+
+def end_sessions(principal: str) -> list[str]:
+    """Deletes the sessions & refresh tokens of a principal, and revokes its JWTs.
+
+    Returns the session keys of the deleted sessions.
+    """
+    with transaction.atomic():
+        session_keys = list(
+            PrincipalSession.objects.filter(principal=principal).values_list(
+                "session_key", flat=True
+            )
+        )
+        if session_keys:
+            Session.objects.filter(session_key__in=session_keys).delete()
+            PrincipalSession.objects.filter(session_key__in=session_keys).delete()
+        RefreshToken.objects.filter(principal=principal).delete()
+        revoke_principal(principal)
+    return session_keys
+
+
+async def alogout_everywhere(principal: str) -> Counter[str]:
+    """Ends all sessions & tokens of a principal, and deletes its session passwords.
+
+    Returns the number of ended sessions, of deleted session passwords, and of the
+    failed canister calls.
+    """
+    session_keys = await sync_to_async(end_sessions)(principal)
+    for session_key in session_keys:
+        session_cache.invalidate(session_key)
+    verified_credentials.invalidate(principal)
+    await arelease_principal(principal)
+
+    semaphore = asyncio.Semaphore(settings.SESSION_CLEANUP_CONCURRENCY)
+    results = await asyncio.gather(
+        *(delete_session_password(key, semaphore, principal) for key in session_keys)
+    )
+    return Counter(
+        sessions=len(session_keys),
+        session_passwords=sum(result is True for result in results),
+        failed=sum(result is None for result in results),
+    )
+
+
+async def arebalance(previous_ids: list[str], dry_run: bool = False) -> Counter[str]:
+    """Deletes the session passwords of the principals moved away from their
+    canister in previous_ids, by the current CANISTER_MOTOKO_IDS.
+
+    Returns the number of indexed principals & of the moved ones, of their
+    sessions, of the deleted session passwords, and of the failed canister calls.
+    A dry run only counts.
+    """
+    previous = HashRing(previous_ids)
+    principals: set[str] = set()
+    moved: set[str] = set()
+    # session_key -> the previous canister id of its moved principal
+    moved_sessions: dict[str, str] = {}
+    async for principal, session_key in PrincipalSession.objects.order_by(
+        "principal"
+    ).values_list("principal", "session_key"):
+        principals.add(principal)
+        canister_id = previous.shard_for(principal)
+        if canister_id != shard_for(principal):
+            moved.add(principal)
+            moved_sessions[session_key] = canister_id
+
+    counts = Counter(
+        principals=len(principals),
+        moved=len(moved),
+        sessions=len(moved_sessions),
+        session_passwords=0,
+        failed=0,
+    )
+    if dry_run:
+        return counts
+    semaphore = asyncio.Semaphore(settings.SESSION_CLEANUP_CONCURRENCY)
+    results = await asyncio.gather(
+        *(
+            delete_session_password(key, semaphore, canister_id=canister_id)
+            for key, canister_id in moved_sessions.items()
+        )
+    )
+    counts["session_passwords"] = sum(result is True for result in results)
+    counts["failed"] = sum(result is None for result in results)
+    return counts
@@ -0,0 +1,98 @@
+"""Rotating refresh tokens, to renew JWTs without a canister call.
+
+A refresh token is an opaque random string. Only its sha256 hash is stored, in the
+RefreshToken table, so a leaked table does not leak usable tokens.
+"""
+
+import datetime
+import hashlib
+import logging
+import secrets
+import uuid
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+
+def hash_token(token: str) -> str:
+    """Returns the hash of a refresh token, as stored in the database"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue(principal: str, family: Optional[uuid.UUID] = None) -> tuple[str, uuid.UUID]:
+    """Issues a refresh token for the principal, in a new family unless given.
+
+    Returns the token & its family.
+    """
+    token = secrets.token_urlsafe(32)
+    refresh_token = RefreshToken.objects.create(
+        token_hash=hash_token(token),
+        family=family or uuid.uuid4(),
+        principal=principal,
+        expires_at=timezone.now()
+        + datetime.timedelta(seconds=settings.JWT_REFRESH_TOKEN_AGE),
+    )
+    return token, refresh_token.family
+
+
+async def aissue(principal: str) -> tuple[str, uuid.UUID]:
+    """Async version of issue, for a new family"""
+    token = secrets.token_urlsafe(32)
+    refresh_token = await RefreshToken.objects.acreate(
+        token_hash=hash_token(token),
+        family=uuid.uuid4(),
+        principal=principal,
+        expires_at=timezone.now()
+        + datetime.timedelta(seconds=settings.JWT_REFRESH_TOKEN_AGE),
+    )
+    return token, refresh_token.family
+
+
+def rotate(token: str) -> Optional[tuple[str, str]]:
+    """Uses up a refresh token & issues the next one of its family.
+
+    Returns the principal & the new refresh token, or None if the token is not valid.
+    """
+    with transaction.atomic():
+        refresh_token = (
+            RefreshToken.objects.select_for_update()
+            .filter(token_hash=hash_token(token))
+            .first()
+        )
+        if refresh_token is None:
+            return None
+
+        if refresh_token.used:
+            logger.warning(
+                "Refresh token reused, revoking its family",
+                extra={
+                    "principal": refresh_token.principal,
+                    "family": refresh_token.family,
+                },
+            )
+            revoke_family(refresh_token.family)
+            return None
+
+        if refresh_token.expires_at <= timezone.now():
+            return None
+
+        refresh_token.used = True
+        refresh_token.save(update_fields=["used"])
+        new_token, _ = issue(refresh_token.principal, refresh_token.family)
+    return refresh_token.principal, new_token
+
+
+def revoke_family(family: uuid.UUID) -> None:
+    """Revokes all refresh tokens of a family, eg. at logout"""
+    RefreshToken.objects.filter(family=family).delete()
+
+
+async def arevoke_family(family: uuid.UUID) -> None:
+    """Async version of revoke_family"""
+    await RefreshToken.objects.filter(family=family).adelete()
@@ -0,0 +1,127 @@
+"""Resilience of the calls to canister_motoko, so a slow or failing IC can not stall
+the workers. Used by CanisterMotoko:
+
+(-) deadlines: every call is cancelled after CANISTER_MOTOKO_TIMEOUT seconds, or
+               after the timeout of its method in CANISTER_MOTOKO_TIMEOUTS
+(-) CircuitBreaker: after a number of consecutive failures, calls fail fast for a
+                    while, instead of piling up on an unhealthy IC
+(-) hedged: an idempotent call that has no reply after a delay is sent again, and
+            the first reply wins, so a slow replica does not set the tail latency
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitBreaker:
+    """Fails fast while the calls keep failing.
+
+    (-) closed: calls go through. `threshold` consecutive failures open the circuit.
+    (-) open: calls are refused, for `reset_timeout` seconds.
+    (-) half-open: one trial call goes through. Success closes the circuit, failure
+                   opens it again.
+
+    A threshold of 0 disables the circuit breaker.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name: str, threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Returns True if a call may go through"""
+        if self.state == self.CLOSED:
+            return True
+        with self.lock:
+            if self.state == self.OPEN and self.retry_after() == 0:
+                # This caller makes the trial call
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """Returns the seconds until the next trial call"""
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self) -> None:
+        """Records a successful call"""
+        if self.state == self.CLOSED and not self.failures:
+            return
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self.state = self.CLOSED
+                logger.info("Circuit closed", extra={"circuit": self.name})
+
+    def record_failure(self) -> None:
+        """Records a failed call, and opens the circuit at the threshold"""
+        if not self.threshold:
+            return
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                logger.warning(
+                    "Circuit opened",
+                    extra={"circuit": self.name, "failures": self.failures},
+                )
+
+
+async def hedged(
+    call: Callable[[], Awaitable[T]], delay: float, attempts: int = 2
+) -> T:
+    """Awaits call(), and calls it again when there is no reply after `delay` seconds,
+    or when it fails, up to `attempts` calls in flight.
+
+    Returns the first reply. The other calls are cancelled. Raises the exception of
+    the last failed call if all of them fail.
+    """
+    pending: set["asyncio.Future[T]"] = set()
+    error: Optional[BaseException] = None
+    try:
+        for attempt in range(attempts):
+            pending.add(asyncio.ensure_future(call()))
+            timeout = None if attempt == attempts - 1 else delay
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                if not done or not pending:
+                    # No reply yet, or all calls failed: send the next one
+                    break
+        assert error is not None
+        raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def method_timeout(
+    method_name: str, timeouts: dict[str, float], default: float
+) -> Optional[float]:
+    """Returns the timeout of a method in seconds, or None for no timeout"""
+    timeout = timeouts.get(method_name, default)
+    return timeout if timeout > 0 else None
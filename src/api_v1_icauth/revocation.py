@@ -0,0 +1,220 @@
+"""Revocation of JWTs before they expire, eg. at logout.
+
+The `jti` of a revoked token is inserted in the RevokedToken table. Every worker
+process keeps the revoked jti's in memory, in a RevocationList:
+(-) a Bloom filter, that answers "not revoked" for almost all tokens in O(1)
+(-) an exact set, that rules out the false positives of the Bloom filter
+
+A row with a principal revokes all JWTs of the principal issued before it, eg. at a
+logout everywhere. A JWT lives JWT_ACCESS_TOKEN_AGE seconds, so those are the JWTs
+of the principal that expire up to now + JWT_ACCESS_TOKEN_AGE. The RevocationList
+keeps that cutoff per principal, next to the jti's.
+
+A RevocationList syncs incrementally from the table, reading only the rows above
+its high-water mark, at most every JWT_REVOCATION_SYNC_INTERVAL seconds. The sync is
+triggered by JWTAuthenticationMiddleware, so a revocation reaches all workers within
+that interval, and checking a token never queries the database.
+
+The rows of expired tokens are deleted by the session cleanup, as an expired token
+fails verification anyway.
+"""
+
+import datetime
+import hashlib
+import math
+import secrets
+import threading
+import time
+from typing import Any, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import RevokedToken
+
+# Rows below the high-water mark that are read again, because ids of concurrent
+# inserts may be committed out of order
+SYNC_OVERLAP = 100
+
+SYNC_BATCH_SIZE = 10_000
+
+# Seconds between prunes of the expired jti's
+PRUNE_INTERVAL = 60.0
+
+
+class BloomFilter:
+    """A Bloom filter of strings, sized for `capacity` items at `error_rate`"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01) -> None:
+        self.size = max(
+            8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )  # bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: str) -> list[int]:
+        """Returns the bit positions of an item, by double hashing"""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        """Adds an item"""
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(item)
+        )
+
+
+class RevocationList:
+    """The revoked jti's of unexpired tokens, synced from the RevokedToken table"""
+
+    def __init__(self) -> None:
+        self.capacity = settings.JWT_REVOCATION_CAPACITY
+        self.bloom = BloomFilter(self.capacity)
+        # jti -> expiry time, as a unix timestamp
+        self.revoked: dict[str, float] = {}
+        # principal -> expiry time of the last revoked token, as a unix timestamp
+        self.principals: dict[str, float] = {}
+        self.high_water = 0
+        self.synced_at = 0.0
+        self.pruned_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        """Returns True if the token with this jti is revoked. No database access."""
+        if jti is None or jti not in self.bloom:
+            return False
+        return jti in self.revoked
+
+    def is_principal_revoked(self, principal: Optional[str], expires_at: float) -> bool:
+        """Returns True if the tokens of the principal expiring then are revoked"""
+        return expires_at <= self.principals.get(principal or "", 0.0)
+
+    def is_token_revoked(self, claims: dict[str, Any]) -> bool:
+        """Returns True if the token with these claims is revoked, by jti or principal"""
+        return self.is_revoked(claims.get("jti")) or self.is_principal_revoked(
+            claims.get("sub"), claims.get("exp", 0.0)
+        )
+
+    def add(self, jti: str, expires_at: float) -> None:
+        """Adds a revoked jti, in this worker only"""
+        self.revoked[jti] = expires_at
+        self.bloom.add(jti)
+
+    def add_principal(self, principal: str, expires_at: float) -> None:
+        """Revokes the tokens of a principal expiring up to expires_at, in this worker"""
+        self.principals[principal] = max(
+            expires_at, self.principals.get(principal, 0.0)
+        )
+
+    def sync_due(self) -> bool:
+        """Returns True if the last sync is more than the sync interval ago"""
+        return (
+            time.monotonic() - self.synced_at >= settings.JWT_REVOCATION_SYNC_INTERVAL
+        )
+
+    def sync(self) -> None:
+        """Reads the revocations since the last sync, and prunes the expired ones"""
+        if not self.lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+            # Another thread is syncing
+            return
+        try:
+            if not self.sync_due():
+                # Synced by an earlier call, eg. of a concurrent request
+                return
+            self.synced_at = time.monotonic()
+            while True:
+                rows = list(
+                    RevokedToken.objects.filter(
+                        id__gt=self.high_water - SYNC_OVERLAP,
+                        expires_at__gt=timezone.now(),
+                    )
+                    .order_by("id")
+                    .values_list("id", "jti", "principal", "expires_at")[
+                        :SYNC_BATCH_SIZE
+                    ]
+                )
+                for row_id, jti, principal, expires_at in rows:
+                    if principal:
+                        self.add_principal(principal, expires_at.timestamp())
+                    else:
+                        self.add(jti, expires_at.timestamp())
+                    self.high_water = max(self.high_water, row_id)
+                if len(rows) < SYNC_BATCH_SIZE:
+                    break
+            if (
+                len(self.revoked) > self.capacity
+                or self.synced_at - self.pruned_at >= PRUNE_INTERVAL
+            ):
+                self.prune()
+        finally:
+            self.lock.release()
+
+    def prune(self) -> None:
+        """Drops the expired jti's, and rebuilds the Bloom filter without them"""
+        self.pruned_at = time.monotonic()
+        now = time.time()
+        revoked = {
+            jti: expires_at
+            for jti, expires_at in list(self.revoked.items())
+            if expires_at > now
+        }
+        self.capacity = max(self.capacity, 2 * len(revoked))
+        bloom = BloomFilter(self.capacity)
+        for jti in revoked:
+            bloom.add(jti)
+        # Set the filter first, so a jti is never in the set but not in the filter
+        self.bloom, self.revoked = bloom, revoked
+        self.principals = {
+            principal: expires_at
+            for principal, expires_at in list(self.principals.items())
+            if expires_at > now
+        }
+
+
+revocation_list = RevocationList()
+
+
+def revoke(jti: str, expires_at: float) -> None:
+    """Revokes the token with this jti, until it expires, in all workers"""
+    RevokedToken.objects.get_or_create(
+        jti=jti,
+        defaults={
+            "expires_at": datetime.datetime.fromtimestamp(
+                expires_at, tz=datetime.timezone.utc
+            )
+        },
+    )
+    revocation_list.add(jti, expires_at)
+
+
+async def arevoke(jti: str, expires_at: float) -> None:
+    """Async version of revoke"""
+    await RevokedToken.objects.aget_or_create(
+        jti=jti,
+        defaults={
+            "expires_at": datetime.datetime.fromtimestamp(
+                expires_at, tz=datetime.timezone.utc
+            )
+        },
+    )
+    revocation_list.add(jti, expires_at)
+
+
+def revoke_principal(principal: str) -> None:
+    """Revokes all tokens issued to the principal until now, in all workers"""
+    expires_at = time.time() + settings.JWT_ACCESS_TOKEN_AGE
+    RevokedToken.objects.create(
+        jti=secrets.token_urlsafe(16),
+        principal=principal,
+        expires_at=datetime.datetime.fromtimestamp(
+            expires_at, tz=datetime.timezone.utc
+        ),
+    )
+    revocation_list.add_principal(principal, expires_at)
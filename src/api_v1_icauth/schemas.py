@@ -8,3 +8,9 @@ class BodyLoginSchema(Schema):
 
     principal: str
     session_password: str
+
+
+class BodyRefreshSchema(Schema):
+    """Defines schema for the body of a POST /refresh request."""
+
+    refresh: str
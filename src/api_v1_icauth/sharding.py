@@ -0,0 +1,76 @@
+"""Sharding of the principals over several canister_motoko canisters.
+
+The session passwords of a principal live in one canister, its shard. With
+CANISTER_MOTOKO_IDS, the principals are mapped to the canisters by consistent
+hashing (HashRing): every canister owns the arcs of a hash ring before its
+SHARD_VNODES points. Adding a canister only moves the principals of the arcs that
+it takes over, about 1/N of them, all to the new canister.
+
+The dApp creates the session password of a principal in its shard, which it gets
+from GET /api/v1/icauth/shard. The principals moved by a change of the canisters
+are cleaned up with the rebalance_canisters command.
+"""
+
+import bisect
+import functools
+import hashlib
+from typing import Any
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Points of every canister on the hash ring. More points spread the principals
+# more evenly.
+SHARD_VNODES = 160
+
+
+def ring_hash(key: str) -> int:
+    """Returns the position of a key on the hash ring"""
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+
+class HashRing:  # pylint: disable=too-few-public-methods
+    """A consistent hash ring of canister ids"""
+
+    def __init__(self, canisters: list[str]) -> None:
+        if not canisters:
+            raise ValueError("A hash ring needs at least one canister")
+        self.canister_ids = list(canisters)
+        points = sorted(
+            (ring_hash(f"{canister_id}#{vnode}"), canister_id)
+            for canister_id in self.canister_ids
+            for vnode in range(SHARD_VNODES)
+        )
+        self.points = [point for point, _ in points]
+        self.owners = [canister_id for _, canister_id in points]
+
+    def shard_for(self, principal: str) -> str:
+        """Returns the canister id of the principal: the next point on the ring"""
+        if len(self.canister_ids) == 1:
+            return self.canister_ids[0]
+        index = bisect.bisect(self.points, ring_hash(principal)) % len(self.points)
+        return self.owners[index]
+
+
+def canister_ids() -> list[str]:
+    """Returns the ids of the canisters the principals are sharded over"""
+    return settings.CANISTER_MOTOKO_IDS or [settings.CANISTER_MOTOKO_ID]
+
+
+@functools.lru_cache(maxsize=None)
+def get_ring() -> HashRing:
+    """Returns the hash ring of the canisters, created on first use"""
+    return HashRing(canister_ids())
+
+
+def shard_for(principal: str) -> str:
+    """Returns the id of the canister that holds the session passwords of a principal"""
+    return get_ring().shard_for(principal)
+
+
+@receiver(setting_changed)
+def reset_ring(*, setting: str, **kwargs: Any) -> None:
+    """Creates a new hash ring when the canister ids change (in tests)"""
+    if setting in ("CANISTER_MOTOKO_ID", "CANISTER_MOTOKO_IDS"):
+        get_ring.cache_clear()
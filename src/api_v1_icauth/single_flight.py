@@ -0,0 +1,171 @@
+"""Single-flight of the session password checks of identical, concurrent
+authentications by PrincipalBackend.aauthenticate.
+
+Retries & multiple tabs of a dApp send the same credentials several times. Instead
+of a session_password_check on the canister per request:
+(-) within a worker, identical checks share one in-flight call (SingleFlight)
+(-) across workers, with LOGIN_CLAIM_TTL, the first one inserts a LoginClaim. The
+    others wait for its result, and reuse it until the claim expires,
+    LOGIN_CLAIM_TTL seconds later. This costs every check a few queries, so it is
+    off by default.
+
+A check that fails with an exception releases its claim, so the next identical
+authentication checks again. A logout releases the claims of the principal. The
+expired claims are deleted by the session cleanup.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .credentials import credential_key
+from .models import LoginClaim
+from .resilience import method_timeout
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reads of a LoginClaim of another worker
+CLAIM_POLL_INTERVAL = 0.05
+
+# Seconds a claim of a check in flight is honoured, if there is no call deadline
+CLAIM_TIMEOUT_DEFAULT = 30.0
+
+
+class SingleFlight:
+    """Runs one call at a time per key; concurrent callers of a key share its result"""
+
+    def __init__(self) -> None:
+        self.flights: dict[str, "asyncio.Task[bool]"] = {}
+
+    async def run(self, key: str, call: Callable[[], Awaitable[bool]]) -> bool:
+        """Returns the result of call(), or of the call in flight for the key"""
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.flights[key] = task
+            task.add_done_callback(lambda done: self.done(key, done))
+        else:
+            logger.debug("Joined a check in flight")
+        # A cancelled caller does not cancel the call of the others
+        return await asyncio.shield(task)
+
+    def done(self, key: str, task: "asyncio.Task[bool]") -> None:
+        """Forgets the call, and retrieves its exception if no caller did"""
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        if not task.cancelled():
+            task.exception()
+
+
+session_password_checks = SingleFlight()
+
+
+def claim(key: str, principal: str, timeout: float) -> tuple[bool, Optional[bool]]:
+    """Claims the check of a key of the principal for `timeout` seconds.
+
+    Returns (True, None) if claimed, or (False, result) if another worker claimed it,
+    where result is None while the check of the other worker runs.
+    """
+    now = timezone.now()
+    row = LoginClaim.objects.filter(key=key).values_list("verified", "expires_at")
+    existing = row.first()
+    if existing is not None and existing[1] > now:
+        return False, existing[0]
+
+    if existing is not None:
+        LoginClaim.objects.filter(key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            LoginClaim.objects.create(
+                key=key,
+                principal=principal,
+                expires_at=now + datetime.timedelta(seconds=timeout),
+            )
+    except IntegrityError:
+        # Claimed by a concurrent request
+        return False, None
+    return True, None
+
+
+def complete(key: str, verified: bool) -> None:
+    """Stores the result of a claimed check, for LOGIN_CLAIM_TTL seconds"""
+    LoginClaim.objects.filter(key=key).update(
+        verified=verified,
+        expires_at=timezone.now()
+        + datetime.timedelta(seconds=settings.LOGIN_CLAIM_TTL),
+    )
+
+
+def release(key: str) -> None:
+    """Deletes the claim of a check that failed"""
+    LoginClaim.objects.filter(key=key, verified__isnull=True).delete()
+
+
+async def arelease_principal(principal: str) -> None:
+    """Deletes the claims of a principal at its logout, so its next login is checked
+    by the canister
+    """
+    if settings.LOGIN_CLAIM_TTL > 0:
+        await LoginClaim.objects.filter(principal=principal).adelete()
+
+
+async def apurge_expired_claims() -> int:
+    """Deletes the expired claims, and returns their number"""
+    deleted, _ = await LoginClaim.objects.filter(
+        expires_at__lte=timezone.now()
+    ).adelete()
+    return deleted
+
+
+async def check_claimed(
+    key: str, principal: str, check: Callable[[], Awaitable[bool]]
+) -> bool:
+    """Returns the result of check(), or of the same check by another worker"""
+    if settings.LOGIN_CLAIM_TTL <= 0:
+        return await check()
+
+    timeout = (
+        method_timeout(
+            "session_password_check",
+            settings.CANISTER_MOTOKO_TIMEOUTS,
+            settings.CANISTER_MOTOKO_TIMEOUT,
+        )
+        or CLAIM_TIMEOUT_DEFAULT
+    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        claimed, verified = await sync_to_async(claim)(key, principal, timeout)
+        if claimed:
+            break
+        if verified is not None:
+            logger.debug("Reused the check of another worker")
+            return verified
+        if loop.time() > deadline:
+            # The claimant is stuck or gone
+            break
+        await asyncio.sleep(CLAIM_POLL_INTERVAL)
+
+    try:
+        verified = await check()
+    except BaseException:
+        await sync_to_async(release)(key)
+        raise
+    await sync_to_async(complete)(key, verified)
+    return verified
+
+
+async def check_session_password(
+    principal: str, password: str, check: Callable[[], Awaitable[bool]]
+) -> bool:
+    """Returns the result of check(), shared by identical concurrent logins"""
+    key = credential_key(principal, password)
+    return await session_password_checks.run(
+        key, lambda: check_claimed(key, principal, check)
+    )
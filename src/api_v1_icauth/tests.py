@@ -5,18 +5,1212 @@ https://docs.djangoproject.com/en/4.0/topics/testing/tools/
 https://docs.djangoproject.com/en/4.0/topics/testing/tools/#testing-asynchronous-code
 """
 
-from django.test import TestCase, AsyncClient  # type: ignore[attr-defined]
+import asyncio
+import base64
+import datetime
+import json
+import logging
+import pickle
+import tempfile
+import time
+from collections import Counter
+from io import StringIO
+from pathlib import Path
+from typing import Any, Mapping
 
+import jwt
+from aiohttp.test_utils import TestServer
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import (  # type: ignore[attr-defined]
+    AsyncClient,
+    SimpleTestCase,
+    TestCase,
+)
+from django.test.utils import override_settings
+from django.utils import timezone
+from ic.agent import Agent  # type: ignore
+from ic.client import Client  # type: ignore
+from ic.identity import Identity  # type: ignore
+from project.lifespan import LifespanApplication, Readiness, readiness
+from project.log import SamplingFilter, StructuredFormatter
+from project.metrics import Histogram, Registry
+from project.sessions.cached_db import SessionStore, session_cache
+from project.sessions.signed_cookies import SessionStore as SignedCookieStore
 
-class ApiV1IcauthTestCase(TestCase):
+from .backends import PrincipalBackend
+from .canister_motoko import (
+    AsyncCanister,
+    CachedCanister,
+    CanisterError,
+    close_http_session,
+    get_call_modes,
+    get_canister_motoko_did,
+    get_circuit_breaker,
+    get_http_session,
+    get_identity,
+    get_transport,
+    load_candid,
+)
+from .cleanup import purge_expired_sessions
+from .credentials import credential_key, verified_credentials
+from .ic_standin import IcStandin
+from .resilience import CircuitBreaker, hedged
+from .models import LoginClaim, PrincipalSession, RefreshToken, RevokedToken
+from .principal_sessions import arebalance
+from .refresh_tokens import aissue
+from .revocation import (
+    BloomFilter,
+    RevocationList,
+    revocation_list,
+    revoke,
+    revoke_principal,
+)
+from .sharding import HashRing, shard_for
+from .single_flight import claim, complete
+from .tokens import create_jwt, get_signing_keys, verified_tokens, verify_jwt
+from .transports import InMemoryTransport
+from .users import aprovision_user, provision_user, user_cache
+
+
+def use_temporary_candid_cache(test_class: type[SimpleTestCase]) -> None:
+    """Caches the candid parsed by the tests of a class in a temporary directory,
+    rather than in CANDID_CACHE_DIR. Called by its setUpClass.
+    """
+    cache_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+    test_class.addClassCleanup(cache_dir.cleanup)
+    candid_cache = override_settings(CANDID_CACHE_DIR=cache_dir.name)
+    candid_cache.enable()
+    test_class.addClassCleanup(candid_cache.disable)
+
+
+@override_settings(
+    CANISTER_MOTOKO_TRANSPORT="api_v1_icauth.transports.InMemoryTransport"
+)
+class ApiV1IcauthTestCase(TestCase):  # pylint: disable=too-many-public-methods
     """Unit tests"""
 
     def setUp(self) -> None:
-        """Every api test needs a client"""
+        """Every api test needs a client & a fresh in-memory canister"""
         self.async_client = AsyncClient()
+        # The users & sessions of earlier tests are rolled back
+        user_cache.clear()
+        session_cache.clear()
+        get_transport.cache_clear()
+        transport = get_transport()
+        assert isinstance(transport, InMemoryTransport)
+        self.transport = transport
 
     async def test_api_v1_icauth_health(self) -> None:
         """Test api/v1/icauth/health"""
         response = await self.async_client.get("/api/v1/icauth/health")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json().get("status"), "ok")
+
+    async def test_http_session_is_shared(self) -> None:
+        """The asyncio canister client reuses one connection pool per event loop"""
+        session = get_http_session()
+        self.assertIs(get_http_session(), session)
+        await close_http_session()
+        self.assertTrue(session.closed)
+        self.assertIsNot(get_http_session(), session)
+        await close_http_session()
+
+    async def test_api_v1_icauth_login(self) -> None:
+        """Test api/v1/icauth/login, with the session password of the principal"""
+        password = self.transport.create_session_password("principal-1")
+        response = await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": password},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("jwt", response.json())
+        self.assertIn("sessionid", response.cookies)
+
+        # A login saves the session_key, which checks the session password, nothing
+        # else
+        self.assertEqual(self.transport.calls, {"save_django_session_key": 1})
+        self.assertEqual(
+            self.transport.state.session_keys,
+            {response.cookies["sessionid"].value: "principal-1"},
+        )
+
+    async def test_login_replaces_session_of_other_principal(self) -> None:
+        """A login into the session of another principal indexes the new session"""
+        await self.login("principal-1")
+        await self.login("principal-2")
+        session_key = self.async_client.cookies["sessionid"].value
+        self.assertEqual(
+            [
+                (ps.principal, ps.session_key)
+                async for ps in PrincipalSession.objects.all()
+            ],
+            [("principal-2", session_key)],
+        )
+        self.assertEqual(self.transport.state.session_keys[session_key], "principal-2")
+
+    async def test_login_into_own_session(self) -> None:
+        """A login into the session of the same principal keeps its session_key"""
+        await self.login("principal-1")
+        session_key = self.async_client.cookies["sessionid"].value
+        await self.login("principal-1")
+        self.assertEqual(self.async_client.cookies["sessionid"].value, session_key)
+        self.assertEqual(self.transport.calls, {"save_django_session_key": 2})
+        self.assertEqual(await PrincipalSession.objects.acount(), 1)
+
+    async def test_api_v1_icauth_login_wrong_password(self) -> None:
+        """Test api/v1/icauth/login, with a wrong session password"""
+        self.transport.create_session_password("principal-1")
+        response = await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": "wrong"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.transport.calls, {"save_django_session_key": 1})
+        self.assertEqual(self.transport.state.session_keys, {})
+
+    async def test_login_session_key_not_saved(self) -> None:
+        """A login fails if the canister does not save its session_key"""
+        body = {"principal": "principal-1", "session_password": "wrong"}
+        response = await self.async_client.post(
+            "/api/v1/icauth/login", body, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.transport.error_rate = 1.0
+        response = await self.async_client.post(
+            "/api/v1/icauth/login", body, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 503)
+
+        response = await self.async_client.get("/api/v1/icauth/me")
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(await PrincipalSession.objects.aexists())
+
+    async def test_api_v1_icauth_logout(self) -> None:
+        """Test api/v1/icauth/logout deletes the session password in the canister"""
+        password = self.transport.create_session_password("principal-1")
+        await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": password},
+            content_type="application/json",
+        )
+        response = await self.async_client.post("/api/v1/icauth/logout")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.transport.state.session_passwords, {})
+
+    @override_settings(LOGIN_CACHE_TTL=60.0, LOGIN_CLAIM_TTL=0.0)
+    async def test_login_verified_credential_cache(self) -> None:
+        """A repeat authentication skips the canister check, until the logout"""
+        password = self.transport.create_session_password("principal-1")
+        body = {"principal": "principal-1", "session_password": password}
+        for _ in range(2):
+            user = await PrincipalBackend().aauthenticate(
+                None, username="principal-1", password=password
+            )
+            assert user is not None
+            self.assertEqual(user.get_username(), "principal-1")
+        self.assertEqual(self.transport.calls["session_password_check"], 1)
+        self.assertEqual(verified_credentials.hits, 1)
+
+        await self.async_client.post(
+            "/api/v1/icauth/login", body, content_type="application/json"
+        )
+        await self.async_client.post("/api/v1/icauth/logout")
+        self.assertFalse(verified_credentials.get("principal-1", password))
+
+    async def login(self, principal: str) -> str:
+        """Logs the principal in with self.async_client & returns the JWT"""
+        password = self.transport.create_session_password(principal)
+        response = await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": principal, "session_password": password},
+            content_type="application/json",
+        )
+        token: str = response.json()["jwt"]
+        return token
+
+    async def refresh(self, token: str) -> Any:
+        """Posts the refresh token to api/v1/icauth/refresh"""
+        return await self.async_client.post(
+            "/api/v1/icauth/refresh",
+            {"refresh": token},
+            content_type="application/json",
+        )
+
+    async def test_api_v1_icauth_refresh(self) -> None:
+        """Test api/v1/icauth/refresh rotates the refresh token, without the canister"""
+        password = self.transport.create_session_password("principal-1")
+        response = await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": password},
+            content_type="application/json",
+        )
+        first = response.json()["refresh"]
+        calls = dict(self.transport.calls)
+
+        response = await self.refresh(first)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(verify_jwt(response.json()["jwt"])["sub"], "principal-1")  # type: ignore[index] # pylint: disable=line-too-long
+        second = response.json()["refresh"]
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.transport.calls, calls)
+
+        # Reuse of a used token revokes the family, including the newest token
+        self.assertEqual((await self.refresh(first)).status_code, 401)
+        self.assertEqual((await self.refresh(second)).status_code, 401)
+        self.assertEqual((await self.refresh("unknown")).status_code, 401)
+
+    async def test_api_v1_icauth_logout_revokes_refresh_token(self) -> None:
+        """Test api/v1/icauth/logout revokes the refresh tokens of the login"""
+        password = self.transport.create_session_password("principal-1")
+        response = await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": password},
+            content_type="application/json",
+        )
+        token = response.json()["refresh"]
+        await self.async_client.post("/api/v1/icauth/logout")
+        self.assertEqual((await self.refresh(token)).status_code, 401)
+
+    async def test_purge_expired_refresh_tokens(self) -> None:
+        """The expired refresh tokens, used or not, are deleted in chunks"""
+        for _ in range(5):
+            token, _ = await aissue("principal-1")
+            await self.refresh(token)
+        unused = [
+            pk
+            async for pk in RefreshToken.objects.filter(used=False)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        ]
+        await RefreshToken.objects.filter(Q(used=True) | Q(pk__in=unused[:2])).aupdate(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+        counts = await purge_expired_sessions(batch_size=3)
+        self.assertEqual(counts["refresh_tokens"], 7)
+        self.assertEqual(
+            [
+                pk
+                async for pk in RefreshToken.objects.order_by("pk").values_list(
+                    "pk", flat=True
+                )
+            ],
+            unused[2:],
+        )
+
+    def test_api_v1_icauth_me_by_jwt(self) -> None:
+        """Test api/v1/icauth/me with a bearer JWT, without database access.
+
+        A sync test, because assertNumQueries can not be used in async tests.
+        """
+        token = async_to_sync(self.login)("principal-1")
+        verified_tokens.clear()
+        revocation_list.sync()
+        with self.assertNumQueries(0):
+            for _ in range(2):
+                response = self.client.get(
+                    "/api/v1/icauth/me", headers={"Authorization": f"Bearer {token}"}
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), {"principal": "principal-1"})
+        # The signature is checked once
+        self.assertEqual((verified_tokens.hits, verified_tokens.misses), (1, 1))
+
+        response = self.client.get(
+            "/api/v1/icauth/me", headers={"Authorization": f"Bearer {token}x"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_async_login(self) -> None:
+        """A login & logout use the async session & ORM, and keep the user cached"""
+        await self.login("principal-1")
+        session_key = self.async_client.cookies["sessionid"].value
+        session = await Session.objects.aget(session_key=session_key)
+        user = await get_user_model().objects.aget(username="principal-1")
+        self.assertEqual(session.get_decoded()["_auth_user_id"], str(user.pk))
+        self.assertIsNotNone(user.last_login)
+
+        # Updating last_login does not drop the user from the cache
+        response = await self.async_client.get("/api/v1/icauth/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_cache.hits, 1)
+
+        await self.async_client.post("/api/v1/icauth/logout")
+        self.assertFalse(
+            await Session.objects.filter(session_key=session_key).aexists()
+        )
+
+    async def test_async_session_store(self) -> None:
+        """The async methods of the SessionStore"""
+        store = SessionStore()
+        store["key"] = "value"
+        await store.asave()
+        session_key = store.session_key
+        self.assertEqual(await SessionStore(session_key).aget("key"), "value")
+
+        await store.acycle_key()
+        self.assertNotEqual(store.session_key, session_key)
+        self.assertEqual(await SessionStore(session_key).aload(), {})
+        self.assertTrue(await SessionStore(store.session_key).ahas_key("key"))
+
+        await store.aflush()
+        self.assertIsNone(store.session_key)
+        self.assertEqual(await Session.objects.acount(), 0)
+
+    @override_settings(SESSION_CACHE_TTL=10.0, SESSION_TOUCH_INTERVAL=3600.0)
+    def test_session_cache(self) -> None:
+        """Sessions are cached, written through, and their expiry updated in batches"""
+        store = SessionStore()
+        store["key"] = "value"
+        store.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(SessionStore(store.session_key)["key"], "value")
+
+        # A save of the unchanged session only queues its new expiry
+        store = SessionStore(store.session_key)
+        with self.assertNumQueries(0):
+            store.save()
+        assert store.session_key is not None
+        expire_date = session_cache.touched[store.session_key]
+        session_cache.touch_interval = 0.0
+        with self.assertNumQueries(1):
+            SessionStore(store.session_key).save()
+        self.assertEqual(session_cache.touched, {})
+        self.assertGreater(
+            Session.objects.get(session_key=store.session_key).expire_date,
+            expire_date,
+        )
+
+        store["key"] = "changed"
+        store.save()
+        session_cache.clear()
+        self.assertEqual(SessionStore(store.session_key)["key"], "changed")
+        store.delete()
+        self.assertEqual(SessionStore(store.session_key).load(), {})
+
+    async def test_signed_cookie_sessions(self) -> None:
+        """A signed cookie session keeps its data in the session key"""
+        store = SignedCookieStore()
+        store["key"] = "value"
+        await store.asave()
+        session_key = str(store.session_key)
+        self.assertEqual(await SignedCookieStore(session_key).aget("key"), "value")
+        self.assertEqual(await SignedCookieStore(session_key + "x").aload(), {})
+
+        with override_settings(SESSION_ENGINE="project.sessions.signed_cookies"):
+            self.async_client = AsyncClient()
+            await self.login("principal-1")
+            response = await self.async_client.get("/api/v1/icauth/me")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Session.objects.acount(), 0)
+
+    def test_purge_expired_sessions(self) -> None:
+        """Expired sessions & their session passwords are deleted in chunks"""
+        for principal in ("principal-1", "principal-2", "principal-3"):
+            if principal == "principal-3":
+                Session.objects.update(
+                    expire_date=timezone.now() - datetime.timedelta(days=1)
+                )
+            self.async_client = AsyncClient()
+            async_to_sync(self.login)(principal)
+        self.assertEqual(len(self.transport.state.session_passwords), 3)
+
+        self.transport.error_rate = 1.0
+        out = StringIO()
+        call_command("purge_expired_sessions", batch_size=1, stdout=out)
+        self.assertIn("Deleted 0 sessions", out.getvalue())
+        self.assertEqual(Session.objects.count(), 3)
+
+        self.transport.error_rate = 0.0
+        get_circuit_breaker.cache_clear()
+        out = StringIO()
+        call_command("purge_expired_sessions", batch_size=1, stdout=out)
+        self.assertIn("Deleted 2 sessions & 2 session passwords", out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(list(self.transport.state.session_passwords), ["principal-3"])
+        self.assertEqual(PrincipalSession.objects.count(), 1)
+
+    @override_settings(SESSION_CACHE_TTL=10.0)
+    def test_user_cache(self) -> None:
+        """A session request loads the user from the user cache, until it is saved"""
+        async_to_sync(self.login)("principal-1")
+        self.client.cookies = self.async_client.cookies
+        user_cache.clear()
+        session_cache.clear()
+        for queries in (2, 0):
+            # The session & the user on a cache miss, then both from the caches
+            with self.assertNumQueries(queries):
+                response = self.client.get("/api/v1/icauth/me")
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual((user_cache.hits, user_cache.misses), (1, 1))
+
+        user = PrincipalBackend().get_user(response.wsgi_request.user.pk)
+        assert user is not None
+        user.save()
+        with self.assertNumQueries(1):
+            self.assertIsNotNone(PrincipalBackend().get_user(user.pk))
+        self.assertEqual((user_cache.hits, user_cache.misses), (2, 2))
+
+    def test_provision_user(self) -> None:
+        """A user is created or read in one statement, on PostgreSQL"""
+        queries = 1 if connection.vendor == "postgresql" else 2
+        with self.assertNumQueries(queries):
+            user = provision_user("principal-1")
+        self.assertTrue(user.is_active)
+        self.assertFalse(user.has_usable_password())
+        with self.assertNumQueries(queries):
+            self.assertEqual(provision_user("principal-1").pk, user.pk)
+
+    def test_aprovision_user(self) -> None:
+        """The async login path creates or reads a user in one statement too"""
+        postgresql = connection.vendor == "postgresql"
+        with self.assertNumQueries(1 if postgresql else 3):
+            user = async_to_sync(aprovision_user)("principal-1")
+        self.assertFalse(user.has_usable_password())
+        with self.assertNumQueries(1):
+            self.assertEqual(async_to_sync(aprovision_user)("principal-1").pk, user.pk)
+
+    async def test_api_v1_icauth_logout_revokes_jwt(self) -> None:
+        """Test api/v1/icauth/logout with a bearer JWT revokes the JWT"""
+        token = await self.login("principal-1")
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await self.async_client.get("/api/v1/icauth/me", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        await self.async_client.post("/api/v1/icauth/logout", headers=headers)
+        response = await AsyncClient().get("/api/v1/icauth/me", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_api_v1_icauth_logout_everywhere(self) -> None:
+        """Test api/v1/icauth/logout-everywhere ends all logins of the principal"""
+        logins = []
+        for principal in ("principal-1", "principal-1", "principal-2"):
+            self.async_client = AsyncClient()
+            password = self.transport.create_session_password(principal)
+            response = await self.async_client.post(
+                "/api/v1/icauth/login",
+                {"principal": principal, "session_password": password},
+                content_type="application/json",
+            )
+            logins.append((self.async_client, response.json()))
+        self.assertEqual(await PrincipalSession.objects.acount(), 3)
+
+        client, tokens = logins[0]
+        response = await client.post("/api/v1/icauth/logout-everywhere")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "status": "logged out everywhere",
+                "sessions": 2,
+                "session_passwords": 2,
+                "failed": 0,
+            },
+        )
+        self.assertEqual(await Session.objects.acount(), 1)
+        self.assertEqual(list(self.transport.state.session_passwords), ["principal-2"])
+
+        # The sessions, JWTs & refresh tokens of the principal are revoked
+        for client, tokens in logins:
+            headers = {"Authorization": f"Bearer {tokens['jwt']}"}
+            response = await AsyncClient().get("/api/v1/icauth/me", headers=headers)
+            self.assertEqual(
+                response.status_code, 200 if client is logins[2][0] else 401
+            )
+            response = await client.get("/api/v1/icauth/me")
+            self.assertEqual(
+                response.status_code, 200 if client is logins[2][0] else 401
+            )
+            self.assertEqual(
+                (await self.refresh(tokens["refresh"])).status_code,
+                200 if client is logins[2][0] else 401,
+            )
+
+        # A new login is not revoked
+        self.async_client = AsyncClient()
+        headers = {"Authorization": f"Bearer {await self.login('principal-1')}"}
+        response = await AsyncClient().get("/api/v1/icauth/me", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        await self.async_client.post("/api/v1/icauth/logout")
+        self.assertEqual(
+            [ps.principal async for ps in PrincipalSession.objects.all()],
+            ["principal-2"],
+        )
+
+    async def test_logout_everywhere_csrf(self) -> None:
+        """A logout everywhere with the session cookie needs the csrf token"""
+        self.async_client = AsyncClient(enforce_csrf_checks=True)
+        await self.login("principal-1")
+        response = await self.async_client.post("/api/v1/icauth/logout-everywhere")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(await PrincipalSession.objects.acount(), 1)
+
+        response = await self.async_client.get("/api/v1/icauth/me")
+        self.assertEqual(response.status_code, 200)
+        csrf_token = self.async_client.cookies["csrftoken"].value
+        response = await self.async_client.post(
+            "/api/v1/icauth/logout-everywhere", headers={"X-CSRFToken": csrf_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await PrincipalSession.objects.acount(), 0)
+
+    async def test_sharded_canisters(self) -> None:
+        """The calls of a principal go to its canister, and a rebalance deletes the
+        session passwords of the principals moved to a new canister
+        """
+        principals = [f"principal-{i}" for i in range(20)]
+        with override_settings(CANISTER_MOTOKO_IDS=["canister-a", "canister-b"]):
+            transport = get_transport()
+            assert isinstance(transport, InMemoryTransport)
+            self.transport = transport
+            response = await self.async_client.get(
+                "/api/v1/icauth/shard", {"principal": "principal-1"}
+            )
+            shards = {principal: shard_for(principal) for principal in principals}
+            self.assertEqual(response.json()["canister_id"], shards["principal-1"])
+            self.assertEqual(set(shards.values()), {"canister-a", "canister-b"})
+
+            for principal in principals:
+                self.async_client = AsyncClient()
+                await self.login(principal)
+            for canister_id in ("canister-a", "canister-b"):
+                self.assertEqual(
+                    sorted(transport.states[canister_id].session_keys.values()),
+                    sorted(p for p in principals if shards[p] == canister_id),
+                )
+            await self.async_client.post("/api/v1/icauth/logout")
+            self.assertNotIn(
+                principals[-1], transport.states[shards[principals[-1]]].session_keys
+            )
+
+        with override_settings(
+            CANISTER_MOTOKO_IDS=["canister-a", "canister-b", "canister-c"]
+        ):
+            transport = get_transport()
+            assert isinstance(transport, InMemoryTransport)
+            transport.states = self.transport.states
+            moved = [p for p in principals[:-1] if shard_for(p) != shards[p]]
+            self.assertTrue(moved)
+            self.assertEqual({shard_for(p) for p in moved}, {"canister-c"})
+
+            out = StringIO()
+            await sync_to_async(call_command)(
+                "rebalance_canisters",
+                previous_ids="canister-a,canister-b",
+                dry_run=True,
+                stdout=out,
+            )
+            self.assertIn(f"{len(moved)} of 19 principals moved", out.getvalue())
+            self.assertEqual(transport.calls, {})
+
+            counts = await arebalance(["canister-a", "canister-b"])
+            self.assertEqual(
+                counts,
+                Counter(
+                    principals=19,
+                    moved=len(moved),
+                    sessions=len(moved),
+                    session_passwords=len(moved),
+                    failed=0,
+                ),
+            )
+            for principal in principals[:-1]:
+                self.assertEqual(
+                    principal in transport.states[shards[principal]].session_passwords,
+                    principal not in moved,
+                )
+
+    def test_revocation_sync(self) -> None:
+        """A revocation reaches the other workers at their next sync"""
+        other_worker = RevocationList()
+        other_worker.sync()
+        claims = verify_jwt(create_jwt("principal-1"))
+        assert claims is not None
+        revoke(claims["jti"], claims["exp"])
+        self.assertFalse(other_worker.is_revoked(claims["jti"]))
+        other_worker.synced_at = 0.0
+        with self.assertNumQueries(1):
+            other_worker.sync()
+        self.assertTrue(other_worker.is_revoked(claims["jti"]))
+        self.assertFalse(other_worker.is_revoked("not-revoked"))
+
+        # All tokens of a principal, in the same sync
+        claims = verify_jwt(create_jwt("principal-2"))
+        assert claims is not None
+        revoke_principal("principal-2")
+        other_worker.synced_at = 0.0
+        with self.assertNumQueries(1):
+            other_worker.sync()
+        self.assertTrue(other_worker.is_token_revoked(claims))
+        self.assertIsNotNone(verify_jwt(create_jwt("principal-2")))
+
+    def test_purge_expired_revocations(self) -> None:
+        """The revocations of expired tokens are deleted, the tokens still fail"""
+        with override_settings(JWT_ACCESS_TOKEN_AGE=-10):
+            expired = create_jwt("principal-1")
+        claims = jwt.decode(expired, options={"verify_signature": False})
+        revoke(claims["jti"], claims["exp"])
+        live = verify_jwt(create_jwt("principal-1"))
+        assert live is not None
+        revoke(live["jti"], live["exp"])
+
+        counts = async_to_sync(purge_expired_sessions)()
+        self.assertEqual(counts["revoked_tokens"], 1)
+        self.assertEqual(
+            list(RevokedToken.objects.values_list("jti", flat=True)), [live["jti"]]
+        )
+        other_worker = RevocationList()
+        other_worker.sync()
+        self.assertFalse(other_worker.is_revoked(claims["jti"]))
+        self.assertTrue(other_worker.is_revoked(live["jti"]))
+        revocation_list.prune()
+        self.assertIsNone(verify_jwt(expired))
+
+    def test_bloom_filter(self) -> None:
+        """No false negatives, and about `error_rate` false positives"""
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        self.assertTrue(all(f"jti-{i}" in bloom for i in range(1000)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    async def test_api_v1_icauth_me_by_session(self) -> None:
+        """Test api/v1/icauth/me with the session cookie"""
+        await self.login("principal-1")
+        response = await self.async_client.get("/api/v1/icauth/me")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"principal": "principal-1"})
+
+        response = await AsyncClient().get("/api/v1/icauth/me")
+        self.assertEqual(response.status_code, 401)
+
+    async def test_canister_circuit_breaker(self) -> None:
+        """Failing canister calls return 503, until the circuit breaker fails fast"""
+        body = {"principal": "principal-1", "session_password": "password"}
+        with override_settings(
+            CANISTER_MOTOKO_MEMORY_ERROR_RATE=1.0, CANISTER_MOTOKO_BREAKER_THRESHOLD=2
+        ):
+            transport = get_transport()
+            assert isinstance(transport, InMemoryTransport)
+            for _ in range(3):
+                response = await self.async_client.post(
+                    "/api/v1/icauth/login", body, content_type="application/json"
+                )
+                self.assertEqual(response.status_code, 503)
+            self.assertEqual(transport.calls["save_django_session_key"], 2)
+            self.assertEqual(response["Retry-After"], "10")
+
+    async def test_canister_timeout(self) -> None:
+        """A canister call that exceeds its deadline returns 503"""
+        password = self.transport.create_session_password("principal-1")
+        body = {"principal": "principal-1", "session_password": password}
+        with override_settings(
+            CANISTER_MOTOKO_MEMORY_LATENCY=1.0,
+            CANISTER_MOTOKO_TIMEOUTS={"save_django_session_key": 0.01},
+        ):
+            response = await self.async_client.post(
+                "/api/v1/icauth/login", body, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 503)
+
+    async def test_canister_call_modes(self) -> None:
+        """A query_or_update call falls back to an update call unless the query is ok"""
+        with override_settings(
+            CANISTER_MOTOKO_CALL_MODES={"session_password_check": "query_or_update"}
+        ):
+            transport = get_transport()
+            assert isinstance(transport, InMemoryTransport)
+            password = transport.create_session_password("principal-1")
+            for session_password, authenticated, calls in (
+                (password, True, 1),
+                ("wrong", False, 2),
+            ):
+                transport.calls.clear()
+                transport.queries.clear()
+                user = await PrincipalBackend().aauthenticate(
+                    None, username="principal-1", password=session_password
+                )
+                self.assertEqual(user is not None, authenticated)
+                self.assertEqual(transport.calls["session_password_check"], calls)
+                self.assertEqual(transport.queries, {"session_password_check": 1})
+
+        # A query discards the changes of a method
+        with override_settings(
+            CANISTER_MOTOKO_CALL_MODES={"session_password_delete": "query"}
+        ):
+            with self.assertRaises(ImproperlyConfigured):
+                get_call_modes()
+
+    async def test_login_single_flight(self) -> None:
+        """Identical concurrent authentications share one session_password_check"""
+        password = self.transport.create_session_password("principal-1")
+        with override_settings(CANISTER_MOTOKO_MEMORY_LATENCY=0.05):
+            transport = get_transport()
+            assert isinstance(transport, InMemoryTransport)
+            transport.states = self.transport.states
+            users = await asyncio.gather(
+                *(
+                    PrincipalBackend().aauthenticate(
+                        None, username="principal-1", password=password
+                    )
+                    for _ in range(5)
+                )
+            )
+        self.assertEqual(
+            [user and user.get_username() for user in users], ["principal-1"] * 5
+        )
+        self.assertEqual(transport.calls["session_password_check"], 1)
+
+    @override_settings(LOGIN_CLAIM_TTL=2.0)
+    async def test_login_claimed_by_other_worker(self) -> None:
+        """An authentication waits for the check of another worker, and reuses its
+        result until the logout
+        """
+        password = self.transport.create_session_password("principal-1")
+        key = credential_key("principal-1", password)
+        claimed, _ = await sync_to_async(claim)(key, "principal-1", 10.0)
+        self.assertTrue(claimed)
+
+        async def other_worker() -> None:
+            await asyncio.sleep(0.1)
+            await sync_to_async(complete)(key, True)
+
+        task = asyncio.ensure_future(other_worker())
+        user = await PrincipalBackend().aauthenticate(
+            None, username="principal-1", password=password
+        )
+        await task
+        self.assertIsNotNone(user)
+        self.assertEqual(self.transport.calls["session_password_check"], 0)
+
+        await self.async_client.post(
+            "/api/v1/icauth/login",
+            {"principal": "principal-1", "session_password": password},
+            content_type="application/json",
+        )
+        await self.async_client.post("/api/v1/icauth/logout")
+        self.assertFalse(await LoginClaim.objects.filter(key=key).aexists())
+
+    async def test_metrics(self) -> None:
+        """/metrics has the latency per route & per canister method"""
+        await self.login("principal-1")
+        response = await self.async_client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count{route="api/v1/icauth/login",'
+            'method="POST",status="200"}',
+            text,
+        )
+        self.assertIn(
+            'canister_call_duration_seconds_count{method="save_django_session_key",'
+            'mode="update",outcome="ok"}',
+            text,
+        )
+
+        # A method chosen by the client does not add a series
+        await self.async_client.generic("BREW", "/api/v1/icauth/health")
+        text = (await self.async_client.get("/metrics")).content.decode()
+        self.assertIn('route="api/v1/icauth/health",method="other"', text)
+        self.assertNotIn("BREW", text)
+
+
+def create_signing_key(algorithm: str) -> str:
+    """Returns a new base64 encoded signing key, made by the jwt_signing_key command"""
+    stdout = StringIO()
+    call_command("jwt_signing_key", algorithm, stdout=stdout)
+    return stdout.getvalue().strip()
+
+
+@override_settings(
+    CANISTER_MOTOKO_TRANSPORT="api_v1_icauth.transports.InMemoryTransport",
+    SESSION_CLEANUP_INTERVAL=0.0,
+)
+class LifespanTestCase(TestCase):
+    """Tests of the warm-up & shutdown of a worker"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        use_temporary_candid_cache(cls)
+
+    def tearDown(self) -> None:
+        readiness.status = Readiness.STARTING
+
+    async def test_lifespan(self) -> None:
+        """The worker is ready once warmed up, until the shutdown"""
+        application = LifespanApplication(get_asgi_application())
+        sent: list[str] = []
+        statuses: list[int] = []
+
+        async def receive() -> dict[str, Any]:
+            response = await AsyncClient().get("/ready")
+            statuses.append(response.status_code)
+            if not sent:
+                return {"type": "lifespan.startup"}
+            return {"type": "lifespan.shutdown"}
+
+        async def send(message: Mapping[str, Any]) -> None:
+            sent.append(message["type"])
+
+        with self.assertLogs("project.lifespan", "INFO") as logs:
+            await application({"type": "lifespan"}, receive, send)
+        self.assertEqual(
+            sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+        )
+        self.assertEqual(statuses, [503, 200])
+        self.assertEqual(readiness.status, Readiness.STOPPING)
+        self.assertFalse([r for r in logs.records if r.levelno > logging.INFO])
+
+        response = await AsyncClient().get("/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {"status": "stopping"})
+
+    async def test_lifespan_warm_up_failed(self) -> None:
+        """A worker whose IC is unreachable is not ready, until a retry succeeds"""
+        application = LifespanApplication(get_asgi_application())
+        application.retry_interval = 0.05
+        with override_settings(
+            CANISTER_MOTOKO_TRANSPORT="api_v1_icauth.transports.IcTransport",
+            IC_NETWORK_URL="http://127.0.0.1:9",
+            IC_IDENTITY_PEM_ENCODED=base64.b64encode(Identity().to_pem()).decode(),
+        ):
+            with self.assertLogs("project.lifespan", "ERROR"):
+                await application.startup()
+            response = await AsyncClient().get("/ready")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json(), {"status": "failed"})
+            await close_http_session()
+
+        # The IC is back
+        assert application.retry_task is not None
+        await asyncio.wait_for(application.retry_task, 5.0)
+        self.assertEqual(readiness.status, Readiness.READY)
+        await application.shutdown()
+
+
+class JwtSigningKeysTestCase(SimpleTestCase):
+    """Tests of the asymmetric signing keys & the JWKS endpoint"""
+
+    def test_key_rotation(self) -> None:
+        """Tokens of the previous key stay valid after a new key is added"""
+        for algorithm in ("EdDSA", "ES256"):
+            previous_key = create_signing_key(algorithm)
+            new_key = create_signing_key(algorithm)
+            with override_settings(
+                JWT_METHOD=algorithm, JWT_SIGNING_KEYS_ENCODED=[previous_key]
+            ):
+                previous_token = create_jwt("principal-1")
+            with override_settings(
+                JWT_METHOD=algorithm, JWT_SIGNING_KEYS_ENCODED=[new_key, previous_key]
+            ):
+                new_token = create_jwt("principal-2")
+                new_kid, previous_kid = (key.kid for key in get_signing_keys())
+                self.assertEqual(jwt.get_unverified_header(new_token)["kid"], new_kid)
+                self.assertEqual(
+                    jwt.get_unverified_header(previous_token)["kid"], previous_kid
+                )
+                self.assertEqual(verify_jwt(new_token)["sub"], "principal-2")  # type: ignore[index] # pylint: disable=line-too-long
+                self.assertEqual(verify_jwt(previous_token)["sub"], "principal-1")  # type: ignore[index] # pylint: disable=line-too-long
+            with override_settings(
+                JWT_METHOD=algorithm, JWT_SIGNING_KEYS_ENCODED=[new_key]
+            ):
+                self.assertIsNone(verify_jwt(previous_token))
+
+    @override_settings(JWT_METHOD="EdDSA", JWT_JWKS_MAX_AGE=600)
+    async def test_api_v1_icauth_jwks(self) -> None:
+        """Test api/v1/icauth/.well-known/jwks.json, with ETag revalidation"""
+        url = "/api/v1/icauth/.well-known/jwks.json"
+        keys = [create_signing_key("EdDSA"), create_signing_key("EdDSA")]
+        with override_settings(JWT_SIGNING_KEYS_ENCODED=keys):
+            response = await AsyncClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Cache-Control"], "public, max-age=600")
+            jwks = response.json()["keys"]
+            self.assertEqual(
+                [jwk["kid"] for jwk in jwks], [key.kid for key in get_signing_keys()]
+            )
+            self.assertEqual(
+                {(jwk["kty"], jwk["crv"], jwk["alg"]) for jwk in jwks},
+                {("OKP", "Ed25519", "EdDSA")},
+            )
+
+            etag = response["ETag"]
+            response = await AsyncClient().get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["ETag"], etag)
+
+        # A rotated key changes the ETag
+        with override_settings(JWT_SIGNING_KEYS_ENCODED=keys[:1]):
+            response = await AsyncClient().get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()["keys"]), 1)
+
+
+class LoggingTestCase(SimpleTestCase):
+    """Tests of the logging pipeline"""
+
+    def test_sampling_filter(self) -> None:
+        """A noisy message is rate limited, and the next one counts the suppressed"""
+        sampling = SamplingFilter(rate=1.0, burst=2)
+
+        def record(level: int = logging.INFO) -> logging.LogRecord:
+            return logging.makeLogRecord(
+                {"name": "noisy", "msg": "login of %s", "levelno": level}
+            )
+
+        self.assertEqual(
+            [sampling.filter(record()) for _ in range(5)], [True] * 2 + [False] * 3
+        )
+        self.assertTrue(sampling.filter(record(logging.ERROR)))
+
+        # One second later, a record passes again
+        sampling.buckets[("noisy", "login of %s")][1] -= 1.0
+        passed = record()
+        self.assertTrue(sampling.filter(passed))
+        self.assertEqual(passed.suppressed, 3)  # type: ignore[attr-defined]
+
+        # Messages formatted before the call keep at most maxsize buckets, the
+        # others share the overflow bucket
+        sampling = SamplingFilter(rate=1.0, burst=2, maxsize=10)
+        passes = [
+            sampling.filter(
+                logging.makeLogRecord(
+                    {"name": "noisy", "msg": f"#{i}", "levelno": logging.INFO}
+                )
+            )
+            for i in range(100)
+        ]
+        self.assertEqual(sum(passes), 10 + 2)
+        self.assertEqual(len(sampling.buckets), 10)
+        self.assertNotIn(("noisy", "#99"), sampling.buckets)
+
+        # Once idle, the buckets are dropped for new messages
+        for bucket in sampling.buckets.values():
+            bucket[1] -= 2.0
+        sampling.pruned_at -= 2.0
+        self.assertTrue(
+            sampling.filter(
+                logging.makeLogRecord(
+                    {"name": "noisy", "msg": "#100", "levelno": logging.INFO}
+                )
+            )
+        )
+        self.assertEqual(list(sampling.buckets), [("noisy", "#100")])
+
+    def test_structured_formatter(self) -> None:
+        """The extra fields are formatted as key=value pairs, or as JSON"""
+        record = logging.makeLogRecord(
+            {"name": "api", "msg": "login", "levelname": "INFO", "principal": "p-1"}
+        )
+        self.assertTrue(
+            StructuredFormatter()
+            .format(record)
+            .endswith("INFO api login principal=p-1")
+        )
+        data = json.loads(StructuredFormatter(json_lines=True).format(record))
+        self.assertEqual(
+            (data["level"], data["message"], data["principal"]),
+            ("INFO", "login", "p-1"),
+        )
+
+
+class MetricsTestCase(SimpleTestCase):
+    """Tests of the histograms & their text exposition format"""
+
+    def test_histogram_render(self) -> None:
+        """Buckets are cumulative, and the count includes the +Inf bucket"""
+        registry = Registry()
+        histogram = registry.histogram("latency_seconds", "Latency", ("route",))
+        self.assertIsInstance(histogram, Histogram)
+        for value in (0.002, 0.02, 0.02, 20.0):
+            histogram.observe(value, 'a"b')
+
+        lines = registry.render().splitlines()
+        self.assertEqual(lines[0], "# HELP latency_seconds Latency")
+        self.assertEqual(lines[1], "# TYPE latency_seconds histogram")
+        self.assertIn('latency_seconds_bucket{route="a\\"b",le="0.001"} 0', lines)
+        self.assertIn('latency_seconds_bucket{route="a\\"b",le="0.025"} 3', lines)
+        self.assertIn('latency_seconds_bucket{route="a\\"b",le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_count{route="a\\"b"} 4', lines)
+        self.assertIn('latency_seconds_sum{route="a\\"b"} 20.042', lines)
+
+    def test_metrics_dir(self) -> None:
+        """The snapshots of all workers in METRICS_DIR are summed"""
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                registry = Registry()
+                histogram = registry.histogram("latency_seconds", "Latency", ())
+                histogram.observe(0.1)
+                registry.flush()
+                # Another worker process
+                (Path(directory) / "1.json").write_text(
+                    json.dumps({"latency_seconds": {"[]": [0.0] * 13 + [1.0, 1.0]}})
+                )
+                self.assertIn("latency_seconds_count 2", registry.render())
+
+
+class ResilienceTestCase(SimpleTestCase):
+    """Tests of the circuit breaker & the hedged calls"""
+
+    def test_circuit_breaker(self) -> None:
+        """Open after `threshold` failures, then half-open for one trial call"""
+        breaker = CircuitBreaker("test", threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_after(), 0)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    async def test_hedged(self) -> None:
+        """A slow call is sent again, and a failed call is retried"""
+        calls: list[float] = []
+
+        async def call() -> float:
+            delay = delays[len(calls)]
+            calls.append(delay)
+            if delay < 0:
+                raise CanisterError("failed")
+            await asyncio.sleep(delay)
+            return delay
+
+        delays = [10.0, 0.01]
+        self.assertEqual(await hedged(call, delay=0.02), 0.01)
+        self.assertEqual(calls, delays)
+
+        calls.clear()
+        delays = [-1.0, 0.01]
+        self.assertEqual(await hedged(call, delay=10.0), 0.01)
+
+        calls.clear()
+        delays = [-1.0, -1.0]
+        with self.assertRaises(CanisterError):
+            await hedged(call, delay=10.0)
+
+
+class ShardingTestCase(SimpleTestCase):
+    """Tests of the consistent hashing of the principals"""
+
+    def test_hash_ring(self) -> None:
+        """A new canister takes about 1/4 of the principals of 3, from all of them"""
+        principals = [f"principal-{i}" for i in range(4000)]
+        ring = HashRing(["canister-a", "canister-b", "canister-c"])
+        before = {principal: ring.shard_for(principal) for principal in principals}
+        self.assertTrue(
+            all(900 < n < 1800 for n in Counter(before.values()).values()),
+        )
+
+        ring = HashRing(["canister-a", "canister-b", "canister-c", "canister-d"])
+        moved = [p for p in principals if ring.shard_for(p) != before[p]]
+        self.assertTrue(600 < len(moved) < 1400)
+        self.assertEqual({ring.shard_for(p) for p in moved}, {"canister-d"})
+        self.assertEqual(
+            {before[p] for p in moved}, {"canister-a", "canister-b", "canister-c"}
+        )
+        self.assertEqual(
+            HashRing(["canister-a"]).shard_for("principal-1"), "canister-a"
+        )
+
+
+# A throwaway `django-server` identity, so the tests need no IC_IDENTITY_PEM_ENCODED
+@override_settings(
+    IC_IDENTITY_PEM_ENCODED=base64.b64encode(Identity().to_pem()).decode()
+)
+class IcStandinTestCase(SimpleTestCase):
+    """Tests of the asyncio canister client, against the stand-in replica"""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        use_temporary_candid_cache(cls)
+
+    def canister_for(self, url: str, caller: Identity) -> AsyncCanister:
+        """Returns canister_motoko at url, called by the caller identity"""
+        return AsyncCanister(
+            CachedCanister(
+                Agent(caller, Client(url=url)),
+                settings.CANISTER_MOTOKO_ID,
+                load_candid(get_canister_motoko_did()),
+            )
+        )
+
+    def test_candid_cache(self) -> None:
+        """A candid interface is parsed once, then read from the cache"""
+        candid = get_canister_motoko_did()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with override_settings(CANDID_CACHE_DIR=cache_dir):
+                methods = load_candid(candid)["methods"]
+                self.assertEqual(len(list(Path(cache_dir).iterdir())), 1)
+                self.assertEqual(load_candid(candid)["methods"].keys(), methods.keys())
+
+                # A changed interface is parsed again, a corrupt cache is skipped
+                changed = candid.replace("whoami", "whoareyou")
+                self.assertIn("whoareyou", load_candid(changed)["methods"])
+                for path in Path(cache_dir).iterdir():
+                    path.write_bytes(b"corrupt")
+                self.assertEqual(load_candid(candid)["methods"].keys(), methods.keys())
+
+                # A pickle without the HMAC of SECRET_KEY is never loaded
+                for path in Path(cache_dir).iterdir():
+                    path.write_bytes(bytes(32) + pickle.dumps({"methods": {}}))
+                self.assertEqual(load_candid(candid)["methods"].keys(), methods.keys())
+
+    async def test_ic_standin_login_flow(self) -> None:
+        """Session password create, check & delete, over the http interface"""
+        server = TestServer(IcStandin().create_app())
+        await server.start_server()
+        try:
+            url = str(server.make_url("")).rstrip("/")
+            user = Identity()
+            dapp = self.canister_for(url, user)
+            django_server = self.canister_for(url, get_identity())
+            principal = user.sender().to_str()
+
+            response = await dapp.session_password_create()
+            password = response[0]["ok"]
+
+            response = await django_server.session_password_check(principal, password)
+            self.assertEqual(response, [{"ok": None}])
+            response = await django_server.session_password_check(principal, "wrong")
+            self.assertEqual(response, [{"err": 401}])
+
+            response = await django_server.save_django_session_key(
+                "session-key", principal, password
+            )
+            self.assertEqual(response, [{"ok": None}])
+            response = await django_server.session_password_delete("session-key")
+            self.assertEqual(response, [{"ok": None}])
+            response = await django_server.session_password_check(principal, password)
+            self.assertEqual(response, [{"err": 404}])
+
+            response = await django_server.whoami()
+            self.assertEqual(response, [get_identity().sender().to_str()])
+            response = await django_server.whoami(query=True)
+            self.assertEqual(response, [get_identity().sender().to_str()])
+        finally:
+            await close_http_session()
+            await server.close()
@@ -0,0 +1,254 @@
+"""JWT tokens, issued at login, for stateless authentication of api calls.
+
+A verified token is kept in a bounded LRU cache until it expires, so requests with a
+hot token skip the signature check, and never touch the database.
+
+Tokens are signed with settings.JWT_METHOD:
+(-) HS256: with the shared SECRET_JWT_KEY
+(-) EdDSA or ES256: with the first key of JWT_SIGNING_KEYS_ENCODED, identified by the
+    `kid` header. All keys are published at /.well-known/jwks.json, so other
+    services can verify the tokens without the secret & without calling us.
+
+Key rotation: put the new key first, and remove the old key once the tokens signed
+with it have expired, ie. after JWT_ACCESS_TOKEN_AGE.
+"""
+
+import base64
+import functools
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpRequest
+
+from .revocation import revocation_list
+
+JWT_ISSUER = "web3r.chat"
+
+# Asymmetric algorithms & a check of the type of their private keys
+SIGNING_KEY_TYPES: dict[str, Callable[[Any], bool]] = {
+    "EdDSA": lambda key: isinstance(key, ed25519.Ed25519PrivateKey),
+    "ES256": lambda key: isinstance(key, ec.EllipticCurvePrivateKey)
+    and isinstance(key.curve, ec.SECP256R1),
+}
+
+# The members of a public JWK that make up its thumbprint (RFC 7638)
+JWK_THUMBPRINT_MEMBERS = {"OKP": ("crv", "kty", "x"), "EC": ("crv", "kty", "x", "y")}
+
+
+class TokenUser:
+    """The user of a request authenticated by a JWT, without a database lookup.
+
+    It has the attributes of django's User that the apis use. The principal is the
+    username, like for the users created by PrincipalBackend.
+    """
+
+    pk = None
+    id = None
+    is_active = True
+    is_staff = False
+    is_superuser = False
+    is_anonymous = False
+    is_authenticated = True
+
+    def __init__(self, claims: dict[str, Any]) -> None:
+        self.claims = claims
+        self.username: str = claims["sub"]
+
+    def __str__(self) -> str:
+        return self.username
+
+    def get_username(self) -> str:
+        """Returns the principal"""
+        return self.username
+
+
+class VerifiedTokenCache:
+    """A bounded LRU cache of verified tokens & their claims.
+
+    A token is dropped when it expires, or when it is the least recently used one.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.tokens: OrderedDict[str, dict[str, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict[str, Any]]:
+        """Returns the claims of a verified token that did not expire yet"""
+        with self.lock:
+            claims = self.tokens.get(token)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims["exp"] <= time.time():
+                del self.tokens[token]
+                self.misses += 1
+                return None
+            self.tokens.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def set(self, token: str, claims: dict[str, Any]) -> None:
+        """Adds a verified token"""
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.tokens[token] = claims
+            self.tokens.move_to_end(token)
+            while len(self.tokens) > self.maxsize:
+                self.tokens.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drops all tokens & resets the counters"""
+        with self.lock:
+            self.tokens.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+verified_tokens = VerifiedTokenCache(settings.JWT_CACHE_SIZE)
+
+
+class SigningKey:  # pylint: disable=too-few-public-methods
+    """A private key to sign JWTs with, and its public JWK"""
+
+    def __init__(self, pem: bytes, algorithm: str) -> None:
+        self.private_key = load_pem_private_key(pem, password=None)
+        if not SIGNING_KEY_TYPES[algorithm](self.private_key):
+            raise ImproperlyConfigured(
+                f"JWT_SIGNING_KEYS_ENCODED has a key that can not sign {algorithm}"
+            )
+        self.public_key = self.private_key.public_key()
+
+        jwk: dict[str, str] = jwt.get_algorithm_by_name(algorithm).to_jwk(
+            self.public_key, as_dict=True
+        )
+        thumbprint = json.dumps(
+            {name: jwk[name] for name in JWK_THUMBPRINT_MEMBERS[jwk["kty"]]},
+            separators=(",", ":"),
+            sort_keys=True,
+        )
+        self.kid = (
+            base64.urlsafe_b64encode(hashlib.sha256(thumbprint.encode()).digest())
+            .rstrip(b"=")
+            .decode()
+        )
+        self.jwk = {**jwk, "kid": self.kid, "alg": algorithm, "use": "sig"}
+
+
+def is_asymmetric() -> bool:
+    """Returns True if the JWTs are signed with JWT_SIGNING_KEYS_ENCODED"""
+    return settings.JWT_METHOD in SIGNING_KEY_TYPES
+
+
+@functools.lru_cache(maxsize=None)
+def get_signing_keys() -> list[SigningKey]:
+    """Returns the keys of JWT_SIGNING_KEYS_ENCODED. The first one signs."""
+    if not is_asymmetric():
+        return []
+    if not settings.JWT_SIGNING_KEYS_ENCODED:
+        raise ImproperlyConfigured(
+            f"JWT_METHOD {settings.JWT_METHOD} needs JWT_SIGNING_KEYS_ENCODED"
+        )
+    return [
+        SigningKey(base64.b64decode(encoded), settings.JWT_METHOD)
+        for encoded in settings.JWT_SIGNING_KEYS_ENCODED
+    ]
+
+
+@functools.lru_cache(maxsize=None)
+def get_jwks() -> tuple[bytes, str]:
+    """Returns the JSON Web Key Set of the public keys, and its ETag"""
+    body = json.dumps({"keys": [key.jwk for key in get_signing_keys()]}).encode()
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+@receiver(setting_changed)
+def reset_verified_tokens(*, setting: str, **kwargs: Any) -> None:
+    """Drops the verified tokens & keys when a JWT setting changes (in tests)"""
+    if setting.startswith("JWT_") or setting == "SECRET_JWT_KEY":
+        verified_tokens.clear()
+        verified_tokens.maxsize = settings.JWT_CACHE_SIZE
+        get_signing_keys.cache_clear()
+        get_jwks.cache_clear()
+
+
+def create_jwt(principal: str) -> str:
+    """Creates a jwt for the logged in user."""
+    # jwt_header = {"alg": "...", "typ": "JWT"} will be inserted by jwt.encode
+    jwt_payload = {
+        "iss": JWT_ISSUER,
+        "exp": time.time() + settings.JWT_ACCESS_TOKEN_AGE,
+        "sub": principal,
+        # To revoke the token
+        "jti": secrets.token_urlsafe(16),
+    }
+    if is_asymmetric():
+        signing_key = get_signing_keys()[0]
+        return jwt.encode(
+            jwt_payload,
+            signing_key.private_key,  # type: ignore[arg-type]
+            algorithm=settings.JWT_METHOD,
+            headers={"kid": signing_key.kid},
+        )
+    return jwt.encode(
+        jwt_payload,
+        settings.SECRET_JWT_KEY,
+        algorithm=settings.JWT_METHOD,
+        headers=None,
+        json_encoder=None,
+    )
+
+
+def get_verification_key(token: str) -> Any:
+    """Returns the key to verify the token with, by its kid header"""
+    if not is_asymmetric():
+        return settings.SECRET_JWT_KEY
+    kid = jwt.get_unverified_header(token).get("kid")
+    for signing_key in get_signing_keys():
+        if signing_key.kid == kid:
+            return signing_key.public_key
+    raise jwt.InvalidTokenError(f"Unknown kid {kid}")
+
+
+def verify_jwt(token: str) -> Optional[dict[str, Any]]:
+    """Returns the claims of a valid & not revoked token, or None"""
+    claims = verified_tokens.get(token)
+    if claims is not None:
+        return None if revocation_list.is_token_revoked(claims) else claims
+
+    try:
+        claims = jwt.decode(
+            token,
+            get_verification_key(token),
+            algorithms=[settings.JWT_METHOD],
+            issuer=JWT_ISSUER,
+            options={"require": ["exp", "iss", "sub"]},
+        )
+    except jwt.InvalidTokenError:
+        return None
+
+    verified_tokens.set(token, claims)
+    return None if revocation_list.is_token_revoked(claims) else claims
+
+
+def get_bearer_token(request: HttpRequest) -> Optional[str]:
+    """Returns the token of an `Authorization: Bearer <token>` header, if any"""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token.strip()
@@ -0,0 +1,235 @@
+"""Transports to canister_motoko, selected with settings.CANISTER_MOTOKO_TRANSPORT
+
+(-) IcTransport: calls the canister on the IC, or on a local replica (default)
+(-) InMemoryTransport: an in-process implementation of candid/canister_motoko.did,
+                       for tests, benchmarks & load tests of the django side alone
+
+A transport returns the responses in the same format as ic-py, eg. [{'ok': None}]
+A method is called as an update call, or as a query call with query=True, on the
+canister_id (of the shard of its principal), CANISTER_MOTOKO_ID by default.
+"""
+
+import asyncio
+import random
+import secrets
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from django.conf import settings
+
+from ic.candid import encode  # type: ignore
+
+from .canister_motoko import (
+    AsyncCanister,
+    CanisterError,
+    CanisterRejected,
+    get_canister_motoko,
+)
+from .sharding import shard_for
+
+# StatusCode values returned in the err variant, as http status codes
+STATUS_UNAUTHORIZED = 401
+STATUS_NOT_FOUND = 404
+
+
+class Transport:
+    """Base class of the transports to canister_motoko"""
+
+    async def call(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        """Calls a method of the canister & returns the response"""
+        raise NotImplementedError
+
+    def call_sync(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        """Blocking version of call, for the sync code paths of the auth app"""
+        raise NotImplementedError
+
+
+class IcTransport(Transport):
+    """Calls the canister_motoko canisters at settings.IC_NETWORK_URL"""
+
+    def __init__(self) -> None:
+        # canister_id -> async canister, created on first use
+        self.canisters_async: dict[str, AsyncCanister] = {}
+
+    def canister_async(self, canister_id: Optional[str]) -> AsyncCanister:
+        """Returns the async canister of a canister id"""
+        canister_id = canister_id or settings.CANISTER_MOTOKO_ID
+        if canister_id not in self.canisters_async:
+            self.canisters_async[canister_id] = AsyncCanister(
+                get_canister_motoko(canister_id)
+            )
+        return self.canisters_async[canister_id]
+
+    async def call(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        canister_async = self.canister_async(canister_id)
+        return await getattr(canister_async, method_name)(*args, query=query)
+
+    def call_sync(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        canister = get_canister_motoko(canister_id or settings.CANISTER_MOTOKO_ID)
+        if not query:
+            return getattr(canister, method_name)(*args)
+        # The ic-py methods make query calls only for the query methods of the candid
+        method = canister.actor["methods"][method_name]
+        arguments = [{"type": t, "value": v} for t, v in zip(method.argTypes, args)]
+        res = canister.agent.query_raw(
+            canister.canister_id, method_name, encode(arguments), method.retTypes
+        )
+        if isinstance(res, str):
+            raise CanisterRejected(f"Rejected: {res}")
+        return [item["value"] for item in res]
+
+
+class CanisterMotokoState:  # pylint: disable=unused-argument
+    """In-memory state & logic of the canister_motoko.did service.
+
+    Every method takes the principal of the caller as first argument, followed by
+    the arguments of the candid method, and returns the candid value.
+    """
+
+    def __init__(self) -> None:
+        # principal -> session password
+        self.session_passwords: dict[str, str] = {}
+        # django session_key -> principal
+        self.session_keys: dict[str, str] = {}
+
+    def greet(self, caller: str, name: str) -> str:
+        """greet: (text) -> (text)"""
+        return f"Hello, {name}!"
+
+    def whoami(self, caller: str) -> str:
+        """whoami: () -> (text)"""
+        return caller
+
+    def session_password_create(self, caller: str) -> dict[str, Any]:
+        """session_password_create: () -> (Result_1)"""
+        password = secrets.token_urlsafe(32)
+        self.session_passwords[caller] = password
+        return {"ok": password}
+
+    def session_password_check(
+        self, caller: str, principal: str, password: str
+    ) -> dict[str, Any]:
+        """session_password_check: (text, text) -> (Result)"""
+        stored = self.session_passwords.get(principal)
+        if stored is None:
+            return {"err": STATUS_NOT_FOUND}
+        if not secrets.compare_digest(stored, password):
+            return {"err": STATUS_UNAUTHORIZED}
+        return {"ok": None}
+
+    def save_django_session_key(
+        self, caller: str, session_key: str, principal: str, password: str
+    ) -> dict[str, Any]:
+        """save_django_session_key: (text, text, text) -> (Result)"""
+        response = self.session_password_check(caller, principal, password)
+        if "ok" in response:
+            self.session_keys[session_key] = principal
+        return response
+
+    def session_password_delete(self, caller: str, session_key: str) -> dict[str, Any]:
+        """session_password_delete: (text) -> (Result)"""
+        principal = self.session_keys.pop(session_key, None)
+        if principal is None:
+            return {"err": STATUS_NOT_FOUND}
+        self.session_passwords.pop(principal, None)
+        return {"ok": None}
+
+
+class InMemoryTransport(Transport):
+    """An in-process canister_motoko, with artificial latency & error rate.
+
+    Configured with:
+    (-) settings.CANISTER_MOTOKO_MEMORY_LATENCY, in seconds per call
+    (-) settings.CANISTER_MOTOKO_MEMORY_ERROR_RATE, fraction of calls that raise
+
+    Every canister id has its own state, in `states`. `state` is the state of
+    CANISTER_MOTOKO_ID. Session passwords of a principal are created with
+    create_session_password, in the canister of its shard.
+    The number of calls per method is counted in `calls`, and of the query calls
+    among them in `queries`.
+    """
+
+    # The principal of the django-server identity, as seen by the canister
+    caller = "django-server"
+
+    def __init__(self) -> None:
+        self.states: dict[str, CanisterMotokoState] = {}
+        self.state = self.state_of(settings.CANISTER_MOTOKO_ID)
+        self.latency = settings.CANISTER_MOTOKO_MEMORY_LATENCY
+        self.error_rate = settings.CANISTER_MOTOKO_MEMORY_ERROR_RATE
+        self.calls: Counter[str] = Counter()
+        self.queries: Counter[str] = Counter()
+
+    def state_of(self, canister_id: Optional[str]) -> CanisterMotokoState:
+        """Returns the state of a canister id, created on first use"""
+        canister_id = canister_id or settings.CANISTER_MOTOKO_ID
+        if canister_id not in self.states:
+            self.states[canister_id] = CanisterMotokoState()
+        return self.states[canister_id]
+
+    def create_session_password(self, principal: str) -> str:
+        """What the dApp does for a principal after login with Internet Identity"""
+        state = self.state_of(shard_for(principal))
+        return str(state.session_password_create(principal)["ok"])
+
+    def _call(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        self.calls[method_name] += 1
+        if query:
+            self.queries[method_name] += 1
+        if self.error_rate and random.random() < self.error_rate:
+            raise CanisterError(f"Injected error in {method_name}")
+        state = self.state_of(canister_id)
+        return [getattr(state, method_name)(self.caller, *args)]
+
+    async def call(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._call(method_name, *args, query=query, canister_id=canister_id)
+
+    def call_sync(
+        self,
+        method_name: str,
+        *args: Any,
+        query: bool = False,
+        canister_id: Optional[str] = None,
+    ) -> Any:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._call(method_name, *args, query=query, canister_id=canister_id)
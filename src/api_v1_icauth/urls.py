@@ -1,35 +1,105 @@
 """URLs"""
 
+import logging
+import math
+from typing import Any
+
 from django.urls import path
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 
 from ninja import NinjaAPI
 
 from . import schemas
 from . import apis
+from .auth import JWTAuth, SessionAuth
+from .canister_motoko import CanisterError, CanisterUnavailable
+from .sharding import shard_for
+
+logger = logging.getLogger(__name__)
 
 api = NinjaAPI()
 
 
+@api.exception_handler(CanisterError)
+def canister_error(request: HttpRequest, exc: Exception) -> HttpResponse:
+    """The ic canister failed, timed out or is unavailable: 503 Service Unavailable,
+    with a Retry-After header while the circuit breaker is open
+    """
+    logger.warning("IC unavailable", extra={"error": exc})
+    response = api.create_response(
+        request, {"detail": "Service Unavailable"}, status=503
+    )
+    if isinstance(exc, CanisterUnavailable):
+        response["Retry-After"] = str(math.ceil(exc.retry_after))
+    return response
+
+
 @api.get("/health")
 async def health(request: HttpRequest) -> dict[str, str]:
     """Health endpoint for api/v1/icauth"""
     return {"status": "ok"}
 
 
+@api.get("/shard")
+async def shard(request: HttpRequest, principal: str) -> dict[str, str]:
+    """Returns the canister to create the session password of a principal in:
+
+    {"principal": "--principal--", "canister_id": "--canister id--"}
+    """
+    return {"principal": principal, "canister_id": shard_for(principal)}
+
+
 @api.post("/login")
-def login(request: HttpRequest, body: schemas.BodyLoginSchema) -> dict[str, str]:
-    """Logs the user in & returns a JWT token valid for duration of django session:
+async def login(request: HttpRequest, body: schemas.BodyLoginSchema) -> dict[str, str]:
+    """Logs the user in & returns a short-lived JWT token, and a refresh token:
+
+    {"jwt": "--jwt token--", "refresh": "--refresh token--"}
+    """
+    return await apis.login(request, body)
+
+
+@api.post("/refresh")
+async def refresh(
+    request: HttpRequest, body: schemas.BodyRefreshSchema
+) -> dict[str, str]:
+    """Returns a new JWT token & the next refresh token, for a refresh token:
 
-    {"jwt": "--jwt token--"}
+    {"jwt": "--jwt token--", "refresh": "--refresh token--"}
     """
-    return apis.login(request, body)
+    return await apis.refresh(request, body)
 
 
 @api.post("/logout")
-def logout(request: HttpRequest) -> dict[str, str]:
+async def logout(request: HttpRequest) -> dict[str, str]:
     """ "Logs the user out."""
-    return apis.logout(request)
+    return await apis.logout(request)
+
+
+@api.post("/logout-everywhere", auth=[JWTAuth(), SessionAuth()])
+async def logout_everywhere(request: HttpRequest) -> dict[str, Any]:
+    """Logs the principal out of all its sessions, and revokes all its tokens:
+
+    {"status": "logged out everywhere", "sessions": 2, "session_passwords": 2, ...}
+    """
+    return await apis.logout_everywhere(request)
+
+
+@api.get("/me", auth=[JWTAuth(), SessionAuth()])
+async def me(request: HttpRequest) -> dict[str, str]:
+    """Returns the principal of the user, authenticated by JWT or session cookie:
+
+    {"principal": "--principal--"}
+    """
+    return {"principal": request.auth.get_username()}  # type: ignore[attr-defined]
+
+
+@api.get("/.well-known/jwks.json")
+async def jwks(request: HttpRequest) -> HttpResponse:
+    """Returns the public keys to verify the JWTs with, as a JSON Web Key Set:
+
+    {"keys": [{"kty": "OKP", "crv": "Ed25519", "x": "...", "kid": "...", ...}]}
+    """
+    return apis.jwks(request)
 
 
 urlpatterns = [
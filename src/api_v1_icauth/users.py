@@ -0,0 +1,209 @@
+"""The users of the principals, for PrincipalBackend.
+
+(-) provision_user: returns the user of a principal, creating it on first login, in
+                    one race-free statement. aprovision_user is its async version.
+(-) UserCache: AuthenticationMiddleware loads the user of the session on every
+               request, with PrincipalBackend.get_user. The UserCache serves it from
+               memory instead, by primary key and by username.
+
+update_last_login replaces the receiver of django, and updates last_login with
+a single UPDATE, without the post_save signal, so a login keeps its user cached.
+
+A cached user is dropped when it is saved or deleted in this process, through the
+post_save & post_delete signals, and otherwise USER_CACHE_TTL seconds after it was
+loaded. A change made by another worker is seen within that time.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+
+UserModel = get_user_model()
+
+
+def provision_user(username: str) -> Any:
+    """Returns the user with this username, creating it if it does not exist.
+
+    On PostgreSQL, a single statement inserts the user, or does nothing when it
+    exists, and returns the row either way. Concurrent first logins of a principal
+    never fail with an IntegrityError. Other databases insert with
+    ON CONFLICT DO NOTHING and read the row back.
+
+    The user is created with an unusable password, as set_unusable_password: "!"
+    followed by a random string, which no password matches, since the session
+    passwords are checked by the ic canister. No post_save signal is sent.
+    """
+    user = UserModel(username=username, is_staff=False, is_superuser=False)
+    user.set_unusable_password()
+    if connection.vendor != "postgresql":
+        UserModel.objects.bulk_create([user], ignore_conflicts=True)
+        return UserModel.objects.get(username=username)
+
+    sql, params = upsert_sql(user)
+    rows = list(UserModel.objects.raw(sql, params))
+    if rows:
+        return rows[0]
+    # Inserted by a concurrent transaction that committed after this statement
+    # started, so neither the insert nor the select of the statement returns it
+    return UserModel.objects.get(username=username)
+
+
+async def aprovision_user(username: str) -> Any:
+    """Async version of provision_user.
+
+    The async ORM has no raw queries, so on PostgreSQL the single statement of
+    provision_user runs in a thread. Other databases read the user first, which is
+    one query for a returning user, and otherwise insert it with
+    ON CONFLICT DO NOTHING & read it back.
+    """
+    if connection.vendor == "postgresql":
+        return await sync_to_async(provision_user)(username)
+    user = await UserModel.objects.filter(username=username).afirst()
+    if user is not None:
+        return user
+    user = UserModel(username=username, is_staff=False, is_superuser=False)
+    user.set_unusable_password()
+    await UserModel.objects.abulk_create([user], ignore_conflicts=True)
+    return await UserModel.objects.aget(username=username)
+
+
+def update_last_login(sender: Any, user: Any, **kwargs: Any) -> None:
+    """Receiver of user_logged_in, in place of django's update_last_login.
+
+    alogin updates last_login asynchronously before it sends the signal, with
+    last_login_updated=True.
+    """
+    if kwargs.get("last_login_updated"):
+        return
+    user.last_login = timezone.now()
+    sender.objects.filter(pk=user.pk).update(last_login=user.last_login)
+
+
+async def aupdate_last_login(user: Any) -> None:
+    """Async version of update_last_login"""
+    user.last_login = timezone.now()
+    await type(user).objects.filter(pk=user.pk).aupdate(last_login=user.last_login)
+
+
+def upsert_sql(user: Any) -> tuple[str, list[Any]]:
+    """Returns the PostgreSQL statement that inserts the user or selects it"""
+    meta = UserModel._meta  # pylint: disable=protected-access
+    quote = connection.ops.quote_name
+    fields = [field for field in meta.local_fields if not field.primary_key]
+    table = quote(meta.db_table)
+    username = quote(
+        next(f.column for f in fields if f.name == UserModel.USERNAME_FIELD)
+    )
+    columns = ", ".join(quote(field.column) for field in fields)
+    values = ", ".join(["%s"] * len(fields))
+    sql = (
+        f"WITH inserted AS ("
+        f"INSERT INTO {table} ({columns}) VALUES ({values}) "
+        f"ON CONFLICT ({username}) DO NOTHING RETURNING *) "
+        f"SELECT * FROM inserted "
+        f"UNION ALL SELECT * FROM {table} WHERE {username} = %s"
+    )
+    params = [
+        field.get_db_prep_save(field.pre_save(user, add=True), connection)
+        for field in fields
+    ]
+    return sql, params + [user.get_username()]
+
+
+class UserCache:
+    """A bounded LRU cache of user objects, by primary key & by username.
+
+    Returns a copy of the cached user, so a request can not change the user that
+    other requests get. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl: float, maxsize: int) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # pk -> (user, expiry time in time.monotonic)
+        self.users: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        # username -> pk
+        self.pks: dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, pk: Any) -> Optional[Any]:
+        """Returns a copy of the cached user with this primary key, or None"""
+        if self.ttl <= 0:
+            return None
+        with self.lock:
+            entry = self.users.get(pk)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.users.move_to_end(pk)
+            self.hits += 1
+        return copy.copy(entry[0])
+
+    def get_by_username(self, username: str) -> Optional[Any]:
+        """Returns a copy of the cached user with this username, or None"""
+        pk = self.pks.get(username)
+        if pk is None:
+            self.misses += 1
+            return None
+        return self.get(pk)
+
+    def set(self, user: Any) -> None:
+        """Adds a user loaded from the database"""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        entry = (copy.copy(user), time.monotonic() + self.ttl)
+        with self.lock:
+            self.users[user.pk] = entry
+            self.users.move_to_end(user.pk)
+            self.pks[user.get_username()] = user.pk
+            while len(self.users) > self.maxsize:
+                _, (evicted, _) = self.users.popitem(last=False)
+                self.pks.pop(evicted.get_username(), None)
+
+    def invalidate(self, pk: Any) -> None:
+        """Drops the user with this primary key"""
+        with self.lock:
+            entry = self.users.pop(pk, None)
+            if entry is not None:
+                self.pks.pop(entry[0].get_username(), None)
+
+    def clear(self) -> None:
+        """Drops all users & resets the counters"""
+        with self.lock:
+            self.users.clear()
+            self.pks.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+user_cache = UserCache(settings.USER_CACHE_TTL, settings.USER_CACHE_SIZE)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user(*, instance: Any, **kwargs: Any) -> None:
+    """Drops a user from the cache when it is saved or deleted"""
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(setting_changed)
+def reset_user_cache(*, setting: str, **kwargs: Any) -> None:
+    """Drops the cached users when a USER_CACHE_ setting changes (in tests)"""
+    if setting.startswith("USER_CACHE_"):
+        user_cache.clear()
+        user_cache.ttl = settings.USER_CACHE_TTL
+        user_cache.maxsize = settings.USER_CACHE_SIZE
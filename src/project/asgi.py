@@ -13,4 +13,12 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once the apps are ready
+from project.lifespan import (  # pylint: disable=wrong-import-position
+    LifespanApplication,
+)
+
+# Warms the worker up at the lifespan startup, see project/lifespan.py
+application = LifespanApplication(django_application)
@@ -0,0 +1,272 @@
+"""ASGI lifespan: the warm-up of a worker before it serves, and its shutdown.
+
+https://asgi.readthedocs.io/en/latest/specs/lifespan.html
+
+Django handles http only, so LifespanApplication answers the lifespan events of
+the server. At startup, before the server accepts connections, a worker:
+(-) checks its database connection, and syncs the JWT revocation list
+(-) builds the canister clients, and opens IC_HTTP_WARMUP_CONNECTIONS connections
+    of the canister http pool to IC_NETWORK_URL, with their TLS handshakes
+(-) sends a throwaway request through the middleware & the ninja router, which
+    imports & sets up everything that a request needs
+(-) starts the session cleanup thread
+
+GET /ready returns 503 until the warm-up has finished, and again from the start of
+the shutdown, so a load balancer only sends requests to warm workers.
+
+The database & canister steps are required: when one fails, the worker serves, but
+its readiness is failed (503) & it runs the failed steps again every
+WARMUP_RETRY_INTERVAL seconds, until they succeed. A failed throwaway request is
+only logged.
+
+At shutdown, a worker closes the canister http pool, writes the queued session
+expire_dates & its metrics, and stops the cleanup thread.
+
+Served without lifespan events, eg. with uvicorn --lifespan off, a worker is ready
+at its first request, without warm-up.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Mapping, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from api_v1_icauth.canister_motoko import (
+    close_http_session,
+    get_http_session,
+    get_transport,
+)
+from api_v1_icauth.cleanup import start_cleanup_thread, stop_cleanup_thread
+from api_v1_icauth.revocation import revocation_list
+from api_v1_icauth.sharding import canister_ids
+from api_v1_icauth.transports import IcTransport
+
+from .metrics import registry
+from .sessions.cached_db import SessionStore
+
+logger = logging.getLogger(__name__)
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[Mapping[str, Any]]]
+Send = Callable[[Mapping[str, Any]], Awaitable[None]]
+ASGIApplication = Callable[[Scope, Receive, Send], Awaitable[None]]
+Steps = list[tuple[str, Callable[[], Awaitable[Any]]]]
+
+# The path of the throwaway request of the warm-up
+WARMUP_PATH = "/api/v1/icauth/health"
+
+# Seconds between the retries of the required warm-up steps that failed
+WARMUP_RETRY_INTERVAL = 5.0
+
+
+class Readiness:  # pylint: disable=too-few-public-methods
+    """The readiness of this worker: starting, ready, failed or stopping"""
+
+    STARTING = "starting"
+    READY = "ready"
+    FAILED = "failed"
+    STOPPING = "stopping"
+
+    def __init__(self) -> None:
+        self.status = self.STARTING
+
+    def is_ready(self) -> bool:
+        """Returns True once the warm-up has finished, until the shutdown"""
+        return self.status == self.READY
+
+
+readiness = Readiness()
+
+
+def warm_up_database() -> None:
+    """Connects to the database & syncs the revocation list, in a worker thread.
+
+    Under ASGI, every request opens the connections of its own thread, so the
+    connection of the warm-up is closed after use.
+    """
+    try:
+        connections["default"].ensure_connection()
+        revocation_list.sync()
+    finally:
+        connections.close_all()
+
+
+async def warm_up_canisters() -> None:
+    """Builds the canister clients, and opens the connections of the http pool"""
+    transport = get_transport()
+    if not isinstance(transport, IcTransport):
+        return
+    # The calls without a principal go to CANISTER_MOTOKO_ID
+    for canister_id in {settings.CANISTER_MOTOKO_ID, *canister_ids()}:
+        transport.canister_async(canister_id)
+
+    session = get_http_session()
+    url = f"{str(settings.IC_NETWORK_URL).rstrip('/')}/api/v2/status"
+
+    async def connect() -> None:
+        async with session.get(url) as response:
+            await response.read()
+
+    # Concurrent requests, so every one opens a connection of the pool
+    await asyncio.gather(
+        *(connect() for _ in range(settings.IC_HTTP_WARMUP_CONNECTIONS))
+    )
+
+
+def flush_touched() -> None:
+    """Writes the queued session expire_dates, in a worker thread"""
+    try:
+        if settings.SESSION_ENGINE == SessionStore.__module__:
+            SessionStore.flush_touched()
+    finally:
+        connections.close_all()
+
+
+async def throwaway_request(application: ASGIApplication) -> int:
+    """Sends a GET request for WARMUP_PATH to the application & returns the status"""
+    host = next(
+        (host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"),
+        "localhost",
+    )
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": WARMUP_PATH,
+        "raw_path": WARMUP_PATH.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", host.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": (host, 80),
+    }
+    status = 0
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Mapping[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await application(scope, receive, send)
+    return status
+
+
+class LifespanApplication:
+    """Wraps the django ASGI application, and handles the lifespan events"""
+
+    def __init__(self, application: ASGIApplication) -> None:
+        self.application = application
+        self.started = False
+        self.retry_interval = WARMUP_RETRY_INTERVAL
+        self.retry_task: Optional["asyncio.Task[None]"] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if not self.started:
+            # Served without lifespan events
+            self.start()
+        await self.application(scope, receive, send)
+
+    async def lifespan(self, receive: Receive, send: Send) -> None:
+        """Answers the lifespan events of the server, until the shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def start(self) -> None:
+        """Starts the background threads & marks the worker ready"""
+        self.started = True
+        start_cleanup_thread()
+        readiness.status = Readiness.READY
+
+    async def startup(self) -> None:
+        """Warms the worker up, then marks it ready, or failed if a required step
+        failed
+        """
+        t0 = time.perf_counter()
+        timings: dict[str, float] = {}
+        failed = await self.run_steps(
+            [
+                ("database", sync_to_async(warm_up_database, thread_sensitive=False)),
+                ("canisters", warm_up_canisters),
+            ],
+            timings,
+        )
+        await self.run_steps([("request", self.warm_up_request)], timings)
+        self.start()
+        timings["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if not failed:
+            logger.info("Worker ready", extra=timings)
+            return
+        readiness.status = Readiness.FAILED
+        logger.error(
+            "Worker not ready, warm-up failed",
+            extra={"steps": ",".join(name for name, _ in failed), **timings},
+        )
+        self.retry_task = asyncio.ensure_future(self.retry(failed))
+
+    async def run_steps(self, steps: Steps, timings: dict[str, float]) -> Steps:
+        """Runs warm-up steps & times them, and returns the steps that failed"""
+        failed: Steps = []
+        for name, step in steps:
+            t1 = time.perf_counter()
+            try:
+                await step()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Warm-up step failed", extra={"step": name})
+                failed.append((name, step))
+            timings[f"{name}_ms"] = round((time.perf_counter() - t1) * 1000, 1)
+        return failed
+
+    async def retry(self, steps: Steps) -> None:
+        """Runs the failed required steps again until they succeed, then marks the
+        worker ready
+        """
+        while steps:
+            await asyncio.sleep(self.retry_interval)
+            steps = await self.run_steps(steps, {})
+        readiness.status = Readiness.READY
+        logger.info("Worker ready, after a retry of its warm-up")
+
+    async def warm_up_request(self) -> None:
+        """Sends the throwaway request of the warm-up"""
+        status = await throwaway_request(self.application)
+        if status != 200:
+            logger.warning(
+                "Warm-up request failed", extra={"path": WARMUP_PATH, "status": status}
+            )
+
+    async def shutdown(self) -> None:
+        """Marks the worker stopping, and closes & writes what it holds"""
+        readiness.status = Readiness.STOPPING
+        if self.retry_task is not None:
+            self.retry_task.cancel()
+        stop_cleanup_thread()
+        steps: list[tuple[str, Callable[[], Awaitable[Any]]]] = [
+            ("canisters", close_http_session),
+            ("sessions", sync_to_async(flush_touched, thread_sensitive=False)),
+            ("metrics", sync_to_async(registry.flush, thread_sensitive=False)),
+        ]
+        for name, step in steps:
+            try:
+                await step()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Shutdown step failed", extra={"step": name})
+        logger.info("Worker stopped")
@@ -0,0 +1,159 @@
+"""Logging pipeline, configured by settings.LOGGING
+
+(-) QueueStreamHandler: hands the records to a background thread, which formats &
+                        writes them, so a log call never blocks on stdout. A forked
+                        worker starts its own thread.
+(-) SamplingFilter: lets through at most `rate` records per second of every noisy
+                    message, and counts the suppressed ones
+(-) StructuredFormatter: the message followed by the `extra` fields of the record,
+                         as key=value pairs or as one JSON object per line
+"""
+
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+# The attributes of every LogRecord, as opposed to the `extra` fields
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class QueueStreamHandler(QueueHandler):
+    """Writes the records to a stream, from a background thread"""
+
+    def __init__(self, stream: Any = None) -> None:
+        super().__init__(queue.SimpleQueue())
+        self.stream_handler = logging.StreamHandler(stream or sys.stdout)
+        self.listener = QueueListener(self.queue, self.stream_handler)
+        self.listener.start()
+        self.closed = False
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self) -> None:
+        """The thread of the listener does not survive a fork, eg. of a worker by a
+        master that imported the application (run_uvicorn.py --preload)
+        """
+        if self.closed:
+            return
+        self.queue = queue.SimpleQueue()
+        self.listener = QueueListener(self.queue, self.stream_handler)
+        self.listener.start()
+
+    def setFormatter(self, fmt: Any) -> None:
+        # The records are formatted in the background thread
+        self.stream_handler.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The listener is in the same process, so the record needs no pickling
+        return record
+
+    def close(self) -> None:
+        # Called by logging.shutdown at exit. Writes the queued records first.
+        if self.listener._thread is not None:  # pylint: disable=protected-access
+            self.listener.stop()
+        self.closed = True
+        super().close()
+
+
+class SamplingFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Rate limits the records up to WARNING, per logger & message template.
+
+    Every message gets a bucket of `burst` records, refilled at `rate` per second.
+    The next record that passes reports how many were suppressed in between.
+    Errors are never suppressed.
+
+    A message formatted before the log call, eg. an f-string, gets a bucket per
+    value, so at most `maxsize` buckets are kept. The idle buckets, refilled with
+    nothing suppressed, are dropped; while all are in use, the other messages share
+    one overflow bucket, so a flood of distinct messages is still rate limited.
+    """
+
+    def __init__(
+        self, rate: float = 10.0, burst: int = 20, maxsize: int = 1000
+    ) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # (logger, msg) -> [tokens, last refill time, suppressed records]
+        self.buckets: dict[tuple[str, str], list[float]] = {}
+        self.overflow = [float(burst), time.monotonic(), 0]
+        self.pruned_at = 0.0
+        self.lock = threading.Lock()
+
+    def prune(self, now: float) -> None:
+        """Drops the buckets refilled since their last record, with none suppressed"""
+        self.pruned_at = now
+        idle = now - self.burst / self.rate
+        self.buckets = {
+            key: bucket
+            for key, bucket in self.buckets.items()
+            if bucket[1] > idle or bucket[2]
+        }
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.WARNING or self.rate <= 0:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                # At most one prune per refill time, as it reads every bucket
+                if (
+                    len(self.buckets) >= self.maxsize
+                    and now - self.pruned_at >= self.burst / self.rate
+                ):
+                    self.prune(now)
+                if len(self.buckets) < self.maxsize:
+                    bucket = self.buckets[key] = [float(self.burst), now, 0]
+                else:
+                    bucket = self.overflow
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.suppressed = int(suppressed)
+        return True
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats a record with its `extra` fields, as text or as a JSON object"""
+
+    def __init__(self, json_lines: bool = False) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        extra = {
+            key: value
+            for key, value in vars(record).items()
+            if key not in RECORD_ATTRIBUTES
+        }
+        if not self.json_lines:
+            text = super().format(record)
+            if extra:
+                text += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+            return text
+
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **extra,
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
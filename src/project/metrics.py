@@ -0,0 +1,202 @@
+"""In-process metrics, exposed at /metrics in the Prometheus text format.
+
+https://prometheus.io/docs/instrumenting/exposition_formats/
+
+A Histogram counts observations per label values, in buckets, with their sum &
+count. The count doubles as the request counter. Recording an observation is a
+dict lookup, a bisect & two additions, without a lock: a worker records from its
+event loop thread, and the GIL makes the dict operations atomic. At worst, a thread
+switch inside an addition loses one observation.
+
+Every gunicorn worker has its own registry. With settings.METRICS_DIR set, e.g. to a
+directory in /dev/shm, every worker writes a snapshot of its registry to a file in
+that directory every METRICS_FLUSH_INTERVAL seconds, and /metrics returns the sum of
+the snapshots of all workers. Clear the directory when the server (re)starts.
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from django.conf import settings
+
+# Latency buckets in seconds, the upper bounds of the buckets except +Inf
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Histogram:
+    """A histogram with a series of bucket counts per combination of label values"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...],
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [count per bucket, ..., count of +Inf bucket, sum]
+        self.series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Records an observation, eg. a latency in seconds"""
+        series = self.series.get(labelvalues)
+        if series is None:
+            series = self.series.setdefault(
+                labelvalues, [0.0] * (len(self.buckets) + 2)
+            )
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self) -> dict[str, list[float]]:
+        """Returns a copy of the series, keyed by the JSON of the label values"""
+        return {
+            json.dumps(labelvalues): list(series)
+            for labelvalues, series in self.series.copy().items()
+        }
+
+
+class Registry:
+    """The histograms of a process, and their snapshots in METRICS_DIR"""
+
+    def __init__(self) -> None:
+        self.histograms: dict[str, Histogram] = {}
+        self.flusher: Optional[threading.Thread] = None
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: tuple[str, ...]
+    ) -> Histogram:
+        """Registers a histogram"""
+        histogram = Histogram(name, documentation, labelnames)
+        self.histograms[name] = histogram
+        return histogram
+
+    def snapshot(self) -> dict[str, dict[str, list[float]]]:
+        """Returns the series of every histogram"""
+        return {
+            name: histogram.snapshot() for name, histogram in self.histograms.items()
+        }
+
+    def start_flusher(self) -> None:
+        """Starts the thread that writes the snapshots of this worker process"""
+        if not settings.METRICS_DIR or self.flusher is not None:
+            return
+        self.flusher = threading.Thread(
+            target=self.flush_periodically, name="metrics-flusher", daemon=True
+        )
+        self.flusher.start()
+
+    def after_fork(self) -> None:
+        """A forked worker starts with empty histograms & its own flusher thread"""
+        for histogram in self.histograms.values():
+            histogram.series.clear()
+        if self.flusher is not None:
+            self.flusher = None
+            self.start_flusher()
+
+    def flush_periodically(self) -> None:
+        """Writes the snapshot every METRICS_FLUSH_INTERVAL seconds"""
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the snapshot of this process to METRICS_DIR, atomically"""
+        if not settings.METRICS_DIR:
+            return
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{os.getpid()}.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.snapshot()), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def collect(self) -> dict[str, dict[str, list[float]]]:
+        """Returns the sum of the snapshots of all workers, or of this process"""
+        if not settings.METRICS_DIR:
+            return self.snapshot()
+
+        self.flush()
+        total: dict[str, dict[str, list[float]]] = {}
+        for path in Path(settings.METRICS_DIR).glob("*.json"):
+            try:
+                snapshot = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            for name, series in snapshot.items():
+                merged = total.setdefault(name, {})
+                for key, values in series.items():
+                    if key in merged:
+                        merged[key] = [a + b for a, b in zip(merged[key], values)]
+                    else:
+                        merged[key] = values
+        return total
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format"""
+        collected = self.collect()
+        lines: list[str] = []
+        for name, histogram in self.histograms.items():
+            lines.append(f"# HELP {name} {histogram.documentation}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, values in sorted(collected.get(name, {}).items()):
+                labelvalues = json.loads(key)
+                labels = format_labels(histogram.labelnames, labelvalues)
+                cumulative = 0.0
+                for bound, count in zip(histogram.buckets + (float("inf"),), values):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = format_labels(
+                        histogram.labelnames + ("le",), labelvalues + [le]
+                    )
+                    lines.append(f"{name}_bucket{bucket_labels} {int(cumulative)}")
+                lines.append(f"{name}_sum{labels} {values[-1]!r}")
+                lines.append(f"{name}_count{labels} {int(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labelnames: tuple[str, ...], labelvalues: list[Any]) -> str:
+    """Returns the labels of a sample, eg. {method="GET",status="200"}, or ''"""
+    if not labelnames:
+        return ""
+    labels = ",".join(
+        f'{name}="{escape_label_value(str(value))}"'
+        for name, value in zip(labelnames, labelvalues)
+    )
+    return f"{{{labels}}}"
+
+
+def escape_label_value(value: str) -> str:
+    """Escapes a label value for the text exposition format"""
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Latency of the http requests, by route, method & status code",
+    ("route", "method", "status"),
+)
@@ -0,0 +1,183 @@
+"""Project wide middleware"""
+
+import time
+from typing import Any, Awaitable, Callable, Union
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.exceptions import SessionInterrupted
+from django.contrib.sessions.middleware import (
+    SessionMiddleware as DjangoSessionMiddleware,
+)
+from django.http import HttpRequest, HttpResponseBase
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from whitenoise.middleware import WhiteNoiseMiddleware  # type: ignore
+
+from .metrics import http_request_duration, registry
+
+# The method label of the latency, "other" for any other, client chosen, method
+METRIC_METHODS = frozenset(("GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"))
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):  # type: ignore[misc]
+    """WhiteNoise, made async capable.
+
+    WhiteNoiseMiddleware is sync only, so under ASGI Django runs it & everything
+    below it in the middleware chain in a thread, and wraps the async views with
+    async_to_sync. That one thread is then held for the full duration of every
+    request, which serializes all requests of a worker process.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[..., Any]) -> None:
+        super().__init__(get_response)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(
+        self, request: HttpRequest
+    ) -> Union[HttpResponseBase, Awaitable[HttpResponseBase]]:
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response: HttpResponseBase = super().__call__(request)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """Async version of WhiteNoiseMiddleware.__call__"""
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            response: HttpResponseBase = await sync_to_async(self.serve)(
+                static_file, request
+            )
+            return response
+        response = await self.get_response(request)
+        return response
+
+
+class MetricsMiddleware:
+    """Records the latency of every request, by route, method & status code.
+
+    It must come first, so the latency includes all other middleware. The route is
+    the pattern of the matched url, eg. api/v1/icauth/login, and the method one of
+    METRIC_METHODS or "other", so the number of series stays bounded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response: Callable[..., Any]) -> None:
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        registry.start_flusher()
+
+    def __call__(
+        self, request: HttpRequest
+    ) -> Union[HttpResponseBase, Awaitable[HttpResponseBase]]:
+        if self.async_mode:
+            return self.__acall__(request)
+        t0 = time.perf_counter()
+        response: HttpResponseBase = self.get_response(request)
+        self.record(request, response, time.perf_counter() - t0)
+        return response
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """Async version of __call__"""
+        t0 = time.perf_counter()
+        response: HttpResponseBase = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - t0)
+        return response
+
+    def record(
+        self, request: HttpRequest, response: HttpResponseBase, latency: float
+    ) -> None:
+        """Records the latency of the request"""
+        match = request.resolver_match
+        http_request_duration.observe(
+            latency,
+            match.route if match is not None else "unmatched",
+            request.method if request.method in METRIC_METHODS else "other",
+            str(response.status_code),
+        )
+
+
+class SessionMiddleware(DjangoSessionMiddleware):
+    """SessionMiddleware, made async capable.
+
+    Django runs the process_request & process_response of its SessionMiddleware in
+    a thread for every async request. Here, creating the session store needs no
+    thread, and the session is saved with the async API of project.sessions, if
+    the SESSION_ENGINE has one.
+    """
+
+    async def __acall__(self, request: HttpRequest) -> HttpResponseBase:
+        """Async version of MiddlewareMixin.__call__"""
+        self.process_request(request)
+        response: HttpResponseBase = await self.get_response(  # type: ignore[misc]
+            request
+        )
+        return await self.aprocess_response(request, response)
+
+    async def aprocess_response(
+        self, request: HttpRequest, response: HttpResponseBase
+    ) -> HttpResponseBase:
+        """Same as process_response, with SessionStore.asave"""
+        try:
+            session: Any = request.session
+            accessed = session.accessed
+            modified = session.modified
+            empty = session.is_empty()
+        except AttributeError:
+            return response
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and empty:
+            response.delete_cookie(
+                settings.SESSION_COOKIE_NAME,
+                path=settings.SESSION_COOKIE_PATH,
+                domain=settings.SESSION_COOKIE_DOMAIN,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+            patch_vary_headers(response, ("Cookie",))
+            return response
+
+        if accessed:
+            patch_vary_headers(response, ("Cookie",))
+        if not (modified or settings.SESSION_SAVE_EVERY_REQUEST) or empty:
+            return response
+        # Skip the session save for 5xx responses
+        if response.status_code >= 500:
+            return response
+
+        if session.get_expire_at_browser_close():
+            max_age = None
+            expires = None
+        else:
+            max_age = session.get_expiry_age()
+            expires = http_date(time.time() + max_age)
+        save = getattr(session, "asave", None) or sync_to_async(session.save)
+        try:
+            await save()
+        except UpdateError as error:
+            raise SessionInterrupted(
+                "The request's session was deleted before the request completed. "
+                "The user may have logged out in a concurrent request, for example."
+            ) from error
+        response.set_cookie(
+            settings.SESSION_COOKIE_NAME,
+            session.session_key,
+            max_age=max_age,
+            expires=expires,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+            path=settings.SESSION_COOKIE_PATH,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=settings.SESSION_COOKIE_HTTPONLY,
+            samesite=settings.SESSION_COOKIE_SAMESITE,
+        )
+        return response
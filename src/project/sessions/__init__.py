@@ -0,0 +1,11 @@
+"""Session engines of the project, with the async session API of Django 5.
+
+Django 4.2 sessions are sync only, so an async view or middleware that touches the
+session needs a sync_to_async hop per access. These SessionStores add the async
+methods (aload, asave, acreate, adelete, acycle_key, aflush, aget, ahas_key), for
+project.middleware.SessionMiddleware & api_v1_icauth.async_auth.
+
+(-) project.sessions.cached_db: database sessions, behind a per worker LRU cache
+(-) project.sessions.signed_cookies: the session data in a signed cookie, without
+                                     any database access
+"""
@@ -0,0 +1,37 @@
+"""The async session methods that do not depend on the storage"""
+
+from typing import Any
+
+from django.contrib.sessions.backends.base import SessionBase
+
+
+class AsyncSessionMixin(SessionBase):
+    """Adds aget & ahas_key to a SessionStore that implements aload"""
+
+    # The session cache is set outside __init__, as in SessionBase
+    # pylint: disable=attribute-defined-outside-init
+
+    async def aload(self) -> dict[str, Any]:
+        """Async version of load"""
+        raise NotImplementedError
+
+    async def _aget_session(self, no_load: bool = False) -> dict[str, Any]:
+        """Async version of _get_session"""
+        self.accessed = True
+        try:
+            session: dict[str, Any] = self._session_cache  # type: ignore[has-type]
+            return session
+        except AttributeError:
+            if self.session_key is None or no_load:
+                self._session_cache = {}
+            else:
+                self._session_cache = await self.aload()
+        return self._session_cache
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        """Async version of get"""
+        return (await self._aget_session()).get(key, default)
+
+    async def ahas_key(self, key: str) -> bool:
+        """Async version of has_key"""
+        return key in await self._aget_session()
@@ -0,0 +1,308 @@
+"""Database sessions, behind a per worker LRU cache.
+
+Every request with a session cookie loads its session, and the default database
+engine reads it from the database every time. This engine:
+(-) SessionCache: with SESSION_CACHE_TTL, keeps the recently used sessions of the
+                  worker in memory, for that many seconds. A session changed or
+                  deleted by another worker, eg. at logout, is seen within that
+                  time, so the cache is off by default.
+(-) writes through: a changed session is written to the database, and cached
+(-) batches the expire_date updates: a save that only moves the expiry of a cached
+    session, eg. with SESSION_SAVE_EVERY_REQUEST, is queued. The queued sessions
+    are updated in one statement every SESSION_TOUCH_INTERVAL seconds.
+
+A new session key is not checked with an exists() query first. The insert of the
+new session fails on the (astronomically unlikely) duplicate key, and is retried.
+"""
+
+import copy
+import datetime
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, UpdateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.exceptions import SuspiciousOperation
+from django.core.signals import setting_changed
+from django.db import DatabaseError, IntegrityError, router
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+from .base import AsyncSessionMixin
+
+# The characters of a session key, as in SessionBase._get_new_session_key
+VALID_KEY_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+class SessionCache:
+    """A bounded LRU cache of session data, by session key.
+
+    Returns a copy of the cached data, so a request can not change the session that
+    other requests get. A ttl of 0 disables the cache, and the batching of the
+    expire_date updates.
+    """
+
+    def __init__(self, ttl: float, maxsize: int, touch_interval: float) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.touch_interval = touch_interval
+        # session_key -> (data, expire_date, expiry time in time.monotonic)
+        self.sessions: OrderedDict[
+            str, tuple[dict[str, Any], datetime.datetime, float]
+        ] = OrderedDict()
+        # session_key -> expire_date, of the sessions touched since the last flush
+        self.touched: dict[str, datetime.datetime] = {}
+        self.flushed_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, session_key: str) -> Optional[dict[str, Any]]:
+        """Returns a copy of the data of an unexpired cached session, or None"""
+        if self.ttl <= 0:
+            return None
+        with self.lock:
+            entry = self.sessions.get(session_key)
+            if (
+                entry is None
+                or entry[2] <= time.monotonic()
+                or entry[1] <= timezone.now()
+            ):
+                self.misses += 1
+                return None
+            self.sessions.move_to_end(session_key)
+            self.hits += 1
+        return copy.deepcopy(entry[0])
+
+    def set(
+        self, session_key: str, data: dict[str, Any], expire_date: datetime.datetime
+    ) -> None:
+        """Adds a session as stored in the database"""
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        entry = (copy.deepcopy(data), expire_date, time.monotonic() + self.ttl)
+        with self.lock:
+            self.sessions[session_key] = entry
+            self.sessions.move_to_end(session_key)
+            while len(self.sessions) > self.maxsize:
+                self.sessions.popitem(last=False)
+
+    def touch(
+        self, session_key: str, data: dict[str, Any], expire_date: datetime.datetime
+    ) -> bool:
+        """Queues the new expire_date of a cached session whose data is unchanged.
+
+        Returns False if the session must be written instead.
+        """
+        if self.ttl <= 0:
+            return False
+        with self.lock:
+            entry = self.sessions.get(session_key)
+            if entry is None or entry[2] <= time.monotonic() or entry[0] != data:
+                return False
+            self.sessions[session_key] = (entry[0], expire_date, entry[2])
+            self.touched[session_key] = expire_date
+        return True
+
+    def take_touched(self, force: bool = False) -> dict[str, datetime.datetime]:
+        """Returns & forgets the queued expire_dates, every touch_interval seconds,
+        or now with force
+        """
+        now = time.monotonic()
+        if not self.touched or (
+            not force and now - self.flushed_at < self.touch_interval
+        ):
+            return {}
+        with self.lock:
+            touched, self.touched = self.touched, {}
+            self.flushed_at = now
+        return touched
+
+    def invalidate(self, session_key: str) -> None:
+        """Drops a session"""
+        with self.lock:
+            self.sessions.pop(session_key, None)
+            self.touched.pop(session_key, None)
+
+    def clear(self) -> None:
+        """Drops all sessions & resets the counters"""
+        with self.lock:
+            self.sessions.clear()
+            self.touched.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+session_cache = SessionCache(
+    settings.SESSION_CACHE_TTL,
+    settings.SESSION_CACHE_SIZE,
+    settings.SESSION_TOUCH_INTERVAL,
+)
+
+
+@receiver(setting_changed)
+def reset_session_cache(*, setting: str, **kwargs: Any) -> None:
+    """Drops the cached sessions when a session cache setting changes (in tests)"""
+    if setting.startswith("SESSION_CACHE_") or setting == "SESSION_TOUCH_INTERVAL":
+        session_cache.clear()
+        session_cache.ttl = settings.SESSION_CACHE_TTL
+        session_cache.maxsize = settings.SESSION_CACHE_SIZE
+        session_cache.touch_interval = settings.SESSION_TOUCH_INTERVAL
+
+
+class SessionStore(AsyncSessionMixin, DBStore):
+    """Database sessions behind the SessionCache, with async methods"""
+
+    # The session cache is set outside __init__, as in SessionBase
+    # pylint: disable=attribute-defined-outside-init
+
+    def _get_new_session_key(self) -> str:
+        # The insert with must_create detects a duplicate key
+        return get_random_string(32, VALID_KEY_CHARS)
+
+    def touched_sessions(self, force: bool = False) -> list[Any]:
+        """Returns the sessions with a queued expire_date, when they are due"""
+        return [
+            self.model(session_key=session_key, expire_date=expire_date)
+            for session_key, expire_date in session_cache.take_touched(force).items()
+        ]
+
+    @classmethod
+    def flush_touched(cls) -> int:
+        """Writes all queued expire_dates now, eg. at the shutdown of the worker.
+
+        Returns the number of updated sessions.
+        """
+        touched = cls().touched_sessions(force=True)
+        if not touched:
+            return 0
+        return int(cls.get_model_class().objects.bulk_update(touched, ["expire_date"]))
+
+    def load(self) -> dict[str, Any]:
+        assert self.session_key is not None
+        data = session_cache.get(self.session_key)
+        if data is not None:
+            return data
+        session = self._get_session_from_db()  # type: ignore[attr-defined]
+        if session is None:
+            return {}
+        data = self.decode(session.session_data)
+        session_cache.set(self.session_key, data, session.expire_date)
+        return data
+
+    def save(self, must_create: bool = False) -> None:
+        if self.session_key is None:
+            self.create()
+            return
+        data = self._get_session(no_load=must_create)  # type: ignore[attr-defined]
+        expire_date = self.get_expiry_date()
+        if not must_create and session_cache.touch(self.session_key, data, expire_date):
+            touched = self.touched_sessions()
+            if touched:
+                self.model.objects.bulk_update(touched, ["expire_date"])
+            return
+        super().save(must_create)
+        session_cache.set(self.session_key, data, expire_date)
+
+    def delete(self, session_key: Optional[str] = None) -> None:
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        session_cache.invalidate(session_key)
+        self.model.objects.filter(session_key=session_key).delete()
+
+    async def aload(self) -> dict[str, Any]:
+        """Async version of load"""
+        assert self.session_key is not None
+        data = session_cache.get(self.session_key)
+        if data is not None:
+            return data
+        try:
+            session = await self.model.objects.aget(
+                session_key=self.session_key, expire_date__gt=timezone.now()
+            )
+        except (self.model.DoesNotExist, SuspiciousOperation) as error:
+            if isinstance(error, SuspiciousOperation):
+                logger = logging.getLogger(
+                    f"django.security.{error.__class__.__name__}"
+                )
+                logger.warning(str(error))
+            self._session_key = None
+            return {}
+        data = self.decode(session.session_data)
+        session_cache.set(self.session_key, data, session.expire_date)
+        return data
+
+    async def acreate(self) -> None:
+        """Async version of create"""
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                await self.asave(must_create=True)
+            except CreateError:
+                continue
+            self.modified = True
+            return
+
+    async def asave(self, must_create: bool = False) -> None:
+        """Async version of save.
+
+        Runs in autocommit, since the async ORM can not use transactions, so the
+        insert or update needs no atomic block of its own.
+        """
+        if self.session_key is None:
+            await self.acreate()
+            return
+        data = await self._aget_session(no_load=must_create)
+        expire_date = self.get_expiry_date()
+        if not must_create and session_cache.touch(self.session_key, data, expire_date):
+            touched = self.touched_sessions()
+            if touched:
+                await self.model.objects.abulk_update(touched, ["expire_date"])
+            return
+
+        obj = self.create_model_instance(data)
+        using = router.db_for_write(self.model, instance=obj)
+        try:
+            await obj.asave(
+                force_insert=must_create, force_update=not must_create, using=using
+            )
+        except IntegrityError as error:
+            if must_create:
+                raise CreateError from error
+            raise
+        except DatabaseError as error:
+            if not must_create:
+                raise UpdateError from error
+            raise
+        session_cache.set(self.session_key, data, expire_date)
+
+    async def adelete(self, session_key: Optional[str] = None) -> None:
+        """Async version of delete"""
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        session_cache.invalidate(session_key)
+        await self.model.objects.filter(session_key=session_key).adelete()
+
+    async def acycle_key(self) -> None:
+        """Async version of cycle_key: moves the data to a new session key"""
+        data = await self._aget_session()
+        key = self.session_key
+        await self.acreate()
+        self._session_cache = data
+        if key:
+            await self.adelete(key)
+
+    async def aflush(self) -> None:
+        """Async version of flush: deletes the session & starts a new one"""
+        self.clear()
+        await self.adelete()
+        self._session_key = None
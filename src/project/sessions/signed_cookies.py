@@ -0,0 +1,47 @@
+"""Sessions stored in a signed cookie, with the async session API.
+
+For sessions that carry little more than the id of the logged in user: loading or
+saving a session never touches the database. The cookie is signed, not encrypted.
+
+There is no server side state, so a logout only deletes the cookie of the browser,
+and a copied cookie stays valid until it expires after SESSION_COOKIE_AGE. The
+django session key changes on every save, so the canister can not map it to the
+session password, which then expires in the canister. For the same reasons, a
+logout everywhere can not end these sessions.
+"""
+
+from typing import Any, Optional
+
+from django.contrib.sessions.backends.signed_cookies import (
+    SessionStore as SignedCookiesStore,
+)
+
+from .base import AsyncSessionMixin
+
+
+class SessionStore(AsyncSessionMixin, SignedCookiesStore):
+    """Signed cookie sessions, with async methods that need no I/O"""
+
+    async def aload(self) -> dict[str, Any]:
+        data: dict[str, Any] = self.load()
+        return data
+
+    async def acreate(self) -> None:
+        """Async version of create"""
+        self.create()
+
+    async def asave(self, must_create: bool = False) -> None:
+        """Async version of save"""
+        self.save(must_create)
+
+    async def adelete(self, session_key: Optional[str] = None) -> None:
+        """Async version of delete"""
+        self.delete(session_key)
+
+    async def acycle_key(self) -> None:
+        """Async version of cycle_key"""
+        self.cycle_key()
+
+    async def aflush(self) -> None:
+        """Async version of flush"""
+        self.flush()
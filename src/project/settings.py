@@ -1,8 +1,9 @@
 """Django settings."""
 
 import os
+import tempfile
 from pathlib import Path
-from typing import Optional, cast
+from typing import Literal, Optional, cast
 from django.core.management.utils import get_random_secret_key
 from pydantic import BaseSettings, PostgresDsn, AnyHttpUrl
 import dj_database_url  # type: ignore
@@ -31,15 +32,109 @@ class SettingsFromEnvironment(BaseSettings):
     DIGITALOCEAN_DOMAIN: Optional[str] = None
 
     SECRET_JWT_KEY: str = get_random_secret_key()
+    # HS256 signs with SECRET_JWT_KEY. EdDSA or ES256 sign with the first key of
+    # JWT_SIGNING_KEYS_ENCODED: base64 encoded pem files of Ed25519 or P-256 keys
     JWT_METHOD: str = "HS256"
+    JWT_SIGNING_KEYS_ENCODED: list[str] = []
+    # Lifetime in seconds of the JWT access tokens, and of the refresh tokens
+    JWT_ACCESS_TOKEN_AGE: int = 15 * 60
+    JWT_REFRESH_TOKEN_AGE: int = 8 * 60 * 60
+    # Seconds before a revoked JWT is refused by all workers, and the number of
+    # revoked JWTs per worker the Bloom filter is sized for
+    JWT_REVOCATION_SYNC_INTERVAL: float = 2.0
+    JWT_REVOCATION_CAPACITY: int = 100_000
+    # Seconds that the public keys at /.well-known/jwks.json may be cached
+    JWT_JWKS_MAX_AGE: int = 3600
+    # Verified JWTs kept in memory, per worker process
+    JWT_CACHE_SIZE: int = 10_000
     IC_IDENTITY_PEM_ENCODED: str = ""
     # https://github.com/rocklabs-io/ic-py/issues/25
     IC_NETWORK_URL: AnyHttpUrl = cast(AnyHttpUrl, "http://localhost:8000")
+    # Connection pool of the asyncio canister client (per worker process)
+    IC_HTTP_POOL_SIZE: int = 100
+    IC_HTTP_KEEPALIVE_TIMEOUT: float = 30.0
+    # Connections of the pool opened at the startup of a worker (0 for none)
+    IC_HTTP_WARMUP_CONNECTIONS: int = 4
 
     CANISTER_MOTOKO_ID: str = "rno2w-sqaaa-aaaaa-aaacq-cai"
+    # The canisters the principals are sharded over, by consistent hashing, eg.
+    # CANISTER_MOTOKO_IDS='["id-1", "id-2"]'. [] for CANISTER_MOTOKO_ID alone.
+    # After a change, run: make rebalance-canisters PREVIOUS_IDS=id-1,id-2
+    CANISTER_MOTOKO_IDS: list[str] = []
+    # Directory of the parsed candid interfaces, read by the workers instead of
+    # parsing the .did files at startup ("" to parse every time). The files are
+    # signed with SECRET_KEY, so the cache is only used with a SECRET_KEY set.
+    CANDID_CACHE_DIR: str = str(Path(tempfile.gettempdir()) / "dapp-0-django-candid")
+    # Use api_v1_icauth.transports.InMemoryTransport to run without an IC replica
+    CANISTER_MOTOKO_TRANSPORT: str = "api_v1_icauth.transports.IcTransport"
+    CANISTER_MOTOKO_MEMORY_LATENCY: float = 0.0
+    CANISTER_MOTOKO_MEMORY_ERROR_RATE: float = 0.0
+    # Deadline in seconds of a canister call, overridden per method, eg.
+    # CANISTER_MOTOKO_TIMEOUTS='{"whoami": 2.0}'. 0 for no deadline.
+    CANISTER_MOTOKO_TIMEOUT: float = 10.0
+    CANISTER_MOTOKO_TIMEOUTS: dict[str, float] = {}
+    # Consecutive failed calls that open the circuit breaker (0 to disable), and
+    # the seconds that calls fail fast with 503 before a trial call
+    CANISTER_MOTOKO_BREAKER_THRESHOLD: int = 5
+    CANISTER_MOTOKO_BREAKER_RESET: float = 10.0
+    # Seconds without reply before an idempotent call is sent again (0 to disable)
+    CANISTER_MOTOKO_HEDGE_DELAY: float = 0.0
+    # Call mode of the read-only methods, eg.
+    # CANISTER_MOTOKO_CALL_MODES='{"session_password_check": "query_or_update"}'
+    # (-) update: through consensus, certified. Seconds per call. The default.
+    # (-) query: one replica, uncertified. Tens of milliseconds per call.
+    # (-) query_or_update: uncertified if the query replies ok, else certified
+    # A query needs a query method of the canister.
+    CANISTER_MOTOKO_CALL_MODES: dict[
+        str, Literal["update", "query", "query_or_update"]
+    ] = {}
+
+    # Seconds that the result of a session password check by PrincipalBackend is
+    # shared with identical authentications in other workers, through the database
+    # (optional, 0 to share it only within a worker, while in flight). The login api
+    # needs no check, save_django_session_key checks the session password.
+    LOGIN_CLAIM_TTL: float = 0.0
+    # Seconds that verified session passwords are cached per worker, to skip the
+    # canister on repeat authentications by PrincipalBackend (0 to disable), and
+    # the principals cached at most
+    LOGIN_CACHE_TTL: float = 0.0
+    LOGIN_CACHE_SIZE: int = 10_000
+    # Seconds that user rows are cached per worker (0 to disable), and the users
+    # cached at most. Saving or deleting a user drops it from the cache.
+    USER_CACHE_TTL: float = 60.0
+    USER_CACHE_SIZE: int = 10_000
+    # The session engine: project.sessions.cached_db, or the signed cookies of
+    # project.sessions.signed_cookies for sessions without server side state
+    SESSION_ENGINE: str = "project.sessions.cached_db"
+    # Seconds that sessions are cached per worker (optional, 0 to disable), and the
+    # sessions cached at most. Another worker serves a session for up to that time
+    # after its logout, so only enable it where that is acceptable.
+    SESSION_CACHE_TTL: float = 0.0
+    SESSION_CACHE_SIZE: int = 10_000
+    # Seconds between the batched updates of the expiry of unchanged sessions
+    SESSION_TOUCH_INTERVAL: float = 60.0
+    # Expired sessions & their canister session passwords deleted per chunk, the
+    # canister calls in flight, and the seconds between the background cleanups of
+    # every worker (0 to disable, run the purge_expired_sessions command instead)
+    SESSION_CLEANUP_BATCH_SIZE: int = 1000
+    SESSION_CLEANUP_CONCURRENCY: int = 20
+    SESSION_CLEANUP_INTERVAL: float = 0.0
 
     CORS_ALLOWED_ORIGINS: list[str] = []
 
+    # Metrics of all gunicorn workers are combined through snapshot files in this
+    # directory, eg. /dev/shm/dapp-0-django-metrics. Not set: metrics per process.
+    METRICS_DIR: Optional[str] = None
+    METRICS_FLUSH_INTERVAL: float = 5.0
+
+    # Logging: the level of the root logger & of specific loggers, eg.
+    # LOG_LEVELS='{"api_v1_icauth": "DEBUG"}', JSON lines instead of text, and the
+    # records per second of every message up to WARNING (0 for no sampling)
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: dict[str, str] = {}
+    LOG_JSON: bool = False
+    LOG_SAMPLING_RATE: float = 10.0
+
     class Config:  # pylint: disable=too-few-public-methods
         """Defines configuration for pydantic environment loading"""
 
@@ -68,15 +163,53 @@ if config.DIGITALOCEAN_DOMAIN is not None:
 
 SECRET_JWT_KEY = config.SECRET_JWT_KEY
 JWT_METHOD = config.JWT_METHOD
+JWT_SIGNING_KEYS_ENCODED = config.JWT_SIGNING_KEYS_ENCODED
+JWT_ACCESS_TOKEN_AGE = config.JWT_ACCESS_TOKEN_AGE
+JWT_REFRESH_TOKEN_AGE = config.JWT_REFRESH_TOKEN_AGE
+JWT_REVOCATION_SYNC_INTERVAL = config.JWT_REVOCATION_SYNC_INTERVAL
+JWT_REVOCATION_CAPACITY = config.JWT_REVOCATION_CAPACITY
+JWT_JWKS_MAX_AGE = config.JWT_JWKS_MAX_AGE
+JWT_CACHE_SIZE = config.JWT_CACHE_SIZE
 IC_IDENTITY_PEM_ENCODED = config.IC_IDENTITY_PEM_ENCODED
 IC_NETWORK_URL = config.IC_NETWORK_URL
+IC_HTTP_POOL_SIZE = config.IC_HTTP_POOL_SIZE
+IC_HTTP_KEEPALIVE_TIMEOUT = config.IC_HTTP_KEEPALIVE_TIMEOUT
+IC_HTTP_WARMUP_CONNECTIONS = config.IC_HTTP_WARMUP_CONNECTIONS
 CANISTER_MOTOKO_ID = config.CANISTER_MOTOKO_ID
+CANISTER_MOTOKO_IDS = config.CANISTER_MOTOKO_IDS
+# Every process has a random SECRET_KEY of its own by default, that would invalidate
+# the cache of the others & of the previous start
+CANDID_CACHE_DIR = (
+    config.CANDID_CACHE_DIR if "SECRET_KEY" in config.__fields_set__ else ""
+)
+CANISTER_MOTOKO_TRANSPORT = config.CANISTER_MOTOKO_TRANSPORT
+CANISTER_MOTOKO_MEMORY_LATENCY = config.CANISTER_MOTOKO_MEMORY_LATENCY
+CANISTER_MOTOKO_MEMORY_ERROR_RATE = config.CANISTER_MOTOKO_MEMORY_ERROR_RATE
+CANISTER_MOTOKO_TIMEOUT = config.CANISTER_MOTOKO_TIMEOUT
+CANISTER_MOTOKO_TIMEOUTS = config.CANISTER_MOTOKO_TIMEOUTS
+CANISTER_MOTOKO_BREAKER_THRESHOLD = config.CANISTER_MOTOKO_BREAKER_THRESHOLD
+CANISTER_MOTOKO_BREAKER_RESET = config.CANISTER_MOTOKO_BREAKER_RESET
+CANISTER_MOTOKO_HEDGE_DELAY = config.CANISTER_MOTOKO_HEDGE_DELAY
+CANISTER_MOTOKO_CALL_MODES = config.CANISTER_MOTOKO_CALL_MODES
+LOGIN_CLAIM_TTL = config.LOGIN_CLAIM_TTL
+LOGIN_CACHE_TTL = config.LOGIN_CACHE_TTL
+LOGIN_CACHE_SIZE = config.LOGIN_CACHE_SIZE
+USER_CACHE_TTL = config.USER_CACHE_TTL
+USER_CACHE_SIZE = config.USER_CACHE_SIZE
+SESSION_CACHE_TTL = config.SESSION_CACHE_TTL
+SESSION_CACHE_SIZE = config.SESSION_CACHE_SIZE
+SESSION_TOUCH_INTERVAL = config.SESSION_TOUCH_INTERVAL
+SESSION_CLEANUP_BATCH_SIZE = config.SESSION_CLEANUP_BATCH_SIZE
+SESSION_CLEANUP_CONCURRENCY = config.SESSION_CLEANUP_CONCURRENCY
+SESSION_CLEANUP_INTERVAL = config.SESSION_CLEANUP_INTERVAL
 
 # ######################################################################
 # https://www.stackhawk.com/blog/django-cors-guide/
 
 CORS_ALLOWED_ORIGINS = config.CORS_ALLOWED_ORIGINS
-print(f"CORS_ALLOWED_ORIGINS: {CORS_ALLOWED_ORIGINS}")
+
+METRICS_DIR = config.METRICS_DIR
+METRICS_FLUSH_INTERVAL = config.METRICS_FLUSH_INTERVAL
 
 CORS_ALLOW_METHODS = [
     "DELETE",
@@ -126,13 +259,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "project.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "project.middleware.AsyncWhiteNoiseMiddleware",
+    "project.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api_v1_icauth.middleware.JWTAuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -167,6 +302,7 @@ AUTHENTICATION_BACKENDS = (
 
 # Define session behavior (Django login/logout cookie sessions)
 # https://docs.djangoproject.com/en/4.0/topics/http/sessions/#topics-http-sessions
+SESSION_ENGINE = config.SESSION_ENGINE
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_COOKIE_AGE = 8 * 60 * 60
 
@@ -299,3 +435,40 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Logging
+# https://docs.djangoproject.com/en/4.0/topics/logging/
+#
+# All records go through a queue to a background thread, which writes them to stdout.
+# The "django" logger propagates to the root logger, instead of its own handlers.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "structured": {
+            "()": "project.log.StructuredFormatter",
+            "json_lines": config.LOG_JSON,
+        },
+    },
+    "filters": {
+        "sampling": {
+            "()": "project.log.SamplingFilter",
+            "rate": config.LOG_SAMPLING_RATE,
+        },
+    },
+    "handlers": {
+        "queue": {
+            "()": "project.log.QueueStreamHandler",
+            "formatter": "structured",
+            "filters": ["sampling"],
+        },
+    },
+    "root": {"handlers": ["queue"], "level": config.LOG_LEVEL},
+    "loggers": {
+        "django": {"handlers": [], "level": config.LOG_LEVEL, "propagate": True},
+        # The access log of the IC stand-in
+        "aiohttp.access": {"level": "WARNING"},
+        **{name: {"level": level} for name, level in config.LOG_LEVELS.items()},
+    },
+}
@@ -19,6 +19,8 @@ from django.urls import include, path
 from django.contrib.staticfiles.storage import staticfiles_storage
 from django.views.generic.base import RedirectView
 
+from . import views
+
 # https://staticfiles.productiondjango.com/blog/failproof-favicons/
 path_favicon = path(
     "favicon.ico",
@@ -30,5 +32,7 @@ path_favicon = path(
 urlpatterns = [
     path("", include("api_v1_icauth.urls")),
     path("admin/", admin.site.urls),
+    path("metrics", views.metrics, name="metrics"),
+    path("ready", views.ready, name="ready"),
     path_favicon,
 ]
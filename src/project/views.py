@@ -0,0 +1,24 @@
+"""Project wide views"""
+
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+
+from .lifespan import readiness
+from .metrics import registry
+
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Returns the metrics of all workers, in the Prometheus text format"""
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@require_GET
+def ready(request: HttpRequest) -> HttpResponse:
+    """Returns 200 once this worker has warmed up, and 503 while it starts or stops"""
+    return JsonResponse(
+        {"status": readiness.status}, status=200 if readiness.is_ready() else 503
+    )
@@ -1,29 +1,427 @@
 #!/usr/bin/env python
-"""Runs Django under ASGI with uvicorn, with reloading when in Wing Pro.
+"""Runs Django under ASGI with uvicorn workers, for production, or with reloading
+when in Wing Pro (or with --reload).
 
 https://www.uvicorn.org/deployment/#running-programmatically
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/uvicorn/
+
+In production, a master process forks --workers uvicorn workers (WEB_CONCURRENCY, or
+the number of CPUs by default), and restarts the ones that die:
+(-) --loop, --http: uvloop & httptools when installed (auto), or asyncio & h11
+(-) --preload: the master imports the application before it forks, and freezes the
+    garbage collector, so the workers share the memory pages of the imported code
+    (copy-on-write) and start faster. The master opens no connections: that is
+    done at the lifespan startup of every worker. Its threads, of the logs & the
+    metrics, are started again in every worker.
+(-) --reuse-port: every worker listens on its own SO_REUSEPORT socket, so the
+    kernel spreads the connections evenly over the workers. Without it, the
+    workers accept from one socket of the master.
+(-) --backlog, --keep-alive: the listen queue, and the seconds an idle keep-alive
+    connection is kept open. Put --keep-alive above the idle timeout of the load
+    balancer, so it does not reuse a connection that the worker closes.
+
+SIGHUP reloads the workers without downtime: the master starts new workers, waits
+until they are warm (lifespan startup complete), then stops the old workers
+gracefully. Their requests in flight get --graceful-timeout seconds to finish. If a
+new worker fails to start, the old workers are kept. With --preload, the new
+workers run the code imported by the master: restart the master to deploy new
+code. With --reuse-port, the connections still in the accept queue of an old worker
+when it closes its socket are reset by the kernel: drop --reuse-port where a reload
+must not lose a single connection.
+
+SIGTERM or SIGINT stops the workers gracefully, then the master.
 """
+import argparse
+import gc
+import importlib.util
+import logging
 import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Any, Optional
+
 import uvicorn  # type: ignore[import]
 
 DJANGO_PORT = int(os.environ.get("DJANGO_PORT", 8001))
+APPLICATION = "project.asgi:application"
+
+# Seconds between two checks of the master for signals & dead workers
+MASTER_TICK = 0.25
+# Seconds before the master starts a worker again, after a worker failed to start
+RESTART_DELAY = 1.0
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class WorkerServer(uvicorn.Server):
+    """A uvicorn server that tells the master when it is warm & serving"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int) -> None:
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: Optional[list[socket.socket]] = None) -> None:
+        await super().startup(sockets)
+        # Not when stopped during the startup: the master then sees the pipe closed
+        # without a message, at the exit of the worker
+        if self.started and not self.should_exit:
+            try:
+                os.write(self.ready_fd, b"r")
+            except BrokenPipeError:
+                # The master stopped waiting, and is stopping this worker
+                pass
+        os.close(self.ready_fd)
+
+
+def create_socket(args: argparse.Namespace) -> socket.socket:
+    """Returns a bound socket on args.host & args.port, with SO_REUSEPORT if set"""
+    family = socket.AF_INET6 if ":" in args.host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if args.reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((args.host, args.port))
+    return sock
+
+
+def resolve(choice: str, fast: str, fallback: str) -> str:
+    """Returns the implementation that uvicorn selects for an auto choice"""
+    if choice != "auto":
+        return choice
+    return fast if importlib.util.find_spec(fast) is not None else fallback
+
+
+def exit_worker(signum: int, frame: Any) -> None:  # pylint: disable=unused-argument
+    """Exits a worker that does not serve, with its logs written"""
+    sys.exit(0)
+
+
+class Master:
+    """Forks, watches & reloads the uvicorn workers.
+
+    The master never blocks on a worker. Every tick of its loop, it waits up to
+    MASTER_TICK seconds for the ready pipes of the starting workers, then handles
+    the signals, collects the exited workers, and starts the missing ones.
+    """
+
+    def __init__(self, args: argparse.Namespace, config: uvicorn.Config) -> None:
+        self.args = args
+        self.config = config
+        # The socket shared by the workers, without --reuse-port
+        self.socket: Optional[socket.socket] = None
+        # The pids of the workers that serve
+        self.workers: set[int] = set()
+        # pid -> (ready fd, deadline in time.monotonic), of the starting workers
+        self.starting: dict[int, tuple[int, float]] = {}
+        # pid -> deadline in time.monotonic, of the workers that stop gracefully
+        self.retiring: dict[int, float] = {}
+        # The workers that a reload in progress replaces, else None
+        self.replaced: Optional[set[int]] = None
+        # Workers that failed to start, and the time.monotonic of the next start
+        self.start_failures = 0
+        self.restart_after = 0.0
+        self.signals: list[int] = []
+
+    def run(self) -> None:
+        """Starts the workers & watches them until SIGTERM or SIGINT"""
+        if not self.args.reuse_port:
+            self.socket = create_socket(self.args)
+            self.socket.listen(self.args.backlog)
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.on_signal)
+
+        t0 = time.perf_counter()
+        booted = False
+        self.spawn_missing()
+        while True:
+            self.wait_ready(MASTER_TICK)
+            if not booted:
+                if self.start_failures:
+                    logger.error("Workers failed to start, stopping")
+                    self.stop()
+                    sys.exit(1)
+                if len(self.workers) == self.args.workers:
+                    booted = True
+                    logger.info(
+                        "%d workers ready in %.2fs (pid %d, %s)",
+                        len(self.workers),
+                        time.perf_counter() - t0,
+                        os.getpid(),
+                        ", ".join(self.settings()),
+                    )
+            while self.signals:
+                if self.signals.pop(0) != signal.SIGHUP:
+                    self.stop()
+                    return
+                if booted:
+                    self.reload()
+            self.reap()
+            if booted:
+                self.spawn_missing()
+
+    def settings(self) -> list[str]:
+        """The settings of the workers, to log"""
+        return [
+            f"loop={resolve(self.args.loop, 'uvloop', 'asyncio')}",
+            f"http={resolve(self.args.http, 'httptools', 'h11')}",
+            f"preload={self.args.preload}",
+            f"reuse_port={self.args.reuse_port}",
+            f"backlog={self.args.backlog}",
+            f"keep_alive={self.args.keep_alive}s",
+        ]
+
+    def on_signal(
+        self, signum: int, frame: Any  # pylint: disable=unused-argument
+    ) -> None:
+        """Queues a signal, for the loop of the master"""
+        self.signals.append(signum)
+
+    def spawn(self) -> int:
+        """Forks a worker, and returns its pid"""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 0
+            try:
+                self.run_worker(ready_write)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except BaseException:  # pylint: disable=broad-except
+                logger.exception("Worker failed")
+                code = 1
+            finally:
+                # os._exit does not flush the logs
+                logging.shutdown()
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)  # pylint: disable=protected-access
+        os.close(ready_write)
+        self.starting[pid] = (ready_read, time.monotonic() + self.args.ready_timeout)
+        return pid
+
+    def run_worker(self, ready_fd: int) -> None:
+        """Serves until SIGTERM or SIGINT, in a forked worker"""
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        # uvicorn handles them while it serves, and raises them again once stopped
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, exit_worker)
+        # The pipes of the other starting workers
+        for fd, _ in self.starting.values():
+            os.close(fd)
+        sock = self.socket or create_socket(self.args)
+        WorkerServer(self.config, ready_fd).run(sockets=[sock])
+
+    def spawn_missing(self) -> None:
+        """Starts workers until --workers serve or start, unless a start failed
+        less than RESTART_DELAY seconds ago
+        """
+        if time.monotonic() < self.restart_after:
+            return
+        current = self.workers - (self.replaced or set())
+        for _ in range(self.args.workers - len(current) - len(self.starting)):
+            self.spawn()
+
+    def wait_ready(self, timeout: float) -> None:
+        """Waits up to timeout seconds for the ready pipes of the starting workers"""
+        fds = {fd: pid for pid, (fd, _) in self.starting.items()}
+        if not fds:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select(list(fds), [], [], timeout)
+        for fd in readable:
+            pid = fds[fd]
+            if pid not in self.starting:
+                # Its reload was aborted by the failure of another worker
+                continue
+            if os.read(fd, 1) == b"r":
+                os.close(self.starting.pop(pid)[0])
+                self.workers.add(pid)
+            else:
+                self.start_failed(pid, "exited during its startup")
+        now = time.monotonic()
+        for pid, (_, deadline) in list(self.starting.items()):
+            # Unless stopped by the failure of another worker of its reload
+            if deadline < now and pid in self.starting:
+                self.start_failed(pid, f"not ready after {self.args.ready_timeout}s")
+        if self.replaced is not None and not self.starting:
+            self.complete_reload()
+
+    def start_failed(self, pid: int, reason: str, exited: bool = False) -> None:
+        """Stops a worker that failed to start, and aborts the reload, if any"""
+        os.close(self.starting.pop(pid)[0])
+        logger.error("Worker %d %s", pid, reason)
+        self.start_failures += 1
+        self.restart_after = time.monotonic() + RESTART_DELAY
+        if not exited:
+            self.retire(pid)
+        if self.replaced is not None:
+            logger.error("New workers failed to start, keeping the old workers")
+            for new_pid in list(self.starting):
+                os.close(self.starting.pop(new_pid)[0])
+                self.retire(new_pid)
+            for new_pid in self.workers - self.replaced:
+                self.retire(new_pid)
+            self.replaced = None
+
+    def retire(self, pid: int) -> None:
+        """Stops a worker gracefully"""
+        self.workers.discard(pid)
+        self.retiring[pid] = time.monotonic() + self.args.graceful_timeout + 5
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reload(self) -> None:
+        """Starts new workers, that replace the old ones once they are all ready"""
+        if self.replaced is not None or self.starting:
+            logger.warning("Workers are starting, reload ignored")
+            return
+        logger.info("Reloading %d workers", len(self.workers))
+        self.replaced = set(self.workers)
+        for _ in range(self.args.workers):
+            self.spawn()
+
+    def complete_reload(self) -> None:
+        """Stops the workers replaced by a reload, once the new ones are ready"""
+        old = self.workers & (self.replaced or set())
+        for pid in old:
+            self.retire(pid)
+        self.replaced = None
+        logger.info("Reloaded, %d old workers stopping", len(old))
+
+    def reap(self) -> None:
+        """Collects the exited workers, and kills the retiring workers that are past
+        their deadline. The workers that died are started again by spawn_missing.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            if pid in self.starting:
+                self.start_failed(pid, "exited during its startup", exited=True)
+            elif pid in self.workers:
+                self.workers.discard(pid)
+                if self.replaced is not None:
+                    self.replaced.discard(pid)
+                logger.error(
+                    "Worker %d died (exit status %d), restarting",
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+        now = time.monotonic()
+        for pid, deadline in list(self.retiring.items()):
+            if deadline < now:
+                logger.warning("Worker %d did not stop in time, killing it", pid)
+                self.retiring[pid] = now + self.args.graceful_timeout
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self) -> None:
+        """Stops all workers gracefully, and waits for them"""
+        logger.info("Stopping %d workers", len(self.workers) + len(self.starting))
+        for pid in list(self.starting):
+            os.close(self.starting.pop(pid)[0])
+            self.retire(pid)
+        for pid in list(self.workers):
+            self.retire(pid)
+        while self.retiring:
+            self.reap()
+            time.sleep(MASTER_TICK)
+
+
+def parse_args() -> argparse.Namespace:
+    """Command line arguments, with defaults from environment variables"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--host", default=os.environ.get("DJANGO_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=DJANGO_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        help="Worker processes (default: WEB_CONCURRENCY, or the number of CPUs)",
+    )
+    parser.add_argument("--loop", choices=["auto", "asyncio", "uvloop"], default="auto")
+    parser.add_argument("--http", choices=["auto", "h11", "httptools"], default="auto")
+    parser.add_argument(
+        "--preload", action="store_true", help="Import the application before forking"
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action=argparse.BooleanOptionalAction,
+        default=hasattr(socket, "SO_REUSEPORT"),
+        help="A SO_REUSEPORT socket per worker (default where supported)",
+    )
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument(
+        "--keep-alive", type=int, default=5, help="Seconds to keep idle connections"
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=30,
+        help="Seconds for the requests in flight at the stop of a worker",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=60.0,
+        help="Seconds for a new worker to be ready",
+    )
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        default="WINGDB_ACTIVE" in os.environ,
+        help="Development: one process, reloaded when the code changes",
+    )
+    return parser.parse_args()
 
 
 def main() -> None:
     """Run uvicorn programmatically"""
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+    args = parse_args()
 
-    reload = False
-    if "WINGDB_ACTIVE" in os.environ:
-        reload = True
+    if args.reload:
+        uvicorn.run(
+            APPLICATION,
+            host=args.host,
+            port=args.port,
+            reload=True,
+            lifespan="on",
+        )
+        return
 
-    uvicorn.run(
-        "project.asgi:application",
-        port=DJANGO_PORT,
-        reload=reload,
-        lifespan="off",
+    config = uvicorn.Config(
+        APPLICATION,
+        loop=args.loop,
+        http=args.http,
+        lifespan="on",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        access_log=args.access_log,
     )
+    if args.preload:
+        # Imports the application
+        config.load()
+        # Objects of the master are not tracked by the garbage collector of the
+        # workers, whose collections would write to (& copy) their memory pages
+        gc.collect()
+        gc.freeze()
+    Master(args, config).run()
 
 
 if __name__ == "__main__":